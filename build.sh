@@ -11,4 +11,7 @@ python manage.py collectstatic --noinput --clear
 echo "=== Application des migrations ==="
 python manage.py migrate --noinput
 
+echo "=== Création de la table de cache ==="
+python manage.py createcachetable
+
 echo "=== Build terminé ==="
\ No newline at end of file
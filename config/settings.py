@@ -65,8 +65,16 @@ INSTALLED_APPS = [
 ]
 
 # ==================== STORAGE CONFIGURATION ====================
-# Cloudinary pour les fichiers média (images uploadées)
-DEFAULT_FILE_STORAGE = 'cloudinary_storage.storage.MediaCloudinaryStorage'
+# Fichiers média (images uploadées) : 'cloudinary' en production, 'local'
+# (FileSystemStorage dans MEDIA_ROOT) pour développer et tester sans Cloudinary
+MEDIA_STORAGE = config('MEDIA_STORAGE', default='cloudinary')
+DEFAULT_FILE_STORAGE = {
+    'cloudinary': 'cloudinary_storage.storage.MediaCloudinaryStorage',
+    'local': 'django.core.files.storage.FileSystemStorage',
+}[MEDIA_STORAGE]
+
+# Largeurs (px) des déclinaisons WebP/JPEG générées pour Formation.image
+IMAGE_LARGEURS = [int(l) for l in config('IMAGE_LARGEURS', default='320,640,960').split(',')]
 
 # WhiteNoise pour les fichiers statiques (CSS, JS)
 STATIC_URL = '/static/'
@@ -80,8 +88,10 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 # ==================== MIDDLEWARE ====================
 MIDDLEWARE = [
+    'formation.middleware.CorrelationIdMiddleware',
+    'formation.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'formation.middleware.WhiteNoiseMiddleware',  # WhiteNoise compatible ASGI
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -90,8 +100,23 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Instrumentation (formation.middleware.PerformanceMiddleware)
+PERF_SEUIL_LENT = config('PERF_SEUIL_LENT', default=1.0, cast=float)  # secondes
+PERF_SEUIL_N_PLUS_UN = config('PERF_SEUIL_N_PLUS_UN', default=5, cast=int)
+# Jeton Bearer attendu par /metrics (sinon réservé aux membres du staff)
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
 ROOT_URLCONF = 'config.urls'
 WSGI_APPLICATION = 'config.wsgi.application'
+# Déploiement ASGI (gunicorn config.asgi:application -k uvicorn.workers.UvicornWorker) :
+# checkout, callback et webhook Moneroo sont alors servis par les vues async
+# de formation/views.py, sans bloquer de worker pendant l'appel à Moneroo
+SERVEUR_ASGI = config('SERVEUR_ASGI', default=False, cast=bool)
+if SERVEUR_ASGI:
+    # Pas de connexions persistantes sous ASGI : chaque requête a son propre
+    # contexte de thread, et les connexions gardées ouvertes s'accumulent
+    # jusqu'à épuiser celles de PostgreSQL (recommandation de Django)
+    DATABASES['default']['CONN_MAX_AGE'] = 0
 
 # ==================== TEMPLATES ====================
 TEMPLATES = [
@@ -119,6 +144,114 @@ MONEROO_MERCHANT_ID = config('MONEROO_MERCHANT_ID')
 MONEROO_WEBHOOK_SECRET = config('MONEROO_WEBHOOK_SECRET', default='')
 SITE_URL = config('SITE_URL', default='http://localhost:8000')
 
+# Client HTTP Moneroo (formation/moneroo.py)
+MONEROO_API_URL = config('MONEROO_API_URL', default='https://api.moneroo.io/v1')
+MONEROO_CONNECT_TIMEOUT = config('MONEROO_CONNECT_TIMEOUT', default=3.05, cast=float)
+MONEROO_READ_TIMEOUT = config('MONEROO_READ_TIMEOUT', default=15, cast=float)
+MONEROO_POOL_MAXSIZE = config('MONEROO_POOL_MAXSIZE', default=10, cast=int)
+MONEROO_RETRIES = config('MONEROO_RETRIES', default=2, cast=int)
+MONEROO_CIRCUIT_SEUIL = config('MONEROO_CIRCUIT_SEUIL', default=5, cast=int)
+MONEROO_CIRCUIT_DELAI = config('MONEROO_CIRCUIT_DELAI', default=30, cast=int)  # secondes
+# Connexions simultanées du client asynchrone (mode ASGI) ; les requêtes
+# au-delà attendent une connexion libre dans le pool
+MONEROO_ASYNC_MAX_CONNEXIONS = config('MONEROO_ASYNC_MAX_CONNEXIONS', default=100, cast=int)
+
+# Checkout : une nouvelle soumission du même panier par le même client dans
+# cette fenêtre (secondes) reprend le paiement Moneroo déjà initialisé. S'il
+# est encore en cours, la vue async attend au plus CHECKOUT_ATTENTE_REPRISE
+# secondes ; la vue synchrone affiche aussitôt une page qui se recharge
+CHECKOUT_FENETRE_REPRISE = config('CHECKOUT_FENETRE_REPRISE', default=900, cast=int)
+CHECKOUT_ATTENTE_REPRISE = config('CHECKOUT_ATTENTE_REPRISE', default=15, cast=float)
+
+# Vérification des paiements (formation/verification.py) : statut mis en
+# cache par transaction, longtemps s'il est définitif (payé, échoué),
+# brièvement s'il peut encore changer (en attente)
+PAIEMENT_CACHE_TIMEOUT = config('PAIEMENT_CACHE_TIMEOUT', default=10, cast=int)
+PAIEMENT_CACHE_TIMEOUT_FINAL = config('PAIEMENT_CACHE_TIMEOUT_FINAL', default=600, cast=int)
+# Délai de lecture des appels de vérification (plus court que
+# MONEROO_READ_TIMEOUT : le callback attend la réponse, le webhook est
+# rejoué), et attente maximale du résultat vérifié par un autre worker
+PAIEMENT_VERIFICATION_TIMEOUT = config('PAIEMENT_VERIFICATION_TIMEOUT', default=5, cast=float)
+PAIEMENT_VERIFICATION_ATTENTE = config('PAIEMENT_VERIFICATION_ATTENTE', default=3, cast=float)
+
+# Commandes abandonnées : passées à "expirée" par expirer_commandes après
+# ce délai (secondes) en attente ; bien au-delà de CHECKOUT_FENETRE_REPRISE
+# et de l'âge vérifié par reconcile_payments. Un paiement tardif reste accepté
+COMMANDE_DUREE_ATTENTE = config('COMMANDE_DUREE_ATTENTE', default=86400, cast=int)
+
+# Exports CSV/JSONL (formation/export.py) : lignes lues par paquets de cette
+# taille (curseur serveur sous PostgreSQL), mémoire constante
+EXPORT_TAILLE_LOT = config('EXPORT_TAILLE_LOT', default=2000, cast=int)
+
+# Webhooks Moneroo : enregistrés par la vue, appliqués par le worker
+# traiter_webhooks (formation/webhooks.py)
+WEBHOOK_TAILLE_LOT = config('WEBHOOK_TAILLE_LOT', default=100, cast=int)
+# Nouvel essai après WEBHOOK_DELAI_BASE × 2^n secondes, plafonné à
+# WEBHOOK_DELAI_MAX : 12 tentatives couvrent une indisponibilité de Moneroo
+# d'environ 3 h avant qu'un webhook ne passe en erreur
+WEBHOOK_MAX_TENTATIVES = config('WEBHOOK_MAX_TENTATIVES', default=12, cast=int)
+WEBHOOK_DELAI_BASE = config('WEBHOOK_DELAI_BASE', default=10, cast=int)  # secondes
+WEBHOOK_DELAI_MAX = config('WEBHOOK_DELAI_MAX', default=3600, cast=int)  # secondes
+# Webhooks traités (corps compris) conservés N jours, puis purgés par le worker
+WEBHOOK_RETENTION_JOURS = config('WEBHOOK_RETENTION_JOURS', default=30, cast=int)
+
+# ==================== CACHE ====================
+# Backend partagé : 'locmem' (un cache par worker gunicorn), 'file' ou 'db'.
+# Avec plusieurs workers (WEB_CONCURRENCY), utiliser 'file' ou 'db' pour que
+# l'invalidation du catalogue soit vue par tous les workers.
+CACHE_BACKEND = config('CACHE_BACKEND', default='locmem')
+
+if CACHE_BACKEND == 'db':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'formation_cache',
+        }
+    }
+elif CACHE_BACKEND == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': config('CACHE_LOCATION', default=str(BASE_DIR / '.cache')),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'formation',
+        }
+    }
+
+# Durée de vie (secondes) des entrées du catalogue ; la version les invalide avant
+CATALOGUE_CACHE_TIMEOUT = config('CATALOGUE_CACHE_TIMEOUT', default=3600, cast=int)
+
+# Recherche : seul le résultat d'une requête vue RECHERCHE_CACHE_SEUIL fois en
+# RECHERCHE_CACHE_FENETRE secondes est mis en cache (les requêtes rares ne
+# remplissent pas le cache)
+RECHERCHE_CACHE_SEUIL = config('RECHERCHE_CACHE_SEUIL', default=2, cast=int)
+RECHERCHE_CACHE_FENETRE = config('RECHERCHE_CACHE_FENETRE', default=600, cast=int)
+
+# ==================== SESSIONS ====================
+# Moteur de session : seuls les visiteurs qui modifient leur panier (ou
+# reçoivent un message trop long pour le cookie) en créent une ; la simple
+# navigation n'écrit jamais. Choix :
+#   'db'             une ligne django_session par visiteur avec panier
+#   'cached_db'      lectures servies par le cache, écritures en base ; à
+#                    réserver à un CACHE_BACKEND partagé ('file') sinon un
+#                    worker peut relire un panier périmé
+#   'file'           un fichier par session (SESSION_FILE_PATH), aucune écriture SQL
+#   'signed_cookies' panier dans un cookie signé (il ne contient que des ids),
+#                    aucune écriture serveur ; pas de révocation côté serveur
+SESSION_BACKEND = config('SESSION_BACKEND', default='db')
+SESSION_ENGINE = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'file': 'django.contrib.sessions.backends.file',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}[SESSION_BACKEND]
+SESSION_FILE_PATH = config('SESSION_FILE_PATH', default=None)
+
 # ==================== EMAIL ====================
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = 'smtp.gmail.com'
@@ -128,6 +261,17 @@ EMAIL_HOST_USER = config('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD')
 DEFAULT_FROM_EMAIL = config('EMAIL_HOST_USER')
 
+# File d'attente des emails d'accès (commande envoyer_emails)
+EMAIL_OUTBOX_TAILLE_LOT = config('EMAIL_OUTBOX_TAILLE_LOT', default=20, cast=int)
+EMAIL_OUTBOX_MAX_TENTATIVES = config('EMAIL_OUTBOX_MAX_TENTATIVES', default=6, cast=int)
+EMAIL_OUTBOX_DELAI_BASE = config('EMAIL_OUTBOX_DELAI_BASE', default=30, cast=int)  # secondes
+# Débit maximal d'envoi (emails/seconde, 0 = illimité) pour rester sous les quotas SMTP
+EMAIL_OUTBOX_DEBIT = config('EMAIL_OUTBOX_DEBIT', default=0, cast=float)
+
+# Durée de vie (secondes) des blocs par formation de l'email d'accès ;
+# leur clé inclut date_modification, une modification les invalide avant
+EMAIL_FRAGMENT_CACHE_TIMEOUT = config('EMAIL_FRAGMENT_CACHE_TIMEOUT', default=86400, cast=int)
+
 # ==================== WHATSAPP ====================
 ADMIN_WHATSAPP = config('ADMIN_WHATSAPP', default='+242061814279')
 
@@ -152,30 +296,46 @@ USE_TZ = True
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # ==================== LOGGING ====================
+# LOG_FORMAT : 'json' (une ligne JSON par événement) ou 'texte'
+# LOG_LEVEL  : niveau du logger 'formation' ; DEBUG active le détail des payloads
+# LOG_ASYNC  : écriture sur stdout depuis un thread dédié (QueueListener)
+LOG_FORMAT = config('LOG_FORMAT', default='json')
+LOG_LEVEL = config('LOG_LEVEL', default='DEBUG' if DEBUG else 'INFO')
+LOG_ASYNC = config('LOG_ASYNC', default=True, cast=bool)
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
+    'filters': {
+        'correlation': {
+            '()': 'formation.logs.CorrelationFilter',
+        },
+    },
     'formatters': {
         'verbose': {
-            'format': '{levelname} {asctime} {module} {message}',
+            'format': '{levelname} {asctime} {module} [{request_id}] {message}',
             'style': '{',
         },
+        'json': {
+            '()': 'formation.logs.JsonFormatter',
+        },
     },
     'handlers': {
         'console': {
-            'class': 'logging.StreamHandler',
-            'formatter': 'verbose',
+            'class': 'formation.logs.QueueStreamHandler' if LOG_ASYNC else 'logging.StreamHandler',
+            'formatter': 'json' if LOG_FORMAT == 'json' else 'verbose',
+            'filters': ['correlation'],
         },
     },
     'loggers': {
         'django': {
             'handlers': ['console'],
-            'level': 'INFO' if not DEBUG else 'DEBUG',
+            'level': 'INFO',
             'propagate': True,
         },
         'formation': {
             'handlers': ['console'],
-            'level': 'DEBUG',
+            'level': LOG_LEVEL,
             'propagate': False,
         },
     },
@@ -1,6 +1,9 @@
 from django.contrib import admin
 from django.utils.html import format_html
+from .export import reponse_export
 from .models import Formation, Client, Commande
+from .outbox import commandes_a_renvoyer, mettre_en_file_renvoi
+from .recherche import rechercher_ids
 
 
 @admin.register(Formation)
@@ -11,6 +14,26 @@ class FormationAdmin(admin.ModelAdmin):
     list_editable = ['active']
     readonly_fields = ['date_creation', 'date_modification']
 
+    def get_search_results(self, request, queryset, search_term):
+        # Recherche habituelle de l'admin (sous-chaînes) complétée par l'index
+        # plein texte (racines, pertinence), qui trouve ce que icontains rate
+        resultats, doublons = super().get_search_results(request, queryset, search_term)
+        if not search_term:
+            return resultats, doublons
+        return resultats | queryset.filter(id__in=rechercher_ids(search_term, actives=False)), doublons
+
+    actions = ['renvoyer_acces']
+
+    def renvoyer_acces(self, request, queryset):
+        crees = mettre_en_file_renvoi(commandes_a_renvoyer(queryset.values('id')))
+        self.message_user(
+            request,
+            f"{len(crees)} renvoi(s) des accès mis en file pour les acheteurs. "
+            f"Suivi dans « Envois d'emails » (motif : renvoi)."
+        )
+
+    renvoyer_acces.short_description = "Renvoyer les accès à tous les acheteurs"
+
     fieldsets = (
         ('Informations principales', {
             'fields': ('titre', 'description', 'prix', 'image', 'active')
@@ -32,10 +55,35 @@ class ClientAdmin(admin.ModelAdmin):
     readonly_fields = ['date_inscription']
     list_filter = ['date_inscription']
 
+    actions = ['exporter_csv', 'exporter_jsonl']
+
+    def exporter_csv(self, request, queryset):
+        return reponse_export('clients', 'csv', queryset)
+
+    exporter_csv.short_description = "Exporter en CSV (commandes et total réglé)"
+
+    def exporter_jsonl(self, request, queryset):
+        return reponse_export('clients', 'jsonl', queryset)
+
+    exporter_jsonl.short_description = "Exporter en JSONL (commandes et total réglé)"
+
 
 from django.contrib import admin
+from django.db.models import prefetch_related_objects
 from django.utils.html import format_html
-from .models import Commande
+from django.utils import timezone
+from .models import Commande, EnvoiEmail, HistoriqueStatut, WebhookEvent, WebhookRecu
+
+
+class HistoriqueStatutInline(admin.TabularInline):
+    model = HistoriqueStatut
+    fields = ('date', 'ancien_statut', 'nouveau_statut', 'origine')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
 
 
 @admin.register(Commande)
@@ -47,6 +95,7 @@ class CommandeAdmin(admin.ModelAdmin):
         'statut_badge',
         'date_commande',
     )
+    list_select_related = ('client',)
 
     list_filter = (
         'statut',
@@ -60,11 +109,14 @@ class CommandeAdmin(admin.ModelAdmin):
         'moneroo_transaction_id',
     )
 
+    # Le statut ne change que par transitions (actions, webhook, callback)
     readonly_fields = (
+        'statut',
         'date_commande',
         'date_paiement',
         'date_acces_envoye',
     )
+    inlines = [HistoriqueStatutInline]
 
     fieldsets = (
         ('Informations client', {
@@ -98,6 +150,7 @@ class CommandeAdmin(admin.ModelAdmin):
             'en_attente': 'orange',
             'paye': 'green',
             'annule': 'red',
+            'expire': 'gray',
             'acces_envoye': 'blue',
         }
         color = colors.get(obj.statut, 'gray')
@@ -110,13 +163,97 @@ class CommandeAdmin(admin.ModelAdmin):
 
     statut_badge.short_description = 'Statut'
 
-    actions = ['marquer_acces_envoye']
+    def get_object(self, request, object_id, from_field=None):
+        '''Fiche d'une commande : formations préchargées (la liste n'en a pas besoin)'''
+        commande = super().get_object(request, object_id, from_field)
+        if commande is not None:
+            prefetch_related_objects([commande], 'formations')
+        return commande
+
+    actions = ['marquer_acces_envoye', 'renvoyer_acces', 'exporter_csv', 'exporter_jsonl', 'exporter_revenus']
 
     def marquer_acces_envoye(self, request, queryset):
-        updated = queryset.filter(statut='paye').update(statut='acces_envoye')
+        updated = queryset.marquer_acces_envoye(origine='admin')
         self.message_user(
             request,
             f'{updated} commande(s) marquée(s) comme "Accès envoyé".'
         )
 
     marquer_acces_envoye.short_description = "Marquer les accès comme envoyés"
+
+    def renvoyer_acces(self, request, queryset):
+        crees = mettre_en_file_renvoi(queryset)
+        self.message_user(request, f"{len(crees)} renvoi(s) des accès mis en file.")
+
+    renvoyer_acces.short_description = "Renvoyer l'email d'accès"
+
+    # Exports en flux : une requête, mémoire constante (formation/export.py)
+    def exporter_csv(self, request, queryset):
+        return reponse_export('commandes', 'csv', queryset)
+
+    exporter_csv.short_description = "Exporter en CSV"
+
+    def exporter_jsonl(self, request, queryset):
+        return reponse_export('commandes', 'jsonl', queryset)
+
+    exporter_jsonl.short_description = "Exporter en JSONL"
+
+    def exporter_revenus(self, request, queryset):
+        return reponse_export('revenus', 'csv', queryset)
+
+    exporter_revenus.short_description = "Exporter le chiffre d'affaires par jour (CSV)"
+
+
+@admin.register(EnvoiEmail)
+class EnvoiEmailAdmin(admin.ModelAdmin):
+    list_display = ('commande', 'motif', 'statut', 'tentatives', 'prochaine_tentative', 'date_envoi')
+    list_filter = ('statut', 'motif')
+    search_fields = ('commande__client__email', 'commande__id')
+    list_select_related = ('commande__client',)
+    readonly_fields = ('date_creation', 'date_envoi', 'derniere_erreur')
+
+    actions = ['relancer']
+
+    def relancer(self, request, queryset):
+        updated = queryset.exclude(statut='envoye').update(
+            statut='en_attente',
+            tentatives=0,
+            prochaine_tentative=timezone.now(),
+        )
+        self.message_user(request, f'{updated} envoi(s) remis en file.')
+
+    relancer.short_description = "Remettre en file d'attente"
+
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ('cle', 'type_evenement', 'statut_paiement', 'commande', 'date_reception')
+    list_filter = ('statut_paiement',)
+    search_fields = ('cle', 'commande__id')
+    readonly_fields = ('date_reception',)
+
+
+@admin.register(WebhookRecu)
+class WebhookRecuAdmin(admin.ModelAdmin):
+    list_display = ('id', 'commande_id', 'statut', 'resultat', 'tentatives', 'date_reception', 'date_traitement')
+    list_filter = ('statut', 'resultat')
+    search_fields = ('commande_id',)
+    readonly_fields = ('corps_texte', 'entetes', 'commande_id', 'resultat', 'date_reception', 'date_traitement', 'derniere_erreur')
+    exclude = ('corps',)
+
+    actions = ['relancer']
+
+    def corps_texte(self, obj):
+        return bytes(obj.corps).decode('utf-8', errors='replace')
+
+    corps_texte.short_description = 'Corps'
+
+    def relancer(self, request, queryset):
+        updated = queryset.exclude(statut='recu').update(
+            statut='recu',
+            tentatives=0,
+            prochaine_tentative=timezone.now(),
+        )
+        self.message_user(request, f'{updated} webhook(s) remis en file.')
+
+    relancer.short_description = "Remettre en file d'attente"
@@ -0,0 +1,162 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.db.models import Max
+from django.template.context_processors import csrf
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .models import Formation
+
+
+CATALOGUE_VERSION_KEY = 'catalogue:version'
+
+# Emplacement du jeton CSRF dans les fragments partagés entre visiteurs
+CSRF_MARQUEUR = '<!--csrf_token-->'
+
+
+def version_catalogue():
+    '''
+    Retourne la version courante du catalogue
+    Toute clé de cache du catalogue inclut cette version : l'incrémenter
+    invalide d'un coup toutes les entrées existantes
+    '''
+    version = cache.get(CATALOGUE_VERSION_KEY)
+    if version is None:
+        # Valeur initiale basée sur l'horloge : si la clé a été évincée, on ne
+        # retombe pas sur une ancienne version encore présente dans le cache
+        cache.add(CATALOGUE_VERSION_KEY, int(time.time() * 1000), timeout=None)
+        version = cache.get(CATALOGUE_VERSION_KEY)
+    return version
+
+
+def invalider_catalogue():
+    '''Incrémente la version du catalogue (appelé par les signaux Formation)'''
+    try:
+        return cache.incr(CATALOGUE_VERSION_KEY)
+    except ValueError:
+        version_catalogue()
+        return cache.incr(CATALOGUE_VERSION_KEY)
+
+
+def cle_catalogue(nom, version=None):
+    '''Construit une clé de cache liée à la version du catalogue'''
+    if version is None:
+        version = version_catalogue()
+    return f'catalogue:v{version}:{nom}'
+
+
+def formations_actives():
+    '''
+    Liste des formations actives, servie depuis le cache tant que la
+    version du catalogue n'a pas changé
+    '''
+    cle = cle_catalogue('formations')
+    formations = cache.get(cle)
+    if formations is None:
+        formations = list(Formation.objects.filter(active=True).defer('vecteur_recherche'))
+        cache.set(cle, formations, settings.CATALOGUE_CACHE_TIMEOUT)
+    return formations
+
+
+def derniere_modification_catalogue():
+    '''
+    Date de modification la plus récente parmi toutes les formations
+    (une formation désactivée compte aussi : son retrait change la page)
+    '''
+    cle = cle_catalogue('derniere_modification')
+    valeur = cache.get(cle)
+    if valeur is None:
+        derniere = Formation.objects.aggregate(m=Max('date_modification'))['m']
+        # 0 distingue "catalogue vide" d'une entrée absente du cache
+        valeur = derniere or 0
+        cache.set(cle, valeur, settings.CATALOGUE_CACHE_TIMEOUT)
+    return valeur or None
+
+
+def grille_catalogue(request, formations=None):
+    '''
+    Fragment HTML de la grille des formations, rendu une seule fois par
+    version du catalogue et partagé par tous les visiteurs
+    Le jeton CSRF, propre à chaque visiteur, est injecté à la volée
+    Une liste de formations (résultats de recherche) est rendue sans cache
+    '''
+    if formations is not None:
+        grille = _rendre_grille(formations)
+    else:
+        cle = cle_catalogue('grille')
+        grille = cache.get(cle)
+        if grille is None:
+            grille = _rendre_grille(formations_actives())
+            cache.set(cle, grille, settings.CATALOGUE_CACHE_TIMEOUT)
+
+    jeton = csrf(request)['csrf_token']
+    champ = f'<input type="hidden" name="csrfmiddlewaretoken" value="{jeton}">'
+    return mark_safe(grille.replace(CSRF_MARQUEUR, champ))
+
+
+def _rendre_grille(formations):
+    return render_to_string('formation/_catalogue_grille.html', {
+        'formations': formations,
+        'csrf_marqueur': mark_safe(CSRF_MARQUEUR),
+    })
+
+
+def _empreinte_visiteur(request):
+    '''
+    Court hachage du cookie CSRF : une page mise en cache par le navigateur
+    contient un jeton lié à ce cookie et ne doit plus servir s'il change
+    '''
+    cookie = request.COOKIES.get(settings.CSRF_COOKIE_NAME, '')
+    return hashlib.sha256(cookie.encode('utf-8')).hexdigest()[:12]
+
+
+def _empreinte_messages(request):
+    '''
+    Empreinte des messages flash en attente ('' s'il n'y en a pas), lus dans
+    tous les stockages (cookie, session) sans les consommer : la page qui
+    les affiche a son propre ETag, la suivante (messages lus) un autre
+    '''
+    stockage = messages.get_messages(request)
+    textes = [f'{message.level}:{message.message}' for message in stockage]
+    if not textes:
+        return ''
+    stockage.used = False
+    return '-' + hashlib.sha256('\n'.join(textes).encode('utf-8')).hexdigest()[:8]
+
+
+def etag_catalogue(request, *args, **kwargs):
+    '''
+    ETag fort de la page catalogue, calculé sans rendre de template ; la
+    recherche (?q=) en fait partie : chaque requête a sa propre page
+    '''
+    from .recherche import normaliser  # import différé : recherche dépend de ce module
+
+    derniere = derniere_modification_catalogue()
+    horodatage = int(derniere.timestamp()) if derniere else 0
+    recherche = hashlib.sha256(normaliser(request.GET.get('q', '')).encode('utf-8')).hexdigest()[:8]
+    return (
+        f'{version_catalogue()}-{horodatage}-{recherche}-{_empreinte_visiteur(request)}'
+        f'{_empreinte_messages(request)}'
+    )
+
+
+def last_modified_catalogue(request, *args, **kwargs):
+    # Pas de Last-Modified pour une page propre à la requête (recherche,
+    # messages) : seul l'ETag en tient compte
+    if request.GET.get('q') or _empreinte_messages(request):
+        return None
+    return derniere_modification_catalogue()
+
+
+def etag_panier(request, *args, **kwargs):
+    '''ETag de la page panier : contenu du panier + version du catalogue'''
+    from .panier import Panier  # import différé : panier dépend de ce module
+
+    return (
+        f'{version_catalogue()}-{Panier(request).empreinte()}-{_empreinte_visiteur(request)}'
+        f'{_empreinte_messages(request)}'
+    )
@@ -1,9 +1,15 @@
+from .panier import Panier
+
+
 def panier_count(request):
     '''
     Ajoute le nombre d'articles dans le panier au contexte global
+    Évalué paresseusement : la session n'est lue que si le template
+    affiche réellement le compteur
     '''
-    panier = request.session.get('panier', {})
-    return {'panier_count': len(panier)}
+    def compter():
+        return len(Panier(request))
+    return {'panier_count': compter}
 
 from django.conf import settings
 
@@ -0,0 +1,174 @@
+'''
+Exports CSV et JSONL des commandes, des clients et du chiffre d'affaires
+- une seule requête par export : les titres des formations d'une commande
+  sont joints par la base (STRING_AGG sous PostgreSQL, GROUP_CONCAT sous
+  SQLite), les totaux des clients calculés par GROUP BY
+- les lignes sont lues par paquets (.iterator(chunk_size)) sous forme de
+  tuples (values_list) et écrites au fil de l'eau : la mémoire reste
+  constante quelle que soit la taille des tables
+'''
+import csv
+import itertools
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Aggregate, CharField, Count, Q, Sum, Value
+from django.db.models.functions import TruncDate
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .models import Client, Commande
+
+
+# Commandes comptées dans le chiffre d'affaires
+STATUTS_REGLES = ('paye', 'acces_envoye')
+
+# Lignes écrites par morceau de réponse
+LIGNES_PAR_MORCEAU = 500
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+
+class Concatener(Aggregate):
+    '''Concaténation des valeurs d'un groupe : GROUP_CONCAT (SQLite) ou STRING_AGG (PostgreSQL)'''
+    function = 'GROUP_CONCAT'
+    output_field = CharField()
+
+    def __init__(self, expression, separateur, **extra):
+        super().__init__(expression, Value(separateur), **extra)
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection, function='STRING_AGG', **extra_context)
+
+
+def requete_commandes(commandes):
+    return (
+        commandes
+        .prefetch_related(None)
+        .order_by('id')
+        .values_list(
+            'id', 'date_commande', 'statut', 'montant_total',
+            'client__nom_complet', 'client__email', 'client__whatsapp',
+            'date_paiement', 'moneroo_transaction_id',
+        )
+        .annotate(titres=Concatener('formations__titre', ' | ', default=Value('')))
+    )
+
+
+def requete_clients(clients):
+    return (
+        clients
+        .order_by('id')
+        .values_list('id', 'nom_complet', 'email', 'whatsapp', 'date_inscription')
+        .annotate(
+            commandes=Count('commande'),
+            total_regle=Sum(
+                'commande__montant_total', filter=Q(commande__statut__in=STATUTS_REGLES), default=Decimal(0)
+            ),
+        )
+    )
+
+
+def requete_revenus(commandes):
+    '''Chiffre d'affaires par jour de paiement'''
+    return (
+        commandes
+        .prefetch_related(None)
+        .filter(statut__in=STATUTS_REGLES, date_paiement__isnull=False)
+        .annotate(jour=TruncDate('date_paiement'))
+        .order_by('jour')
+        .values_list('jour')
+        .annotate(commandes=Count('id'), montant=Sum('montant_total'))
+    )
+
+
+# Nom de l'export : (colonnes, requête, modèle exporté par défaut)
+EXPORTS = {
+    'commandes': (
+        ('id', 'date_commande', 'statut', 'montant_total', 'client', 'email', 'whatsapp',
+         'date_paiement', 'transaction_moneroo', 'formations'),
+        requete_commandes,
+        Commande,
+    ),
+    'clients': (
+        ('id', 'nom_complet', 'email', 'whatsapp', 'date_inscription', 'commandes', 'total_regle'),
+        requete_clients,
+        Client,
+    ),
+    'revenus': (
+        ('jour', 'commandes', 'montant'),
+        requete_revenus,
+        Commande,
+    ),
+}
+
+
+def exporter(nom, queryset=None, taille_lot=None):
+    '''
+    Colonnes et itérateur des lignes (tuples) de l'export `nom`, restreint
+    au queryset donné (sélection de l'admin) ou sur toute la table
+    '''
+    colonnes, requete, modele = EXPORTS[nom]
+    if queryset is None:
+        queryset = modele.objects.all()
+    lignes = requete(queryset).iterator(chunk_size=taille_lot or settings.EXPORT_TAILLE_LOT)
+    return colonnes, lignes
+
+
+def _valeur(valeur):
+    if isinstance(valeur, (datetime, date)):
+        return valeur.isoformat()
+    if isinstance(valeur, Decimal):
+        # Montants : deux décimales, y compris pour les sommes calculées par SQLite
+        return f'{valeur:.2f}'
+    return valeur
+
+
+class _Tampon:
+    '''Fichier factice : csv.writer retourne la ligne au lieu de l'écrire'''
+
+    def write(self, valeur):
+        return valeur
+
+
+def flux(colonnes, lignes, format_):
+    '''Texte de l'export, par morceaux de LIGNES_PAR_MORCEAU lignes'''
+    if format_ == 'csv':
+        writer = csv.writer(_Tampon())
+        yield writer.writerow(colonnes)
+        formater = lambda ligne: writer.writerow([_valeur(v) for v in ligne])
+    else:
+        formater = lambda ligne: json.dumps(
+            dict(zip(colonnes, map(_valeur, ligne))), ensure_ascii=False
+        ) + '\n'
+
+    while morceau := list(itertools.islice(lignes, LIGNES_PAR_MORCEAU)):
+        yield ''.join(map(formater, morceau))
+
+
+async def _flux_async(morceaux):
+    '''
+    Sous ASGI, Django matérialiserait un itérateur synchrone en entier :
+    le générateur (et son curseur) est avancé morceau par morceau dans le
+    thread des vues synchrones
+    '''
+    suivant = sync_to_async(next)
+    while (morceau := await suivant(morceaux, None)) is not None:
+        yield morceau
+
+
+def reponse_export(nom, format_, queryset=None):
+    morceaux = flux(*exporter(nom, queryset), format_)
+    response = StreamingHttpResponse(
+        _flux_async(morceaux) if settings.SERVEUR_ASGI else morceaux,
+        content_type=FORMATS[format_],
+    )
+    fichier = f"{nom}-{timezone.localdate():%Y%m%d}.{format_}"
+    response['Content-Disposition'] = f'attachment; filename="{fichier}"'
+    return response
@@ -23,4 +23,19 @@ class ClientForm(forms.ModelForm):
             'nom_complet': 'Nom complet *',
             'whatsapp': 'Numéro WhatsApp *',
             'email': 'Adresse email *',
-        }
\ No newline at end of file
+        }
+
+    @classmethod
+    def soumis(cls, data):
+        '''
+        Formulaire lié au client déjà connu sous cet email : un client qui
+        repasse commande n'est pas refusé par la contrainte d'unicité (la
+        vue le retrouve par get_or_create, sans modifier sa fiche)
+        '''
+        email = (data.get('email') or '').strip().lower()
+        client = Client.objects.filter(email__lower=email).first() if email else None
+        return cls(data, instance=client)
+
+    def clean_email(self):
+        # Emails enregistrés en minuscules : A@x.com et a@x.com sont le même client
+        return self.cleaned_data['email'].lower()
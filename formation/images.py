@@ -0,0 +1,89 @@
+'''
+Déclinaisons responsives de Formation.image
+À l'upload, l'image est redimensionnée aux largeurs IMAGE_LARGEURS en WebP
+et en JPEG, enregistrées dans le stockage média (Cloudinary ou disque) ;
+leurs URLs sont conservées dans Formation.variantes_image pour le srcset
+'''
+import logging
+from io import BytesIO
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+from .models import Formation
+
+
+logger = logging.getLogger(__name__)
+
+FORMATS = (
+    ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    ('jpg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+)
+
+
+def largeurs_pour(largeur_source):
+    '''Largeurs à produire, sans jamais agrandir l'image d'origine'''
+    largeurs = sorted(l for l in settings.IMAGE_LARGEURS if l <= largeur_source)
+    return largeurs or [largeur_source]
+
+
+def _encoder(image, format_pil, options):
+    if format_pil == 'JPEG' and image.mode != 'RGB':
+        # Pas de transparence en JPEG : fond blanc
+        fond = Image.new('RGB', image.size, 'white')
+        fond.paste(image, mask=image.getchannel('A') if 'A' in image.getbands() else None)
+        image = fond
+    tampon = BytesIO()
+    image.save(tampon, format_pil, **options)
+    return tampon.getvalue()
+
+
+def supprimer_variantes(variantes, stockage):
+    for format_, _, _ in FORMATS:
+        for _, nom, _ in variantes.get(format_, []):
+            try:
+                stockage.delete(nom)
+            except Exception as e:
+                logger.warning("Déclinaison %s non supprimée : %s", nom, e)
+
+
+def generer_variantes(formation):
+    '''
+    (Re)génère les déclinaisons de l'image d'une formation et les enregistre
+    sur le modèle sans déclencher post_save ; retourne variantes_image
+    '''
+    stockage = formation.image.storage
+    anciennes = formation.variantes_image or {}
+    variantes = {}
+
+    if formation.image:
+        with formation.image.open('rb') as fichier:
+            source = ImageOps.exif_transpose(Image.open(fichier))
+            source.load()
+        if source.mode not in ('RGB', 'RGBA'):
+            source = source.convert('RGBA' if 'transparency' in source.info else 'RGB')
+
+        largeur_source, hauteur_source = source.size
+        racine = PurePosixPath(formation.image.name).stem
+        variantes = {'source': formation.image.name, 'ratio': round(hauteur_source / largeur_source, 4)}
+        for largeur in largeurs_pour(largeur_source):
+            hauteur = max(round(hauteur_source * largeur / largeur_source), 1)
+            redimensionnee = source.resize((largeur, hauteur), Image.LANCZOS)
+            for format_, format_pil, options in FORMATS:
+                nom = stockage.save(
+                    f'formation/variantes/{formation.pk}/{racine}-{largeur}.{format_}',
+                    ContentFile(_encoder(redimensionnee, format_pil, options))
+                )
+                variantes.setdefault(format_, []).append([largeur, nom, stockage.url(nom)])
+
+    Formation.objects.filter(pk=formation.pk).update(variantes_image=variantes)
+    formation.variantes_image = variantes
+    supprimer_variantes(anciennes, stockage)
+    return variantes
+
+
+def variantes_a_jour(formation):
+    source = (formation.variantes_image or {}).get('source')
+    return source == (formation.image.name or None)
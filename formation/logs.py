@@ -0,0 +1,67 @@
+'''
+Journalisation structurée de l'application
+- JsonFormatter : une ligne JSON par événement
+- identifiants de corrélation (requête, commande) portés par des contextvars
+- QueueStreamHandler : l'écriture sur stdout se fait dans un thread dédié,
+  un worker n'est jamais bloqué par la sortie standard
+'''
+import atexit
+import contextvars
+import json
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+
+request_id_var = contextvars.ContextVar('request_id', default=None)
+commande_id_var = contextvars.ContextVar('commande_id', default=None)
+
+# Attributs présents sur tout LogRecord : le reste vient de `extra=`
+_ATTRIBUTS_STANDARD = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+
+def lier_commande(commande_id):
+    '''Associe les logs suivants de la requête courante à une commande'''
+    commande_id_var.set(commande_id)
+
+
+class CorrelationFilter(logging.Filter):
+    '''Ajoute request_id et commande_id à chaque enregistrement'''
+
+    def filter(self, record):
+        if not hasattr(record, 'request_id'):
+            record.request_id = request_id_var.get()
+        if not hasattr(record, 'commande_id'):
+            record.commande_id = commande_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        donnees = {
+            'ts': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'niveau': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for cle, valeur in vars(record).items():
+            if cle not in _ATTRIBUTS_STANDARD and valeur is not None:
+                donnees[cle] = valeur
+        if record.exc_info:
+            donnees['exception'] = self.formatException(record.exc_info)
+        return json.dumps(donnees, ensure_ascii=False, default=str)
+
+
+class QueueStreamHandler(QueueHandler):
+    '''
+    Handler non bloquant : le message est formaté dans le thread appelant
+    puis écrit sur le flux par un QueueListener en arrière-plan
+    '''
+
+    def __init__(self, stream=None):
+        file = queue.SimpleQueue()
+        super().__init__(file)
+        self.listener = QueueListener(file, logging.StreamHandler(stream))
+        self.listener.start()
+        atexit.register(self.listener.stop)
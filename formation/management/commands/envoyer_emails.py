@@ -0,0 +1,42 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from formation.outbox import traiter_lot
+
+
+class Command(BaseCommand):
+    help = "Envoie les emails d'accès en attente dans la file (outbox)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lot', type=int, default=settings.EMAIL_OUTBOX_TAILLE_LOT,
+            help="Nombre d'emails envoyés par connexion SMTP"
+        )
+        parser.add_argument(
+            '--debit', type=float, default=settings.EMAIL_OUTBOX_DEBIT,
+            help="Emails par seconde au plus (0 = illimité)"
+        )
+        parser.add_argument(
+            '--boucle', action='store_true',
+            help="Tourne en continu (mode worker)"
+        )
+        parser.add_argument(
+            '--pause', type=float, default=5,
+            help="Secondes d'attente quand la file est vide (mode --boucle)"
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            # On vide la file lot par lot avant de se mettre en pause
+            while True:
+                envoyes, echecs = traiter_lot(options['lot'], options['debit'])
+                if envoyes or echecs:
+                    self.stdout.write(f"{envoyes} email(s) envoyé(s), {echecs} échec(s)")
+                if envoyes + echecs < options['lot']:
+                    break
+
+            if not options['boucle']:
+                return
+            time.sleep(options['pause'])
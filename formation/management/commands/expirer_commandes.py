@@ -0,0 +1,98 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from formation.models import Client, Commande
+
+
+class Command(BaseCommand):
+    help = (
+        "Passe à « expirée » les commandes restées en attente au-delà de "
+        "COMMANDE_DUREE_ATTENTE, par petits lots (à planifier toutes les "
+        "quelques minutes, sans gêner le trafic)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--duree', type=int, default=None,
+            help="Âge minimal (secondes) d'une commande en attente pour expirer "
+                 "(défaut : COMMANDE_DUREE_ATTENTE)"
+        )
+        parser.add_argument('--lot', type=int, default=1000, help="Commandes modifiées par UPDATE")
+        parser.add_argument(
+            '--pause', type=float, default=0,
+            help="Secondes d'attente entre deux lots (laisse respirer la base)"
+        )
+        parser.add_argument(
+            '--purger-clients', action='store_true',
+            help="Supprime aussi les clients sans aucune commande"
+        )
+
+    def handle(self, *args, **options):
+        duree = options['duree'] if options['duree'] is not None else settings.COMMANDE_DUREE_ATTENTE
+        limite = timezone.now() - timedelta(seconds=duree)
+
+        debut = time.perf_counter()
+        expirees = self.expirer(limite, options['lot'], options['pause'])
+        self.rapport(f"{expirees} commande(s) expirée(s)", expirees, debut)
+
+        if options['purger_clients']:
+            debut = time.perf_counter()
+            supprimes = self.purger_clients(options['lot'], options['pause'])
+            self.rapport(f"{supprimes} client(s) sans commande supprimé(s)", supprimes, debut)
+
+    def rapport(self, message, nombre, debut):
+        duree = time.perf_counter() - debut
+        debit = nombre / duree if duree else 0
+        self.stdout.write(self.style.SUCCESS(f"{message} en {duree:.1f} s ({debit:.0f}/s)"))
+
+    def expirer(self, limite, taille, pause):
+        '''
+        Parcours par clé (id croissant) : chaque lot est une courte
+        transaction qui ne verrouille que ses lignes, et la transition
+        conditionnelle laisse gagner un webhook ou un callback concurrent
+        '''
+        candidates = Commande.objects.filter(statut='en_attente', date_commande__lt=limite).order_by('id')
+        total, dernier_id = 0, 0
+        while True:
+            ids = list(candidates.filter(id__gt=dernier_id).values_list('id', flat=True)[:taille])
+            if not ids:
+                break
+            dernier_id = ids[-1]
+            total += Commande.objects.filter(id__in=ids).marquer_comme_expire()
+            self.stdout.write(f"... {total} commande(s) expirée(s) (jusqu'à #{dernier_id})")
+            if pause:
+                time.sleep(pause)
+        return total
+
+    def purger_clients(self, taille, pause):
+        '''
+        Supprime les clients sans commande, par lots parcourus par clé
+        Les clients du lot sont verrouillés avant de vérifier à nouveau
+        qu'ils n'ont pas de commande : un checkout concurrent (qui verrouille
+        aussi son client) crée sa commande avant, ou après sans le trouver
+        '''
+        sans_commande = ~Exists(Commande.objects.filter(client=OuterRef('pk')))
+        total, dernier_id = 0, 0
+        while True:
+            ids = list(
+                Client.objects.filter(sans_commande, id__gt=dernier_id)
+                .order_by('id')
+                .values_list('id', flat=True)[:taille]
+            )
+            if not ids:
+                break
+            dernier_id = ids[-1]
+            with transaction.atomic():
+                verrouilles = list(Client.objects.filter(id__in=ids).select_for_update().values_list('id', flat=True))
+                supprimes, _ = Client.objects.filter(sans_commande, id__in=verrouilles).delete()
+            total += supprimes
+            self.stdout.write(f"... {total} client(s) supprimé(s) (jusqu'à #{dernier_id})")
+            if pause:
+                time.sleep(pause)
+        return total
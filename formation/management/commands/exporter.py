@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from formation.export import EXPORTS, FORMATS, exporter, flux
+
+
+class Command(BaseCommand):
+    help = (
+        "Exporte les commandes, les clients ou le chiffre d'affaires par jour "
+        "en CSV ou JSONL, en flux (mémoire constante quelle que soit la taille des tables)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('export', choices=sorted(EXPORTS))
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--sortie', default='-', help="Fichier de sortie (- : sortie standard)")
+        parser.add_argument('--lot', type=int, default=None, help="Lignes lues par paquet (défaut : EXPORT_TAILLE_LOT)")
+
+    def handle(self, *args, **options):
+        colonnes, lignes = exporter(options['export'], taille_lot=options['lot'])
+        compteur = [0]
+
+        def comptees(lignes):
+            for ligne in lignes:
+                compteur[0] += 1
+                yield ligne
+
+        morceaux = flux(colonnes, comptees(lignes), options['format'])
+        debut = time.perf_counter()
+        if options['sortie'] == '-':
+            for morceau in morceaux:
+                self.stdout.write(morceau, ending='')
+        else:
+            with open(options['sortie'], 'w', encoding='utf-8', newline='') as sortie:
+                sortie.writelines(morceaux)
+
+        duree = time.perf_counter() - debut
+        debit = compteur[0] / duree if duree else 0
+        # Rapport sur stderr : stdout peut porter l'export lui-même
+        self.stderr.write(
+            f"{compteur[0]} ligne(s) exportée(s) en {duree:.1f} s ({debit:.0f}/s)", style_func=self.style.SUCCESS
+        )
+
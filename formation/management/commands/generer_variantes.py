@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from formation.cache import invalider_catalogue
+from formation.images import generer_variantes, variantes_a_jour
+from formation.models import Formation
+
+
+class Command(BaseCommand):
+    help = "Génère les déclinaisons WebP/JPEG manquantes des images de formations"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--forcer', action='store_true',
+            help="Régénère aussi les déclinaisons à jour (après un changement d'IMAGE_LARGEURS)"
+        )
+
+    def handle(self, *args, **options):
+        generees = echecs = 0
+        for formation in Formation.objects.exclude(image='').exclude(image__isnull=True).iterator():
+            if variantes_a_jour(formation) and not options['forcer']:
+                continue
+            try:
+                variantes = generer_variantes(formation)
+            except Exception as e:
+                echecs += 1
+                self.stderr.write(f"#{formation.pk} {formation.image.name} : {e}")
+                continue
+            generees += 1
+            self.stdout.write(f"#{formation.pk} : {len(variantes.get('jpg', []))} largeur(s)")
+
+        if generees:
+            invalider_catalogue()
+        self.stdout.write(self.style.SUCCESS(f"{generees} image(s) traitée(s), {echecs} échec(s)"))
@@ -0,0 +1,50 @@
+import time
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = (
+        "Supprime les sessions expirées par lots (à planifier périodiquement) ; "
+        "contrairement à clearsessions, aucune transaction ne verrouille toute la table"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lot', type=int, default=1000, help="Sessions supprimées par DELETE")
+        parser.add_argument(
+            '--pause', type=float, default=0,
+            help="Secondes d'attente entre deux lots (laisse respirer la base)"
+        )
+
+    def handle(self, *args, **options):
+        if settings.SESSION_ENGINE not in (
+            'django.contrib.sessions.backends.db',
+            'django.contrib.sessions.backends.cached_db',
+        ):
+            # Fichiers, cache ou cookies : le moteur sait se nettoyer lui-même
+            import_module(settings.SESSION_ENGINE).SessionStore.clear_expired()
+            self.stdout.write(f"Sessions expirées nettoyées ({settings.SESSION_ENGINE})")
+            return
+
+        maintenant = timezone.now()
+        expirees = Session.objects.filter(expire_date__lt=maintenant)
+        total = 0
+        debut = time.perf_counter()
+        while True:
+            cles = list(expirees.values_list('session_key', flat=True)[:options['lot']])
+            if not cles:
+                break
+            supprimees, _ = Session.objects.filter(session_key__in=cles).delete()
+            total += supprimees
+            self.stdout.write(f"{total} session(s) supprimée(s)")
+            if options['pause']:
+                time.sleep(options['pause'])
+
+        duree = time.perf_counter() - debut
+        self.stdout.write(self.style.SUCCESS(
+            f"{total} session(s) expirée(s) supprimée(s) en {duree:.1f} s"
+        ))
@@ -0,0 +1,159 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from formation.models import Commande, EnvoiEmail
+from formation.utils import statut_paiement_moneroo, STATUTS_PAYES, STATUTS_ECHOUES
+
+
+class LimiteurDebit:
+    '''Seau à jetons partagé entre threads : au plus `par_seconde` appels/s'''
+
+    def __init__(self, par_seconde):
+        self.intervalle = 1.0 / par_seconde if par_seconde > 0 else 0
+        self.prochain = time.monotonic()
+        self._lock = threading.Lock()
+
+    def attendre(self):
+        if not self.intervalle:
+            return
+        with self._lock:
+            maintenant = time.monotonic()
+            attente = self.prochain - maintenant
+            self.prochain = max(self.prochain, maintenant) + self.intervalle
+        if attente > 0:
+            time.sleep(attente)
+
+
+class Command(BaseCommand):
+    help = (
+        "Vérifie auprès de Moneroo les commandes restées en attente ou "
+        "récemment expirées (webhook perdu) et met à jour leur statut"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--age', type=int, default=30,
+            help="Âge minimal (minutes) d'une commande en attente pour être vérifiée"
+        )
+        parser.add_argument(
+            '--expirees', type=int, default=72,
+            help="Vérifie aussi les commandes expirées depuis moins de N heures "
+                 "(un paiement tardif reste accepté ; 0 : les ignorer)"
+        )
+        parser.add_argument(
+            '--workers', type=int, default=8,
+            help="Nombre de vérifications simultanées"
+        )
+        parser.add_argument(
+            '--debit', type=float, default=20,
+            help="Nombre maximal d'appels Moneroo par seconde (0 = illimité)"
+        )
+        parser.add_argument(
+            '--lot', type=int, default=500,
+            help="Nombre de commandes traitées entre deux points de reprise"
+        )
+        parser.add_argument(
+            '--checkpoint', default=str(Path(settings.BASE_DIR) / '.reconcile_payments.json'),
+            help="Fichier de point de reprise"
+        )
+        parser.add_argument(
+            '--recommencer', action='store_true',
+            help="Ignore le point de reprise existant"
+        )
+
+    def handle(self, *args, **options):
+        checkpoint = Path(options['checkpoint'])
+        dernier_id = 0
+        if checkpoint.exists() and not options['recommencer']:
+            dernier_id = json.loads(checkpoint.read_text())['dernier_id']
+            self.stdout.write(f"Reprise après la commande #{dernier_id}")
+
+        maintenant = timezone.now()
+        selection = Q(statut='en_attente', date_commande__lte=maintenant - timedelta(minutes=options['age']))
+        if options['expirees']:
+            # Expirée après COMMANDE_DUREE_ATTENTE : la date de commande borne
+            # la fenêtre sans lire l'historique des statuts
+            depuis = maintenant - timedelta(seconds=settings.COMMANDE_DUREE_ATTENTE, hours=options['expirees'])
+            selection |= Q(statut='expire', date_commande__gte=depuis)
+        candidates = (
+            Commande.objects
+            .filter(selection, moneroo_transaction_id__isnull=False)
+            .exclude(moneroo_transaction_id='')
+            .order_by('id')
+        )
+        limiteur = LimiteurDebit(options['debit'])
+
+        def verifier(ligne):
+            limiteur.attendre()
+            return ligne[0], statut_paiement_moneroo(ligne[1])
+
+        totaux = {'verifiees': 0, 'payees': 0, 'annulees': 0, 'inchangees': 0}
+        debut = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            while True:
+                # Parcours par clé (id croissant) : pas d'OFFSET, reprise triviale
+                lot = list(
+                    candidates
+                    .filter(id__gt=dernier_id)
+                    .values_list('id', 'moneroo_transaction_id')[:options['lot']]
+                )
+                if not lot:
+                    break
+
+                resultats = list(pool.map(verifier, lot))
+                payees = [cid for cid, statut in resultats if statut in STATUTS_PAYES]
+                annulees = [cid for cid, statut in resultats if statut in STATUTS_ECHOUES]
+
+                nb_payees = self.appliquer_paiements(payees)
+                nb_annulees = self.appliquer_annulations(annulees)
+
+                totaux['verifiees'] += len(lot)
+                totaux['payees'] += nb_payees
+                totaux['annulees'] += nb_annulees
+                totaux['inchangees'] += len(lot) - nb_payees - nb_annulees
+
+                dernier_id = lot[-1][0]
+                checkpoint.write_text(json.dumps({'dernier_id': dernier_id}))
+                self.stdout.write(
+                    f"... {totaux['verifiees']} vérifiée(s) (jusqu'à #{dernier_id})"
+                )
+
+        checkpoint.unlink(missing_ok=True)
+        duree = time.perf_counter() - debut
+        debit = totaux['verifiees'] / duree if duree else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"{totaux['verifiees']} commande(s) vérifiée(s) en {duree:.1f}s "
+            f"({debit:.0f}/s) : {totaux['payees']} payée(s), "
+            f"{totaux['annulees']} annulée(s), {totaux['inchangees']} inchangée(s)"
+        ))
+
+    def appliquer_paiements(self, ids):
+        '''Passe les commandes à "payé" et met leurs emails d'accès en file, en masse'''
+        if not ids:
+            return 0
+        with transaction.atomic():
+            # Seules les commandes encore en attente (ou expirées) sont
+            # concernées : un webhook a pu les traiter entre-temps
+            ids = (
+                Commande.objects
+                .filter(id__in=ids, statut__in=('en_attente', 'expire'))
+                .transition('paye', 'reconciliation', date_paiement=timezone.now())
+            )
+            EnvoiEmail.objects.bulk_create([EnvoiEmail(commande_id=cid) for cid in ids])
+        return len(ids)
+
+    def appliquer_annulations(self, ids):
+        if not ids:
+            return 0
+        return Commande.objects.filter(id__in=ids).marquer_comme_annule(origine='reconciliation')
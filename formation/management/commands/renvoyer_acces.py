@@ -0,0 +1,80 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from formation.models import Commande, EnvoiEmail, Formation
+from formation.outbox import commandes_a_renvoyer, mettre_en_file_renvoi, traiter_lot
+
+
+class Command(BaseCommand):
+    help = (
+        "Renvoie les accès aux acheteurs d'une ou plusieurs formations (après "
+        "correction d'un lien par exemple) en passant par la file d'emails"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--formation', type=int, action='append', default=[],
+            help="ID d'une formation dont les acheteurs sont à recontacter (répétable)"
+        )
+        parser.add_argument(
+            '--commande', type=int, action='append', default=[],
+            help="ID d'une commande payée à recontacter (répétable)"
+        )
+        parser.add_argument(
+            '--envoyer', action='store_true',
+            help="Vide la file immédiatement au lieu de laisser faire le worker"
+        )
+        parser.add_argument('--lot', type=int, default=settings.EMAIL_OUTBOX_TAILLE_LOT)
+        parser.add_argument(
+            '--debit', type=float, default=settings.EMAIL_OUTBOX_DEBIT,
+            help="Emails par seconde au plus (0 = illimité)"
+        )
+
+    def handle(self, *args, **options):
+        if not options['formation'] and not options['commande']:
+            raise CommandError("Indiquez au moins une --formation ou une --commande")
+
+        inconnues = set(options['formation']) - set(
+            Formation.objects.filter(id__in=options['formation']).values_list('id', flat=True)
+        )
+        if inconnues:
+            raise CommandError(f"Formation(s) introuvable(s) : {sorted(inconnues)}")
+
+        commande_ids = set(options['commande'])
+        if options['formation']:
+            commande_ids.update(commandes_a_renvoyer(options['formation']).values_list('id', flat=True))
+        commandes = Commande.objects.filter(id__in=commande_ids)
+
+        # Les renvois encore en file d'une exécution interrompue sont repris
+        ids_suivis = list(
+            EnvoiEmail.objects
+            .filter(motif='renvoi', statut='en_attente', commande__in=commandes)
+            .values_list('id', flat=True)
+        )
+        crees = mettre_en_file_renvoi(commandes)
+        ids_suivis += [envoi.id for envoi in crees]
+        self.stdout.write(f"{len(crees)} renvoi(s) mis en file, {len(ids_suivis)} à suivre")
+
+        suivis = EnvoiEmail.objects.filter(id__in=ids_suivis)
+        if not options['envoyer']:
+            restants = suivis.filter(statut='en_attente').count()
+            self.stdout.write(f"{restants} renvoi(s) en attente, expédiés par le worker envoyer_emails")
+            return
+
+        while True:
+            envoyes, echecs = traiter_lot(options['lot'], options['debit'])
+            if not envoyes and not echecs:
+                break
+            restants = suivis.filter(statut='en_attente').count()
+            self.stdout.write(f"{envoyes} envoyé(s), {echecs} échec(s), {restants} restant(s)")
+
+        self.afficher_resultats(suivis)
+
+    def afficher_resultats(self, suivis):
+        '''Journal par destinataire des renvois visés'''
+        for envoi in suivis.select_related('commande__client').order_by('commande_id'):
+            ligne = f"#{envoi.commande_id} {envoi.commande.client.email} : {envoi.get_statut_display()}"
+            if envoi.statut != 'envoye' and envoi.derniere_erreur:
+                ligne += f" ({envoi.derniere_erreur})"
+            style = self.style.SUCCESS if envoi.statut == 'envoye' else self.style.WARNING
+            self.stdout.write(style(ligne))
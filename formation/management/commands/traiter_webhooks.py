@@ -0,0 +1,73 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from formation.webhooks import purger_traites, traiter_lot
+
+
+# Intervalle (secondes) entre deux purges des webhooks traités en mode --boucle
+INTERVALLE_PURGE = 3600
+
+
+class Command(BaseCommand):
+    help = (
+        "Applique les webhooks Moneroo reçus (WebhookRecu), par lots "
+        "partitionnés par commande, et purge ceux traités depuis plus de "
+        "WEBHOOK_RETENTION_JOURS"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lot', type=int, default=settings.WEBHOOK_TAILLE_LOT,
+            help="Nombre de webhooks réservés à la fois"
+        )
+        parser.add_argument(
+            '--threads', type=int, default=4,
+            help="Tranches de commandes traitées en parallèle dans un lot"
+        )
+        parser.add_argument(
+            '--partitions', type=int, default=1,
+            help="Nombre de workers se partageant les commandes (commande_id modulo N)"
+        )
+        parser.add_argument(
+            '--partition', type=int, default=0,
+            help="Partition traitée par ce worker (0 à partitions - 1)"
+        )
+        parser.add_argument(
+            '--boucle', action='store_true',
+            help="Tourne en continu (mode worker)"
+        )
+        parser.add_argument(
+            '--pause', type=float, default=1,
+            help="Secondes d'attente quand la file est vide (mode --boucle)"
+        )
+
+    def handle(self, *args, **options):
+        if not 0 <= options['partition'] < options['partitions']:
+            raise CommandError("--partition doit être compris entre 0 et --partitions - 1")
+
+        derniere_purge = None
+        while True:
+            # On vide la file lot par lot avant de se mettre en pause
+            while True:
+                traites, echecs = traiter_lot(
+                    options['lot'], options['threads'], options['partition'], options['partitions']
+                )
+                if traites or echecs:
+                    self.stdout.write(f"{traites} webhook(s) appliqué(s), {echecs} échec(s)")
+                if traites + echecs < options['lot']:
+                    break
+
+            # Purge par la seule partition 0 : les workers ne se marchent pas dessus
+            if options['partition'] == 0 and (
+                derniere_purge is None or time.monotonic() - derniere_purge >= INTERVALLE_PURGE
+            ):
+                derniere_purge = time.monotonic()
+                supprimes = purger_traites(options['lot'])
+                if supprimes:
+                    self.stdout.write(f"{supprimes} webhook(s) traité(s) purgé(s)")
+
+            if not options['boucle']:
+                return
+            time.sleep(options['pause'])
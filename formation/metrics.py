@@ -0,0 +1,156 @@
+'''
+Métriques de performance en mémoire, exposées au format texte Prometheus
+Chaque worker gunicorn tient ses propres compteurs : l'étiquette `pid`
+de formation_worker_info permet de distinguer les processus scrapés
+'''
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+BUCKETS_DUREE = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BUCKETS_NOMBRE = (1, 2, 5, 10, 20, 50, 100, 200)
+
+_DESCRIPTIONS = {
+    'formation_requete_duree_secondes': "Durée totale des requêtes par vue",
+    'formation_requete_sql_requetes': "Nombre de requêtes SQL par requête HTTP",
+    'formation_requete_sql_secondes': "Temps passé en base par requête HTTP",
+    'formation_template_secondes': "Temps de rendu des templates par requête HTTP",
+    'formation_sortant_secondes': "Durée des appels sortants (Moneroo, SMTP)",
+    'formation_requetes_lentes_total': "Requêtes dépassant PERF_SEUIL_LENT",
+    'formation_n_plus_un_total': "Requêtes HTTP avec une requête SQL répétée (N+1 probable)",
+}
+
+
+class Histogramme:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.compteurs = [0] * len(buckets)
+        self.somme = 0.0
+        self.total = 0
+
+    def observer(self, valeur):
+        for i, borne in enumerate(self.buckets):
+            if valeur <= borne:
+                self.compteurs[i] += 1
+        self.somme += valeur
+        self.total += 1
+
+
+class Registre:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histogrammes = {}
+        self.compteurs = {}
+
+    def observer(self, nom, valeur, buckets=BUCKETS_DUREE, **etiquettes):
+        cle = (nom, tuple(sorted(etiquettes.items())))
+        with self._lock:
+            histogramme = self.histogrammes.get(cle)
+            if histogramme is None:
+                histogramme = self.histogrammes[cle] = Histogramme(buckets)
+            histogramme.observer(valeur)
+
+    def incrementer(self, nom, valeur=1, **etiquettes):
+        cle = (nom, tuple(sorted(etiquettes.items())))
+        with self._lock:
+            self.compteurs[cle] = self.compteurs.get(cle, 0) + valeur
+
+    def exposer(self):
+        '''Rend toutes les métriques au format d'exposition texte Prometheus'''
+        lignes = [
+            '# TYPE formation_worker_info gauge',
+            f'formation_worker_info{{pid="{os.getpid()}"}} 1',
+        ]
+        with self._lock:
+            histogrammes = sorted(self.histogrammes.items())
+            compteurs = sorted(self.compteurs.items())
+
+        deja_decrits = set()
+        for (nom, etiquettes), h in histogrammes:
+            if nom not in deja_decrits:
+                lignes.append(f'# HELP {nom} {_DESCRIPTIONS.get(nom, nom)}')
+                lignes.append(f'# TYPE {nom} histogram')
+                deja_decrits.add(nom)
+            for borne, nombre in zip(h.buckets, h.compteurs):
+                lignes.append(f'{nom}_bucket{_etiquettes(etiquettes, le=borne)} {nombre}')
+            lignes.append(f'{nom}_bucket{_etiquettes(etiquettes, le="+Inf")} {h.total}')
+            lignes.append(f'{nom}_sum{_etiquettes(etiquettes)} {h.somme:.6f}')
+            lignes.append(f'{nom}_count{_etiquettes(etiquettes)} {h.total}')
+
+        for (nom, etiquettes), valeur in compteurs:
+            if nom not in deja_decrits:
+                lignes.append(f'# HELP {nom} {_DESCRIPTIONS.get(nom, nom)}')
+                lignes.append(f'# TYPE {nom} counter')
+                deja_decrits.add(nom)
+            lignes.append(f'{nom}{_etiquettes(etiquettes)} {valeur}')
+
+        return '\n'.join(lignes) + '\n'
+
+
+def _echapper(valeur):
+    return str(valeur).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _etiquettes(etiquettes, **supplementaires):
+    paires = list(etiquettes) + list(supplementaires.items())
+    if not paires:
+        return ''
+    return '{' + ','.join(f'{cle}="{_echapper(valeur)}"' for cle, valeur in paires) + '}'
+
+
+registre = Registre()
+
+# Mesures de la requête HTTP en cours (None hors requête)
+mesures_requete = contextvars.ContextVar('mesures_requete', default=None)
+
+
+@contextmanager
+def mesurer(cible):
+    '''
+    Chronomètre un appel sortant (cible = 'moneroo', 'smtp'...) ; la durée
+    alimente l'histogramme global et les mesures de la requête en cours
+    '''
+    debut = time.perf_counter()
+    try:
+        yield
+    finally:
+        duree = time.perf_counter() - debut
+        registre.observer('formation_sortant_secondes', duree, cible=cible)
+        mesures = mesures_requete.get()
+        if mesures is not None:
+            mesures[cible] = mesures.get(cible, 0.0) + duree
+
+
+_profondeur_template = threading.local()
+
+
+def instrumenter_templates():
+    '''
+    Enveloppe le rendu des templates Django pour en mesurer la durée
+    Seul le rendu le plus externe est compté (pas de double comptage)
+    '''
+    from django.template.backends.django import Template
+
+    if getattr(Template.render, '_instrumente', False):
+        return
+    render_original = Template.render
+
+    def render(self, context=None, request=None):
+        profondeur = getattr(_profondeur_template, 'valeur', 0)
+        _profondeur_template.valeur = profondeur + 1
+        debut = time.perf_counter()
+        try:
+            return render_original(self, context, request)
+        finally:
+            _profondeur_template.valeur = profondeur
+            mesures = mesures_requete.get()
+            if profondeur == 0 and mesures is not None:
+                mesures['template'] = mesures.get('template', 0.0) + time.perf_counter() - debut
+
+    render._instrumente = True
+    Template.render = render
@@ -0,0 +1,187 @@
+import logging
+import time
+import uuid
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connection
+from whitenoise.middleware import WhiteNoiseMiddleware as BaseWhiteNoiseMiddleware
+
+from .logs import request_id_var, commande_id_var
+from .metrics import registre, mesures_requete, instrumenter_templates, BUCKETS_NOMBRE
+
+
+logger = logging.getLogger(__name__)
+
+
+class HybrideMixin:
+    '''
+    Middleware utilisable en WSGI comme en ASGI : sous ASGI, Django
+    l'appelle directement depuis la boucle d'événements, sans le faire
+    passer par un thread (les vues async restent non bloquantes)
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.traiter(request, self.get_response)
+
+
+class CorrelationIdMiddleware(HybrideMixin):
+    '''
+    Attribue un identifiant à chaque requête (repris de X-Request-ID s'il
+    est fourni par le proxy) et le renvoie dans la réponse
+    Tous les logs émis pendant la requête le portent
+    '''
+
+    def traiter(self, request, get_response):
+        request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+        jeton_requete = request_id_var.set(request_id[:64])
+        jeton_commande = commande_id_var.set(None)
+        try:
+            response = get_response(request)
+        finally:
+            request_id_var.reset(jeton_requete)
+            commande_id_var.reset(jeton_commande)
+        response['X-Request-ID'] = request_id[:64]
+        return response
+
+    async def __acall__(self, request):
+        request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+        jeton_requete = request_id_var.set(request_id[:64])
+        jeton_commande = commande_id_var.set(None)
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_id_var.reset(jeton_requete)
+            commande_id_var.reset(jeton_commande)
+        response['X-Request-ID'] = request_id[:64]
+        return response
+
+
+class PerformanceMiddleware(HybrideMixin):
+    '''
+    Mesure chaque requête : durée totale, nombre et durée des requêtes SQL,
+    rendu des templates et appels sortants (Moneroo, SMTP)
+    Les résultats alimentent les histogrammes exposés sur /metrics ; les
+    requêtes lentes et les requêtes SQL répétées (N+1) sont journalisées
+    '''
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.seuil_lent = settings.PERF_SEUIL_LENT
+        self.seuil_n_plus_un = settings.PERF_SEUIL_N_PLUS_UN
+        instrumenter_templates()
+
+    def preparer(self):
+        mesures = {'sql_requetes': 0, 'sql_temps': 0.0}
+        requetes_sql = Counter()
+
+        def compter_sql(execute, sql, params, many, context):
+            debut = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                mesures['sql_requetes'] += 1
+                mesures['sql_temps'] += time.perf_counter() - debut
+                requetes_sql[sql] += 1
+
+        return mesures, requetes_sql, compter_sql
+
+    def traiter(self, request, get_response):
+        mesures, requetes_sql, compter_sql = self.preparer()
+        jeton = mesures_requete.set(mesures)
+        debut = time.perf_counter()
+        try:
+            with connection.execute_wrapper(compter_sql):
+                response = get_response(request)
+        finally:
+            mesures_requete.reset(jeton)
+        self.enregistrer(request, mesures, requetes_sql, time.perf_counter() - debut)
+        return response
+
+    async def __acall__(self, request):
+        # La connexion (propre au contexte de la requête) est celle que
+        # réutilisent les appels sync_to_async : le compteur les voit
+        mesures, requetes_sql, compter_sql = self.preparer()
+        jeton = mesures_requete.set(mesures)
+        debut = time.perf_counter()
+        try:
+            with connection.execute_wrapper(compter_sql):
+                response = await self.get_response(request)
+        finally:
+            mesures_requete.reset(jeton)
+        self.enregistrer(request, mesures, requetes_sql, time.perf_counter() - debut)
+        return response
+
+    def enregistrer(self, request, mesures, requetes_sql, duree):
+
+        match = getattr(request, 'resolver_match', None)
+        vue = match.view_name if match else 'inconnue'
+        registre.observer('formation_requete_duree_secondes', duree, vue=vue)
+        registre.observer('formation_requete_sql_requetes', mesures['sql_requetes'], BUCKETS_NOMBRE, vue=vue)
+        registre.observer('formation_requete_sql_secondes', mesures['sql_temps'], vue=vue)
+        registre.observer('formation_template_secondes', mesures.get('template', 0.0), vue=vue)
+
+        details = {
+            'vue': vue,
+            'duree_ms': round(duree * 1000, 1),
+            'sql_requetes': mesures['sql_requetes'],
+            'sql_ms': round(mesures['sql_temps'] * 1000, 1),
+            'template_ms': round(mesures.get('template', 0.0) * 1000, 1),
+            'moneroo_ms': round(mesures.get('moneroo', 0.0) * 1000, 1),
+            'smtp_ms': round(mesures.get('smtp', 0.0) * 1000, 1),
+        }
+
+        repetee, nombre = requetes_sql.most_common(1)[0] if requetes_sql else ('', 0)
+        if nombre >= self.seuil_n_plus_un:
+            registre.incrementer('formation_n_plus_un_total', vue=vue)
+            logger.warning(
+                "N+1 probable : requête SQL exécutée %d fois", nombre,
+                extra={**details, 'sql': repetee[:300]}
+            )
+
+        if duree >= self.seuil_lent:
+            registre.incrementer('formation_requetes_lentes_total', vue=vue)
+            logger.warning("Requête lente (%.0f ms)", duree * 1000, extra=details)
+        else:
+            logger.debug("Requête traitée", extra=details)
+
+
+class WhiteNoiseMiddleware(BaseWhiteNoiseMiddleware):
+    '''
+    WhiteNoise utilisable sous ASGI : la recherche du fichier statique se
+    fait en mémoire, seule la suite de la chaîne est attendue. Sans cela,
+    Django ferait passer chaque requête par un thread à cause de lui
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = self.find_file(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return await self.get_response(request)
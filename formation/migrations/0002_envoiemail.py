@@ -0,0 +1,34 @@
+# Generated by Django 5.0.1 on 2026-10-17 22:50
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('formation', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EnvoiEmail',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('statut', models.CharField(choices=[('en_attente', 'En attente'), ('envoye', 'Envoyé'), ('abandonne', 'Abandonné')], default='en_attente', max_length=20)),
+                ('tentatives', models.PositiveIntegerField(default=0)),
+                ('prochaine_tentative', models.DateTimeField(default=django.utils.timezone.now)),
+                ('derniere_erreur', models.TextField(blank=True)),
+                ('date_creation', models.DateTimeField(auto_now_add=True)),
+                ('date_envoi', models.DateTimeField(blank=True, null=True)),
+                ('commande', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='envois_email', to='formation.commande')),
+            ],
+            options={
+                'verbose_name': "Envoi d'email",
+                'verbose_name_plural': "Envois d'emails",
+                'ordering': ['prochaine_tentative'],
+                'indexes': [models.Index(fields=['statut', 'prochaine_tentative'], name='formation_e_statut_1db3ff_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.1 on 2026-10-17 22:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('formation', '0002_envoiemail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cle', models.CharField(max_length=255, unique=True)),
+                ('type_evenement', models.CharField(blank=True, max_length=100)),
+                ('statut_paiement', models.CharField(blank=True, max_length=50)),
+                ('date_reception', models.DateTimeField(auto_now_add=True)),
+                ('commande', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='webhook_events', to='formation.commande')),
+            ],
+            options={
+                'verbose_name': 'Événement webhook',
+                'verbose_name_plural': 'Événements webhook',
+                'ordering': ['-date_reception'],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def dedoublonner_clients(apps, schema_editor):
+    '''
+    Regroupe les clients de même email sur le plus ancien avant la pose
+    de la contrainte d'unicité : leurs commandes lui sont rattachées
+    '''
+    Client = apps.get_model('formation', 'Client')
+    Commande = apps.get_model('formation', 'Commande')
+
+    doublons = (
+        Client.objects
+        .values('email')
+        .annotate(nombre=Count('id'), premier=Min('id'))
+        .filter(nombre__gt=1)
+    )
+    for doublon in doublons:
+        autres = Client.objects.filter(email=doublon['email']).exclude(id=doublon['premier'])
+        Commande.objects.filter(client__in=autres).update(client_id=doublon['premier'])
+        autres.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('formation', '0003_webhookevent'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedoublonner_clients, migrations.RunPython.noop),
+    ]
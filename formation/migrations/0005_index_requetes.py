@@ -0,0 +1,37 @@
+# Generated by Django 5.0.1 on 2026-10-17 23:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('formation', '0004_dedoublonner_clients'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='commande',
+            index=models.Index(fields=['-date_commande'], name='commande_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='commande',
+            index=models.Index(fields=['statut', '-date_commande'], name='commande_statut_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='commande',
+            index=models.Index(condition=models.Q(('date_paiement__isnull', False)), fields=['date_paiement'], name='commande_paiement_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='commande',
+            index=models.Index(condition=models.Q(('moneroo_transaction_id__isnull', False)), fields=['moneroo_transaction_id'], name='commande_transaction_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='formation',
+            index=models.Index(condition=models.Q(('active', True)), fields=['-date_creation'], name='formation_active_recent_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='client',
+            constraint=models.UniqueConstraint(fields=('email',), name='client_email_unique'),
+        ),
+    ]
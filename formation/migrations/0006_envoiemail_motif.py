@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-17 23:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('formation', '0005_index_requetes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='envoiemail',
+            name='motif',
+            field=models.CharField(choices=[('achat', 'Achat'), ('renvoi', 'Renvoi des accès')], default='achat', max_length=20),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.0.1 on 2026-10-17 23:08
+
+import django.contrib.postgres.search
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+
+
+def creer_index_recherche(apps, schema_editor):
+    '''
+    Index plein texte propre à chaque base, puis indexation de l'existant
+    PostgreSQL : index GIN sur vecteur_recherche ; SQLite : table FTS5
+    '''
+    Formation = apps.get_model('formation', 'Formation')
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE INDEX formation_recherche_gin ON formation_formation USING gin (vecteur_recherche)'
+        )
+        Formation.objects.update(vecteur_recherche=(
+            SearchVector('titre', weight='A', config='french')
+            + SearchVector('description', weight='B', config='french')
+        ))
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE formation_recherche USING fts5("
+            "titre, description, tokenize='unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(
+            'INSERT INTO formation_recherche (rowid, titre, description) '
+            'SELECT id, titre, description FROM formation_formation'
+        )
+
+
+def supprimer_index_recherche(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS formation_recherche_gin')
+    elif vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS formation_recherche')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('formation', '0006_envoiemail_motif'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='formation',
+            name='vecteur_recherche',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(creer_index_recherche, supprimer_index_recherche),
+    ]
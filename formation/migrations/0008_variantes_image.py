@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-17 23:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('formation', '0007_recherche_plein_texte'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='formation',
+            name='variantes_image',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
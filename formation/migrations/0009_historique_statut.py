@@ -0,0 +1,30 @@
+# Generated by Django 5.0.1 on 2026-10-17 23:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('formation', '0008_variantes_image'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HistoriqueStatut',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ancien_statut', models.CharField(choices=[('en_attente', 'En attente'), ('paye', 'Payé'), ('annule', 'Annulé'), ('acces_envoye', 'Accès envoyé')], max_length=20)),
+                ('nouveau_statut', models.CharField(choices=[('en_attente', 'En attente'), ('paye', 'Payé'), ('annule', 'Annulé'), ('acces_envoye', 'Accès envoyé')], max_length=20)),
+                ('origine', models.CharField(blank=True, choices=[('webhook', 'Webhook Moneroo'), ('callback', 'Retour de paiement'), ('reconciliation', 'Réconciliation'), ('email', "Envoi de l'email d'accès"), ('admin', 'Administration')], max_length=20)),
+                ('date', models.DateTimeField(auto_now_add=True)),
+                ('commande', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='historique', to='formation.commande')),
+            ],
+            options={
+                'verbose_name': 'Changement de statut',
+                'verbose_name_plural': 'Historique des statuts',
+                'ordering': ['date', 'id'],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.0.1 on 2026-10-17 23:18
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('formation', '0009_historique_statut'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookRecu',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('corps', models.BinaryField()),
+                ('entetes', models.JSONField(default=dict)),
+                ('commande_id', models.BigIntegerField(null=True)),
+                ('statut', models.CharField(choices=[('recu', 'Reçu'), ('traite', 'Traité'), ('erreur', 'En erreur')], default='recu', max_length=20)),
+                ('resultat', models.CharField(blank=True, max_length=20)),
+                ('tentatives', models.PositiveIntegerField(default=0)),
+                ('prochaine_tentative', models.DateTimeField(default=django.utils.timezone.now)),
+                ('derniere_erreur', models.TextField(blank=True)),
+                ('date_reception', models.DateTimeField(auto_now_add=True)),
+                ('date_traitement', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Webhook reçu',
+                'verbose_name_plural': 'Webhooks reçus',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['statut', 'prochaine_tentative'], name='webhookrecu_file_idx')],
+            },
+        ),
+    ]
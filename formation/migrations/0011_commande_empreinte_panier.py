@@ -0,0 +1,22 @@
+# Generated by Django 5.0.1 on 2026-10-17 23:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('formation', '0010_webhookrecu'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='commande',
+            name='empreinte_panier',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='commande',
+            index=models.Index(condition=models.Q(('statut', 'en_attente')), fields=['client', 'empreinte_panier'], name='commande_reprise_idx'),
+        ),
+    ]
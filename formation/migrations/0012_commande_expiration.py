@@ -0,0 +1,33 @@
+# Generated by Django 5.0.1 on 2026-10-17 23:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('formation', '0011_commande_empreinte_panier'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='commande',
+            name='statut',
+            field=models.CharField(choices=[('en_attente', 'En attente'), ('paye', 'Payé'), ('annule', 'Annulé'), ('expire', 'Expirée'), ('acces_envoye', 'Accès envoyé')], default='en_attente', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='historiquestatut',
+            name='ancien_statut',
+            field=models.CharField(choices=[('en_attente', 'En attente'), ('paye', 'Payé'), ('annule', 'Annulé'), ('expire', 'Expirée'), ('acces_envoye', 'Accès envoyé')], max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='historiquestatut',
+            name='nouveau_statut',
+            field=models.CharField(choices=[('en_attente', 'En attente'), ('paye', 'Payé'), ('annule', 'Annulé'), ('expire', 'Expirée'), ('acces_envoye', 'Accès envoyé')], max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='historiquestatut',
+            name='origine',
+            field=models.CharField(blank=True, choices=[('webhook', 'Webhook Moneroo'), ('callback', 'Retour de paiement'), ('reconciliation', 'Réconciliation'), ('expiration', 'Expiration des commandes abandonnées'), ('email', "Envoi de l'email d'accès"), ('admin', 'Administration')], max_length=20),
+        ),
+    ]
@@ -0,0 +1,43 @@
+from django.db import migrations
+from django.db.models import Count, Min
+from django.db.models.functions import Lower
+
+
+def dedoublonner_emails(apps, schema_editor):
+    '''
+    Regroupe les clients dont l'email ne diffère que par la casse sur le
+    plus ancien (comme 0004), puis enregistre tous les emails en minuscules
+    Migration de données seule : sous PostgreSQL, la clé étrangère des
+    commandes est vérifiée en fin de transaction, et un ALTER TABLE sur
+    formation_client échouerait dans la même migration (0014)
+    '''
+    Client = apps.get_model('formation', 'Client')
+    Commande = apps.get_model('formation', 'Commande')
+
+    doublons = (
+        Client.objects
+        .annotate(email_min=Lower('email'))
+        .values('email_min')
+        .annotate(nombre=Count('id'), premier=Min('id'))
+        .filter(nombre__gt=1)
+    )
+    for doublon in doublons:
+        autres = (
+            Client.objects.annotate(email_min=Lower('email'))
+            .filter(email_min=doublon['email_min'])
+            .exclude(id=doublon['premier'])
+        )
+        Commande.objects.filter(client__in=autres).update(client_id=doublon['premier'])
+        autres.delete()
+    Client.objects.update(email=Lower('email'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('formation', '0012_commande_expiration'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedoublonner_emails, migrations.RunPython.noop),
+    ]
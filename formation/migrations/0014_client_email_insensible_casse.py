@@ -0,0 +1,22 @@
+# Generated by Django 5.0.1 on 2026-10-17 23:40
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('formation', '0013_client_email_minuscules'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='client',
+            name='client_email_unique',
+        ),
+        migrations.AddConstraint(
+            model_name='client',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('email'), name='client_email_ci_unique'),
+        ),
+    ]
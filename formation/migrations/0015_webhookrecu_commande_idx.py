@@ -0,0 +1,17 @@
+# Generated by Django 5.0.1 on 2026-10-17 23:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('formation', '0014_client_email_insensible_casse'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='webhookrecu',
+            index=models.Index(condition=models.Q(('statut', 'recu')), fields=['commande_id', 'id'], name='webhookrecu_commande_idx'),
+        ),
+    ]
@@ -1,8 +1,18 @@
-from django.db import models
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models, transaction
 from django.core.validators import MinValueValidator
+from django.db.models.functions import Lower
 from django.utils import timezone
 
 
+# email__lower : recherche par LOWER(email), servie par l'index de
+# client_email_ci_unique
+models.EmailField.register_lookup(Lower)
+
+
 class Formation(models.Model):
     titre = models.CharField(max_length=200, verbose_name="Titre")
     description = models.TextField(verbose_name="Description")
@@ -32,14 +42,55 @@ class Formation(models.Model):
     date_creation = models.DateTimeField(auto_now_add=True)
     date_modification = models.DateTimeField(auto_now=True)
 
+    # Déclinaisons redimensionnées de l'image, générées par formation.images :
+    # {'source': nom, 'ratio': h/l, 'webp': [[largeur, nom, url], ...], 'jpg': [...]}
+    variantes_image = models.JSONField(default=dict, blank=True, editable=False)
+
+    # Index plein texte (PostgreSQL), tenu à jour par formation.recherche
+    vecteur_recherche = SearchVectorField(null=True, editable=False)
+
     class Meta:
         verbose_name = "Formation"
         verbose_name_plural = "Formations"
         ordering = ['-date_creation']
+        indexes = [
+            # Catalogue : formations actives, les plus récentes d'abord
+            models.Index(
+                fields=['-date_creation'],
+                condition=models.Q(active=True),
+                name='formation_active_recent_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.titre
 
+    def _srcset(self, format_):
+        return ', '.join(f'{url} {largeur}w' for largeur, _, url in self.variantes_image.get(format_, []))
+
+    @property
+    def srcset_webp(self):
+        return self._srcset('webp')
+
+    @property
+    def srcset_jpeg(self):
+        return self._srcset('jpg')
+
+    @property
+    def image_miniature(self):
+        '''Plus petite déclinaison JPEG, ou l'image d'origine à défaut'''
+        if self.variantes_image.get('jpg'):
+            return self.variantes_image['jpg'][0][2]
+        return self.image.url if self.image else ''
+
+    @property
+    def image_dimensions(self):
+        '''(largeur, hauteur) de la plus grande déclinaison, pour réserver la place'''
+        if not self.variantes_image.get('jpg'):
+            return None
+        largeur = self.variantes_image['jpg'][-1][0]
+        return largeur, round(largeur * self.variantes_image['ratio'])
+
 
 class Client(models.Model):
     nom_complet = models.CharField(max_length=200, verbose_name="Nom complet")
@@ -51,19 +102,104 @@ class Client(models.Model):
         verbose_name = "Client"
         verbose_name_plural = "Clients"
         ordering = ['-date_inscription']
+        constraints = [
+            # Recherché par email au checkout (get_or_create) : l'unicité,
+            # insensible à la casse, empêche deux checkouts concurrents de
+            # créer deux clients (les emails sont enregistrés en minuscules)
+            models.UniqueConstraint(Lower('email'), name='client_email_ci_unique'),
+        ]
 
     def __str__(self):
         return f"{self.nom_complet} ({self.email})"
 
 
+class CommandeQuerySet(models.QuerySet):
+
+    def with_details(self):
+        '''
+        Profil de chargement des chemins de paiement et de l'admin : client
+        joint et formations préchargées, soit un nombre fixe de requêtes
+        quelle que soit la taille du panier
+        '''
+        return self.select_related('client').prefetch_related('formations')
+
+    def paiement_en_cours(self, client, empreinte_panier, montant_total):
+        '''
+        Commandes en attente du même client pour le même panier et le même
+        montant, créées dans la fenêtre CHECKOUT_FENETRE_REPRISE : une
+        nouvelle soumission du checkout les reprend au lieu d'en créer une
+        '''
+        limite = timezone.now() - timedelta(seconds=settings.CHECKOUT_FENETRE_REPRISE)
+        return self.filter(
+            client=client,
+            empreinte_panier=empreinte_panier,
+            montant_total=montant_total,
+            statut='en_attente',
+            date_commande__gte=limite,
+        ).order_by('-date_commande')
+
+    def transition(self, vers, origine='', **champs):
+        '''
+        Applique la transition vers `vers` aux commandes dont le statut le
+        permet (Commande.TRANSITIONS), par un seul UPDATE conditionnel :
+        deux chemins concurrents (webhook, callback) ne peuvent pas tous deux
+        réussir. Chaque changement est tracé dans HistoriqueStatut
+        Retourne les ids des commandes effectivement modifiées
+        '''
+        sources = Commande.TRANSITIONS[vers]
+        with transaction.atomic(savepoint=False):
+            # Les lignes candidates sont verrouillées (PostgreSQL) : l'UPDATE
+            # qui suit modifie exactement celles-ci, avec leur statut d'origine
+            avant = dict(
+                self.filter(statut__in=sources)
+                .select_for_update()
+                .values_list('id', 'statut')
+            )
+            if not avant:
+                return []
+            Commande.objects.filter(id__in=avant, statut__in=sources).update(statut=vers, **champs)
+            HistoriqueStatut.objects.bulk_create([
+                HistoriqueStatut(commande_id=commande_id, ancien_statut=statut, nouveau_statut=vers, origine=origine)
+                for commande_id, statut in avant.items()
+            ])
+        return list(avant)
+
+    def marquer_comme_paye(self, date_paiement=None, origine=''):
+        '''Retourne le nombre de commandes passées à "payé"'''
+        return len(self.transition('paye', origine, date_paiement=date_paiement or timezone.now()))
+
+    def marquer_comme_annule(self, origine=''):
+        '''Annule les commandes encore en attente ; retourne le nombre modifié'''
+        return len(self.transition('annule', origine))
+
+    def marquer_comme_expire(self, origine='expiration'):
+        '''Passe à "expirée" les commandes encore en attente ; retourne le nombre modifié'''
+        return len(self.transition('expire', origine))
+
+    def marquer_acces_envoye(self, date_acces_envoye=None, origine=''):
+        return len(self.transition('acces_envoye', origine, date_acces_envoye=date_acces_envoye or timezone.now()))
+
+
 class Commande(models.Model):
     STATUT_CHOICES = [
         ('en_attente', 'En attente'),
         ('paye', 'Payé'),
         ('annule', 'Annulé'),
+        ('expire', 'Expirée'),
         ('acces_envoye', 'Accès envoyé'),
     ]
 
+    # Statuts de départ autorisés pour chaque statut d'arrivée ; un
+    # paiement confirmé après une annulation ou une expiration (paiement
+    # tardif) est accepté
+    TRANSITIONS = {
+        'en_attente': (),
+        'paye': ('en_attente', 'annule', 'expire'),
+        'annule': ('en_attente',),
+        'expire': ('en_attente',),
+        'acces_envoye': ('paye',),
+    }
+
     client = models.ForeignKey(Client, on_delete=models.CASCADE)
     formations = models.ManyToManyField(Formation)
     montant_total = models.DecimalField(max_digits=10, decimal_places=2)
@@ -84,25 +220,219 @@ class Commande(models.Model):
         blank=True,
         null=True
     )
+    # Empreinte du panier (Panier.empreinte) : reprise du paiement en cours
+    empreinte_panier = models.CharField(max_length=64, blank=True, editable=False)
 
     date_commande = models.DateTimeField(auto_now_add=True)
     date_paiement = models.DateTimeField(null=True, blank=True)
     date_acces_envoye = models.DateTimeField(null=True, blank=True)
 
+    objects = CommandeQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Commande"
         verbose_name_plural = "Commandes"
         ordering = ['-date_commande']
+        indexes = [
+            models.Index(fields=['-date_commande'], name='commande_date_idx'),
+            models.Index(fields=['statut', '-date_commande'], name='commande_statut_date_idx'),
+            models.Index(
+                fields=['date_paiement'],
+                condition=models.Q(date_paiement__isnull=False),
+                name='commande_paiement_idx'
+            ),
+            models.Index(
+                fields=['moneroo_transaction_id'],
+                condition=models.Q(moneroo_transaction_id__isnull=False),
+                name='commande_transaction_idx'
+            ),
+            models.Index(
+                fields=['client', 'empreinte_panier'],
+                condition=models.Q(statut='en_attente'),
+                name='commande_reprise_idx'
+            ),
+        ]
 
     def __str__(self):
         return f"Commande #{self.id} - {self.client.nom_complet}"
 
-    def marquer_comme_paye(self):
-        self.statut = 'paye'
-        self.date_paiement = timezone.now()
-        self.save()
+    def transition(self, vers, origine='', **champs):
+        '''
+        Transition conditionnelle de cette commande (voir
+        CommandeQuerySet.transition) ; l'instance est mise à jour en mémoire
+        Retourne True si cet appel a effectivement changé le statut
+        '''
+        if not Commande.objects.filter(pk=self.pk).transition(vers, origine, **champs):
+            return False
+        self.statut = vers
+        for champ, valeur in champs.items():
+            setattr(self, champ, valeur)
+        return True
+
+    def marquer_comme_paye(self, origine=''):
+        '''Retourne True si cet appel a effectivement marqué la commande payée'''
+        return self.transition('paye', origine, date_paiement=timezone.now())
+
+    def marquer_comme_annule(self, origine=''):
+        '''Retourne True si cet appel a effectivement annulé la commande'''
+        return self.transition('annule', origine)
+
+    def marquer_acces_envoye(self, origine=''):
+        '''Retourne True si la commande payée est passée à "accès envoyé"'''
+        return self.transition('acces_envoye', origine, date_acces_envoye=timezone.now())
+
+
+class HistoriqueStatut(models.Model):
+    '''Journal des changements de statut des commandes (une ligne par transition)'''
+    ORIGINE_CHOICES = [
+        ('webhook', 'Webhook Moneroo'),
+        ('callback', 'Retour de paiement'),
+        ('reconciliation', 'Réconciliation'),
+        ('expiration', 'Expiration des commandes abandonnées'),
+        ('email', "Envoi de l'email d'accès"),
+        ('admin', 'Administration'),
+    ]
+
+    commande = models.ForeignKey(
+        Commande,
+        on_delete=models.CASCADE,
+        related_name='historique'
+    )
+    ancien_statut = models.CharField(max_length=20, choices=Commande.STATUT_CHOICES)
+    nouveau_statut = models.CharField(max_length=20, choices=Commande.STATUT_CHOICES)
+    origine = models.CharField(max_length=20, choices=ORIGINE_CHOICES, blank=True)
+    date = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Changement de statut"
+        verbose_name_plural = "Historique des statuts"
+        ordering = ['date', 'id']
+
+    def __str__(self):
+        return f"Commande #{self.commande_id} : {self.ancien_statut} → {self.nouveau_statut}"
+
+
+class WebhookEvent(models.Model):
+    '''
+    Registre des webhooks Moneroo déjà traités
+    La clé unique rend le traitement idempotent face aux redélivrances
+    '''
+    cle = models.CharField(max_length=255, unique=True)
+    type_evenement = models.CharField(max_length=100, blank=True)
+    statut_paiement = models.CharField(max_length=50, blank=True)
+    commande = models.ForeignKey(
+        Commande,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='webhook_events'
+    )
+    date_reception = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Événement webhook"
+        verbose_name_plural = "Événements webhook"
+        ordering = ['-date_reception']
+
+    def __str__(self):
+        return self.cle
+
+
+class WebhookRecu(models.Model):
+    '''
+    Boîte de réception des webhooks Moneroo
+    La vue enregistre le webhook tel quel (corps brut, en-têtes) en un seul
+    INSERT et répond aussitôt ; la commande traiter_webhooks l'applique
+    ensuite (formation/webhooks.py)
+    '''
+    STATUT_CHOICES = [
+        ('recu', 'Reçu'),
+        ('traite', 'Traité'),
+        ('erreur', 'En erreur'),
+    ]
+
+    corps = models.BinaryField()
+    entetes = models.JSONField(default=dict)
+    # Clé de partition du traitement (pas de clé étrangère : la commande
+    # peut ne pas exister, le webhook est tout de même conservé)
+    commande_id = models.BigIntegerField(null=True)
+    statut = models.CharField(
+        max_length=20,
+        choices=STATUT_CHOICES,
+        default='recu'
+    )
+    resultat = models.CharField(max_length=20, blank=True)
+    tentatives = models.PositiveIntegerField(default=0)
+    prochaine_tentative = models.DateTimeField(default=timezone.now)
+    derniere_erreur = models.TextField(blank=True)
+
+    date_reception = models.DateTimeField(auto_now_add=True)
+    date_traitement = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Webhook reçu"
+        verbose_name_plural = "Webhooks reçus"
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['statut', 'prochaine_tentative'], name='webhookrecu_file_idx'),
+            # Webhooks en attente d'une commande : ordre par commande (reserver_lot)
+            models.Index(
+                fields=['commande_id', 'id'],
+                condition=models.Q(statut='recu'),
+                name='webhookrecu_commande_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f"Webhook #{self.id} commande #{self.commande_id} ({self.get_statut_display()})"
+
 
-    def marquer_acces_envoye(self):
-        self.statut = 'acces_envoye'
-        self.date_acces_envoye = timezone.now()
-        self.save()
\ No newline at end of file
+class EnvoiEmail(models.Model):
+    '''
+    File d'attente (outbox) des emails d'accès
+    Une ligne est créée dans la même transaction que le passage de la
+    commande à "payé" ; la commande envoyer_emails les expédie ensuite
+    hors du cycle requête/réponse
+    '''
+    STATUT_CHOICES = [
+        ('en_attente', 'En attente'),
+        ('envoye', 'Envoyé'),
+        ('abandonne', 'Abandonné'),
+    ]
+    MOTIF_CHOICES = [
+        ('achat', 'Achat'),
+        ('renvoi', 'Renvoi des accès'),
+    ]
+
+    commande = models.ForeignKey(
+        Commande,
+        on_delete=models.CASCADE,
+        related_name='envois_email'
+    )
+    statut = models.CharField(
+        max_length=20,
+        choices=STATUT_CHOICES,
+        default='en_attente'
+    )
+    motif = models.CharField(
+        max_length=20,
+        choices=MOTIF_CHOICES,
+        default='achat'
+    )
+    tentatives = models.PositiveIntegerField(default=0)
+    prochaine_tentative = models.DateTimeField(default=timezone.now)
+    derniere_erreur = models.TextField(blank=True)
+
+    date_creation = models.DateTimeField(auto_now_add=True)
+    date_envoi = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Envoi d'email"
+        verbose_name_plural = "Envois d'emails"
+        ordering = ['prochaine_tentative']
+        indexes = [
+            models.Index(fields=['statut', 'prochaine_tentative']),
+        ]
+
+    def __str__(self):
+        return f"Email commande #{self.commande_id} ({self.get_statut_display()})"
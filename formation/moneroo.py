@@ -0,0 +1,294 @@
+import asyncio
+import random
+import threading
+import time
+import weakref
+
+import requests
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .metrics import mesurer
+
+
+class CircuitOuvert(Exception):
+    '''Moneroo est considéré comme indisponible : l'appel n'est pas tenté'''
+
+
+class CircuitBreaker:
+    '''
+    Disjoncteur simple : après `seuil` échecs consécutifs, les appels sont
+    refusés pendant `delai` secondes, puis un appel d'essai est autorisé
+    (semi-ouvert) ; s'il réussit le circuit se referme
+    '''
+
+    def __init__(self, seuil, delai):
+        self.seuil = seuil
+        self.delai = delai
+        self.echecs = 0
+        self.ouvert_depuis = None
+        self._lock = threading.Lock()
+
+    @property
+    def etat(self):
+        if self.ouvert_depuis is None:
+            return 'ferme'
+        if time.monotonic() - self.ouvert_depuis >= self.delai:
+            return 'semi_ouvert'
+        return 'ouvert'
+
+    def autoriser(self):
+        with self._lock:
+            etat = self.etat
+            if etat == 'ouvert':
+                raise CircuitOuvert("Moneroo indisponible, nouvel essai plus tard")
+            if etat == 'semi_ouvert':
+                # Un seul appel d'essai : les suivants attendent un nouveau délai
+                self.ouvert_depuis = time.monotonic()
+
+    def succes(self):
+        with self._lock:
+            self.echecs = 0
+            self.ouvert_depuis = None
+
+    def echec(self):
+        with self._lock:
+            self.echecs += 1
+            if self.echecs >= self.seuil:
+                self.ouvert_depuis = time.monotonic()
+
+
+class MonerooClient:
+    '''
+    Client HTTP Moneroo partagé par tout le processus
+    La session requests garde les connexions TLS ouvertes (keep-alive) ;
+    les GET (idempotents) sont rejoués avec backoff aléatoire, les POST ne
+    sont rejoués que si la connexion n'a pas pu être établie
+    '''
+
+    def __init__(self, api_key=None, base_url=None):
+        self.api_key = api_key or settings.MONEROO_API_KEY
+        self.base_url = (base_url or settings.MONEROO_API_URL).rstrip('/')
+        self.timeout = (settings.MONEROO_CONNECT_TIMEOUT, settings.MONEROO_READ_TIMEOUT)
+        self.circuit = CircuitBreaker(
+            settings.MONEROO_CIRCUIT_SEUIL,
+            settings.MONEROO_CIRCUIT_DELAI,
+        )
+
+        retry = Retry(
+            total=settings.MONEROO_RETRIES,
+            connect=settings.MONEROO_RETRIES,
+            read=settings.MONEROO_RETRIES,
+            status=settings.MONEROO_RETRIES,
+            status_forcelist=(429, 502, 503, 504),
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            backoff_factor=0.3,
+            backoff_jitter=0.3,
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        self.adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=settings.MONEROO_POOL_MAXSIZE,
+            max_retries=retry,
+        )
+        self.session = requests.Session()
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+        self.session.headers.update({
+            'Authorization': f'Bearer {self.api_key}',
+            'Accept': 'application/json',
+        })
+
+        self._lock = threading.Lock()
+        self._requetes = 0
+        self._erreurs = 0
+        self._latence_totale = 0.0
+        self._latence_max = 0.0
+
+    def get(self, chemin, **kwargs):
+        return self.request('GET', chemin, **kwargs)
+
+    def post(self, chemin, **kwargs):
+        return self.request('POST', chemin, **kwargs)
+
+    def request(self, methode, chemin, **kwargs):
+        '''
+        Exécute un appel à l'API Moneroo
+        Lève CircuitOuvert si Moneroo est jugé indisponible, et les
+        exceptions requests habituelles en cas d'erreur réseau
+        '''
+        self.circuit.autoriser()
+        kwargs.setdefault('timeout', self.timeout)
+
+        debut = time.perf_counter()
+        try:
+            with mesurer('moneroo'):
+                response = self.session.request(methode, f'{self.base_url}{chemin}', **kwargs)
+        except requests.exceptions.RequestException:
+            self._enregistrer(time.perf_counter() - debut, erreur=True)
+            self.circuit.echec()
+            raise
+
+        erreur_serveur = response.status_code >= 500
+        self._enregistrer(time.perf_counter() - debut, erreur=erreur_serveur)
+        if erreur_serveur:
+            self.circuit.echec()
+        else:
+            self.circuit.succes()
+        return response
+
+    def _enregistrer(self, duree, erreur=False):
+        with self._lock:
+            self._requetes += 1
+            self._latence_totale += duree
+            self._latence_max = max(self._latence_max, duree)
+            if erreur:
+                self._erreurs += 1
+
+    def stats(self):
+        '''Latences, erreurs, état du disjoncteur et du pool de connexions'''
+        pools = self.adapter.poolmanager.pools
+        pools = [pools.get(cle) for cle in pools.keys()]
+        pools = [pool for pool in pools if pool is not None]
+        with self._lock:
+            stats = {
+                'requetes': self._requetes,
+                'erreurs': self._erreurs,
+                'latence_moyenne_ms': round(1000 * self._latence_totale / self._requetes, 1) if self._requetes else 0,
+                'latence_max_ms': round(1000 * self._latence_max, 1),
+                'circuit': self.circuit.etat,
+                'pool': {
+                    'taille_max': settings.MONEROO_POOL_MAXSIZE,
+                    # requetes_http >> connexions_creees : le keep-alive fonctionne
+                    # Compteurs des HTTPConnectionPool d'urllib3, absents
+                    # d'autres implémentations : 0 plutôt qu'une erreur
+                    'connexions_creees': sum(getattr(p, 'num_connections', 0) for p in pools),
+                    'requetes_http': sum(getattr(p, 'num_requests', 0) for p in pools),
+                },
+            }
+        clients_async = list(_clients_async.values())
+        if clients_async:
+            stats['async'] = {
+                'requetes': sum(c.requetes for c in clients_async),
+                'erreurs': sum(c.erreurs for c in clients_async),
+            }
+        return stats
+
+
+class AsyncMonerooClient:
+    '''
+    Équivalent asynchrone de MonerooClient (httpx), pour les vues ASGI
+    Un même processus peut garder des centaines d'initialisations de
+    paiement en vol sans bloquer de thread. Mêmes règles de rejeu : le
+    transport rejoue les échecs de connexion (toutes méthodes), les GET
+    sont en plus rejoués sur 429/502/503/504 avec backoff aléatoire
+    Le disjoncteur est celui du client synchrone : l'état de Moneroo est
+    partagé par tout le processus
+    '''
+
+    STATUTS_REJOUES = (429, 502, 503, 504)
+
+    def __init__(self, circuit, api_key=None, base_url=None):
+        import httpx
+
+        self.httpx = httpx
+        self.circuit = circuit
+        self.base_url = (base_url or settings.MONEROO_API_URL).rstrip('/')
+        self.retries = settings.MONEROO_RETRIES
+        self.client = httpx.AsyncClient(
+            headers={
+                'Authorization': f'Bearer {api_key or settings.MONEROO_API_KEY}',
+                'Accept': 'application/json',
+            },
+            timeout=httpx.Timeout(settings.MONEROO_READ_TIMEOUT, connect=settings.MONEROO_CONNECT_TIMEOUT),
+            # Avec un transport explicite, httpx ignore le paramètre limits du
+            # client : les limites du pool sont données au transport
+            transport=httpx.AsyncHTTPTransport(
+                retries=self.retries,
+                limits=httpx.Limits(
+                    max_connections=settings.MONEROO_ASYNC_MAX_CONNEXIONS,
+                    max_keepalive_connections=settings.MONEROO_POOL_MAXSIZE,
+                ),
+            ),
+        )
+        self.requetes = 0
+        self.erreurs = 0
+
+    async def get(self, chemin, **kwargs):
+        return await self.request('GET', chemin, **kwargs)
+
+    async def post(self, chemin, **kwargs):
+        return await self.request('POST', chemin, **kwargs)
+
+    async def request(self, methode, chemin, **kwargs):
+        '''
+        Lève CircuitOuvert si Moneroo est jugé indisponible, et les
+        exceptions httpx (httpx.HTTPError) en cas d'erreur réseau
+        '''
+        self.circuit.autoriser()
+        tentatives = self.retries if methode in ('GET', 'HEAD') else 0
+        for tentative in range(tentatives + 1):
+            self.requetes += 1
+            try:
+                with mesurer('moneroo'):
+                    response = await self.client.request(methode, f'{self.base_url}{chemin}', **kwargs)
+            except self.httpx.HTTPError:
+                self.erreurs += 1
+                self.circuit.echec()
+                raise
+            if response.status_code not in self.STATUTS_REJOUES or tentative == tentatives:
+                break
+            await asyncio.sleep(0.3 * (2 ** tentative) + random.uniform(0, 0.3))
+
+        if response.status_code >= 500:
+            self.erreurs += 1
+            self.circuit.echec()
+        else:
+            self.circuit.succes()
+        return response
+
+    def stats(self):
+        return {'requetes': self.requetes, 'erreurs': self.erreurs}
+
+
+_client = None
+_client_lock = threading.Lock()
+
+# Un client asynchrone par boucle d'événements : le pool httpx est lié à
+# la boucle qui l'a créé (une seule par worker uvicorn)
+_clients_async = weakref.WeakKeyDictionary()
+
+
+def get_client():
+    '''
+    Retourne le client Moneroo du processus (créé au premier appel, donc
+    après le fork des workers gunicorn)
+    '''
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MonerooClient()
+    return _client
+
+
+def get_client_async():
+    '''Retourne le client Moneroo asynchrone de la boucle d'événements courante'''
+    boucle = asyncio.get_running_loop()
+    client = _clients_async.get(boucle)
+    if client is None:
+        client = _clients_async[boucle] = AsyncMonerooClient(get_client().circuit)
+    return client
+
+
+@receiver(setting_changed)
+def reinitialiser_client(setting, **kwargs):
+    '''Recrée le client quand une option MONEROO_* change (override_settings)'''
+    global _client
+    if setting.startswith('MONEROO_'):
+        _client = None
+        _clients_async.clear()
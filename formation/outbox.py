@@ -0,0 +1,163 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .metrics import mesurer
+from .models import Commande, EnvoiEmail
+from .utils import construire_email_acces
+
+
+logger = logging.getLogger(__name__)
+
+# Durée pendant laquelle un lot réservé par un worker est invisible des autres
+DUREE_RESERVATION = timedelta(minutes=5)
+
+
+def mettre_en_file_acces(commande_id):
+    '''
+    Enregistre l'envoi des accès d'une commande dans la file d'attente
+    À appeler dans la même transaction que commande.marquer_comme_paye()
+    '''
+    return EnvoiEmail.objects.create(commande_id=commande_id)
+
+
+def commandes_a_renvoyer(formation_ids):
+    '''Commandes payées (accès envoyés ou non) contenant l'une des formations'''
+    return (
+        Commande.objects
+        .filter(statut__in=['paye', 'acces_envoye'], formations__in=formation_ids)
+        .distinct()
+    )
+
+
+def mettre_en_file_renvoi(commandes):
+    '''
+    Met en file un renvoi des accès pour chaque commande payée du queryset,
+    sauf celles qui ont déjà un envoi en attente (relancer l'action ou la
+    commande ne crée pas de doublons)
+    Retourne la liste des envois créés
+    '''
+    commande_ids = (
+        commandes
+        .filter(statut__in=['paye', 'acces_envoye'])
+        .exclude(envois_email__statut='en_attente')
+        .order_by()
+        .values_list('id', flat=True)
+        .distinct()
+    )
+    return EnvoiEmail.objects.bulk_create(
+        [EnvoiEmail(commande_id=commande_id, motif='renvoi') for commande_id in commande_ids],
+        batch_size=500
+    )
+
+
+def delai_avant_nouvel_essai(tentatives):
+    '''Backoff exponentiel : base, 2×base, 4×base... plafonné à 6 h'''
+    secondes = settings.EMAIL_OUTBOX_DELAI_BASE * (2 ** max(tentatives - 1, 0))
+    return timedelta(seconds=min(secondes, 6 * 3600))
+
+
+def reserver_lot(taille):
+    '''
+    Réserve un lot d'envois dus en repoussant leur prochaine tentative
+    SKIP LOCKED (PostgreSQL) permet à plusieurs workers de vider la file
+    en parallèle sans se marcher dessus
+    '''
+    maintenant = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            EnvoiEmail.objects
+            .select_for_update(skip_locked=True)
+            .filter(statut='en_attente', prochaine_tentative__lte=maintenant)
+            .order_by('prochaine_tentative')
+            .values_list('id', flat=True)[:taille]
+        )
+        EnvoiEmail.objects.filter(id__in=ids).update(
+            prochaine_tentative=maintenant + DUREE_RESERVATION
+        )
+    return list(
+        EnvoiEmail.objects
+        .filter(id__in=ids)
+        .select_related('commande__client')
+        .prefetch_related('commande__formations')
+    )
+
+
+def traiter_lot(taille=None, debit=None):
+    '''
+    Envoie un lot d'emails sur une seule connexion SMTP, à `debit`
+    emails/seconde au plus (EMAIL_OUTBOX_DEBIT par défaut, 0 = illimité)
+    Retourne le couple (nombre envoyés, nombre en échec)
+    '''
+    if debit is None:
+        debit = settings.EMAIL_OUTBOX_DEBIT
+    intervalle = 1 / debit if debit > 0 else 0
+    lot = reserver_lot(taille or settings.EMAIL_OUTBOX_TAILLE_LOT)
+    if not lot:
+        return 0, 0
+
+    envoyes = echecs = 0
+    connection = get_connection(fail_silently=False)
+    try:
+        with mesurer('smtp'):
+            connection.open()
+    except Exception as e:
+        # Serveur SMTP injoignable : tout le lot est replanifié
+        for envoi in lot:
+            enregistrer_echec(envoi, e)
+        return 0, len(lot)
+
+    try:
+        for envoi in lot:
+            debut = time.monotonic()
+            if envoyer(envoi, connection):
+                envoyes += 1
+            else:
+                echecs += 1
+            if intervalle:
+                time.sleep(max(0, intervalle - (time.monotonic() - debut)))
+    finally:
+        connection.close()
+    return envoyes, echecs
+
+
+def envoyer(envoi, connection):
+    '''Envoie un email de la file et enregistre le résultat'''
+    try:
+        message = construire_email_acces(envoi.commande, connection=connection)
+        with mesurer('smtp'):
+            message.send()
+    except Exception as e:
+        enregistrer_echec(envoi, e)
+        return False
+
+    with transaction.atomic():
+        envoi.tentatives += 1
+        envoi.statut = 'envoye'
+        envoi.date_envoi = timezone.now()
+        envoi.derniere_erreur = ''
+        envoi.save(update_fields=['tentatives', 'derniere_erreur', 'statut', 'date_envoi'])
+        if envoi.commande.statut == 'paye':
+            envoi.commande.marquer_acces_envoye(origine='email')
+    return True
+
+
+def enregistrer_echec(envoi, erreur):
+    '''Replanifie un envoi avec backoff, ou l'abandonne après trop d'échecs'''
+    envoi.tentatives += 1
+    envoi.derniere_erreur = f"{type(erreur).__name__}: {erreur}"
+    logger.warning(
+        "Échec d'envoi de l'email d'accès (tentative %d) : %s", envoi.tentatives, envoi.derniere_erreur,
+        extra={'commande_id': envoi.commande_id}
+    )
+    if envoi.tentatives >= settings.EMAIL_OUTBOX_MAX_TENTATIVES:
+        # Lettre morte : visible dans l'admin, relançable manuellement
+        envoi.statut = 'abandonne'
+    else:
+        envoi.prochaine_tentative = timezone.now() + delai_avant_nouvel_essai(envoi.tentatives)
+    envoi.save(update_fields=['tentatives', 'derniere_erreur', 'statut', 'prochaine_tentative'])
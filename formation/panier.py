@@ -0,0 +1,93 @@
+import hashlib
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Sum
+
+from .cache import formations_actives, cle_catalogue
+from .models import Formation
+
+
+SESSION_KEY = 'panier'
+
+
+def formations_par_id():
+    '''Formations actives indexées par id, tirées du cache du catalogue'''
+    return {formation.id: formation for formation in formations_actives()}
+
+
+class Panier:
+    '''
+    Panier stocké en session sous forme de liste d'ids de formations
+    Titres et prix ne sont pas copiés en session : ils sont lus dans le
+    cache du catalogue. La session n'est réécrite que si le contenu change
+    '''
+
+    def __init__(self, request):
+        self.session = request.session
+        contenu = self.session.get(SESSION_KEY) or []
+        # Ancien format : {id: {'titre', 'prix'}} ; converti sans réécriture
+        self.ids = [int(formation_id) for formation_id in contenu]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, formation_id):
+        return formation_id in self.ids
+
+    def ajouter(self, formation_id):
+        '''Retourne False si la formation était déjà dans le panier'''
+        if formation_id in self.ids:
+            return False
+        self.ids.append(formation_id)
+        self.enregistrer()
+        return True
+
+    def retirer(self, formation_id):
+        '''Retourne False si la formation n'était pas dans le panier'''
+        if formation_id not in self.ids:
+            return False
+        self.ids.remove(formation_id)
+        self.enregistrer()
+        return True
+
+    def vider(self):
+        if self.ids or SESSION_KEY in self.session:
+            self.ids = []
+            self.session.pop(SESSION_KEY, None)
+
+    def enregistrer(self):
+        self.session[SESSION_KEY] = self.ids
+
+    def formations(self):
+        '''Formations du panier encore actives, dans l'ordre d'ajout'''
+        catalogue = formations_par_id()
+        return [catalogue[formation_id] for formation_id in self.ids if formation_id in catalogue]
+
+    def empreinte(self):
+        '''
+        Identifie le contenu du panier (ETag, clés de cache, reprise du
+        checkout) : seules les formations encore actives comptent
+        '''
+        ids = ','.join(str(formation.id) for formation in sorted(self.formations(), key=lambda f: f.id))
+        return hashlib.sha256(ids.encode('utf-8')).hexdigest()[:12]
+
+    def total(self):
+        '''
+        Somme des prix des formations actives du panier, calculée en base
+        (SUM) et mise en cache pour la version courante du catalogue :
+        toute modification d'une formation change la clé
+        '''
+        if not self.ids:
+            return Decimal('0')
+        cle = cle_catalogue(f'panier:total:{self.empreinte()}')
+        total = cache.get(cle)
+        if total is None:
+            total = (
+                Formation.objects
+                .filter(id__in=self.ids, active=True)
+                .aggregate(total=Sum('prix'))['total']
+            ) or Decimal('0')
+            cache.set(cle, total, settings.CATALOGUE_CACHE_TIMEOUT)
+        return total
@@ -0,0 +1,148 @@
+'''
+Recherche plein texte sur les formations
+- PostgreSQL : colonne vecteur_recherche (tsvector pondéré titre > description,
+  configuration 'french') indexée en GIN, classement par ts_rank
+- SQLite (développement) : table virtuelle FTS5 formation_recherche,
+  classement par bm25
+- autres bases : repli sur icontains, sans classement
+L'index est tenu à jour formation par formation par les signaux
+'''
+import hashlib
+import re
+import unicodedata
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import F, Q
+
+from .cache import cle_catalogue, formations_actives
+from .models import Formation
+
+
+TABLE_FTS5 = 'formation_recherche'
+LONGUEUR_MAX_REQUETE = 200
+
+
+def vecteur_formation():
+    '''Expression du tsvector d'une formation (titre prioritaire)'''
+    return (
+        SearchVector('titre', weight='A', config='french')
+        + SearchVector('description', weight='B', config='french')
+    )
+
+
+def indexer_formation(formation):
+    '''Met à jour l'entrée d'une formation dans l'index de recherche'''
+    if connection.vendor == 'postgresql':
+        Formation.objects.filter(pk=formation.pk).update(vecteur_recherche=vecteur_formation())
+    elif connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {TABLE_FTS5} WHERE rowid = %s', [formation.pk])
+            cursor.execute(
+                f'INSERT INTO {TABLE_FTS5} (rowid, titre, description) VALUES (%s, %s, %s)',
+                [formation.pk, formation.titre, formation.description]
+            )
+
+
+def desindexer_formation(formation_id):
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {TABLE_FTS5} WHERE rowid = %s', [formation_id])
+
+
+def normaliser(requete):
+    '''
+    Forme canonique d'une requête, utilisée telle quelle pour chercher et
+    comme clé de cache : minuscules, ponctuation et espaces superflus
+    retirés (les accents sont gérés par chaque moteur)
+    '''
+    requete = unicodedata.normalize('NFC', requete[:LONGUEUR_MAX_REQUETE].lower())
+    return ' '.join(re.findall(r'\w+', requete))
+
+
+def _ids_postgresql(requete, formations):
+    recherche = SearchQuery(requete, config='french', search_type='websearch')
+    return list(
+        formations
+        .filter(vecteur_recherche=recherche)
+        .annotate(rang=SearchRank(F('vecteur_recherche'), recherche))
+        .order_by('-rang', '-date_creation')
+        .values_list('id', flat=True)
+    )
+
+
+def _ids_sqlite(requete, formations):
+    # Chaque mot devient un préfixe entre guillemets : aucun opérateur FTS5
+    # ne peut être injecté, et "form" trouve "formation"
+    expression = ' '.join(f'"{mot}"*' for mot in requete.split())
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM {TABLE_FTS5} WHERE {TABLE_FTS5} MATCH %s '
+            f'ORDER BY bm25({TABLE_FTS5}, 10.0, 1.0)',
+            [expression]
+        )
+        classement = [ligne[0] for ligne in cursor.fetchall()]
+    retenus = set(formations.filter(id__in=classement).values_list('id', flat=True))
+    return [formation_id for formation_id in classement if formation_id in retenus]
+
+
+def _ids_generique(requete, formations):
+    filtre = Q()
+    for mot in requete.split():
+        filtre &= Q(titre__icontains=mot) | Q(description__icontains=mot)
+    return list(formations.filter(filtre).values_list('id', flat=True))
+
+
+def _cle_cache(requete, actives):
+    '''Même clé quels que soient l'ordre et la répétition des mots'''
+    mots = ' '.join(sorted(set(requete.split())))
+    empreinte = hashlib.sha256(mots.encode('utf-8')).hexdigest()[:16]
+    return cle_catalogue(f'recherche:{"actives" if actives else "toutes"}:{empreinte}')
+
+
+def _requete_frequente(cle):
+    '''
+    Compte les occurrences d'une requête sur RECHERCHE_CACHE_FENETRE secondes :
+    une requête rare (faute de frappe, recherche isolée de l'admin) ne laisse
+    qu'un compteur éphémère au lieu d'un résultat gardé une heure
+    '''
+    compteur = cle + ':vues'
+    if cache.add(compteur, 1, settings.RECHERCHE_CACHE_FENETRE):
+        return settings.RECHERCHE_CACHE_SEUIL <= 1
+    try:
+        return cache.incr(compteur) >= settings.RECHERCHE_CACHE_SEUIL
+    except ValueError:
+        # Compteur expiré entre add et incr
+        return False
+
+
+def rechercher_ids(requete, actives=True):
+    '''
+    Ids des formations correspondant à la requête (actives seulement par
+    défaut), les plus pertinentes d'abord ; le résultat des requêtes
+    répétées est mis en cache pour la version courante du catalogue
+    '''
+    requete = normaliser(requete)
+    if not requete:
+        return []
+    cle = _cle_cache(requete, actives)
+    ids = cache.get(cle)
+    if ids is None:
+        formations = Formation.objects.filter(active=True) if actives else Formation.objects.all()
+        if connection.vendor == 'postgresql':
+            ids = _ids_postgresql(requete, formations)
+        elif connection.vendor == 'sqlite':
+            ids = _ids_sqlite(requete, formations)
+        else:
+            ids = _ids_generique(requete, formations)
+        if _requete_frequente(cle):
+            cache.set(cle, ids, settings.CATALOGUE_CACHE_TIMEOUT)
+    return ids
+
+
+def rechercher(requete):
+    '''Formations actives correspondant à la requête, par pertinence'''
+    catalogue = {formation.id: formation for formation in formations_actives()}
+    return [catalogue[i] for i in rechercher_ids(requete) if i in catalogue]
@@ -0,0 +1,56 @@
+import logging
+
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .cache import invalider_catalogue
+from .models import Formation
+from .images import generer_variantes, supprimer_variantes, variantes_a_jour
+from .recherche import indexer_formation, desindexer_formation
+
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=Formation)
+@receiver(post_delete, sender=Formation)
+def formation_modifiee(sender, instance, **kwargs):
+    '''
+    Invalide le cache du catalogue à chaque création, modification ou
+    suppression d'une formation (y compris la case "Active" éditée
+    directement dans la liste de l'admin)
+    '''
+    invalider_catalogue()
+
+
+@receiver(post_save, sender=Formation)
+def formation_enregistree(sender, instance, raw=False, **kwargs):
+    '''Réindexe la formation pour la recherche plein texte'''
+    if not raw:
+        indexer_formation(instance)
+
+
+@receiver(post_delete, sender=Formation)
+def formation_supprimee(sender, instance, **kwargs):
+    desindexer_formation(instance.pk)
+
+
+@receiver(post_save, sender=Formation)
+def image_enregistree(sender, instance, raw=False, **kwargs):
+    '''Génère les déclinaisons responsives quand une nouvelle image est uploadée'''
+    if raw or variantes_a_jour(instance):
+        return
+    try:
+        generer_variantes(instance)
+    except Exception:
+        # Une image illisible ne doit pas empêcher l'enregistrement :
+        # le catalogue retombe sur l'image d'origine
+        logger.exception("Échec de la génération des déclinaisons", extra={'formation_id': instance.pk})
+        return
+    invalider_catalogue()
+
+
+@receiver(post_delete, sender=Formation)
+def image_supprimee(sender, instance, **kwargs):
+    if instance.variantes_image:
+        supprimer_variantes(instance.variantes_image, instance.image.storage)
@@ -0,0 +1,428 @@
+'''
+Benchmark du tunnel d'achat
+catalogue → ajout au panier → panier → checkout → webhook (réception puis
+traitement différé) → callback,
+joué avec le client de test Django contre le faux serveur Moneroo
+
+Joué sous le lanceur de tests (base de test jetable), à petite échelle par
+défaut et en grandeur réelle via BENCH_ITERATIONS, voir test_bench
+'''
+import hashlib
+import hmac
+import json
+import platform
+import random
+import statistics
+import time
+import tracemalloc
+from decimal import Decimal
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import Client as ClientHttp, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from django.utils import timezone
+
+from formation.models import Formation, Client, Commande
+from formation.tests.moneroo_stub import MonerooStub
+from formation.utils import construire_email_acces
+from formation.webhooks import traiter_lot as traiter_webhooks
+
+
+ETAPES = [
+    'catalogue', 'ajouter_panier', 'panier', 'checkout', 'checkout_post',
+    'webhook', 'webhook_differe', 'callback',
+]
+
+
+def peupler(nb_formations, nb_clients, nb_commandes, graine=42):
+    '''Crée un jeu de données reproductible'''
+    aleatoire = random.Random(graine)
+    formations = Formation.objects.bulk_create([
+        Formation(
+            titre=f'Formation {i}',
+            description=f'Description de la formation {i}. ' * 20,
+            prix=Decimal(aleatoire.randrange(5000, 50000, 500)),
+            lien_drive=f'https://drive.example.com/{i}',
+        )
+        for i in range(nb_formations)
+    ], batch_size=500)
+    clients = Client.objects.bulk_create([
+        Client(nom_complet=f'Client {i}', whatsapp=f'+2420600{i:05d}', email=f'client{i}@example.com')
+        for i in range(nb_clients)
+    ], batch_size=500)
+    if not clients:
+        return formations
+
+    statuts = [s for s, _ in Commande.STATUT_CHOICES]
+    commandes = Commande.objects.bulk_create([
+        Commande(
+            client=aleatoire.choice(clients),
+            montant_total=Decimal(10000),
+            statut=aleatoire.choice(statuts),
+            moneroo_transaction_id=f'py_seed_{i}',
+        )
+        for i in range(nb_commandes)
+    ], batch_size=500)
+    Through = Commande.formations.through
+    Through.objects.bulk_create([
+        Through(commande_id=commande.id, formation_id=formation.id)
+        for commande in commandes
+        for formation in aleatoire.sample(formations, min(3, len(formations)))
+    ], batch_size=1000)
+    return formations
+
+
+def percentile(valeurs, p):
+    if not valeurs:
+        return 0.0
+    valeurs = sorted(valeurs)
+    rang = (len(valeurs) - 1) * p / 100
+    bas = int(rang)
+    haut = min(bas + 1, len(valeurs) - 1)
+    return valeurs[bas] + (valeurs[haut] - valeurs[bas]) * (rang - bas)
+
+
+class Tunnel:
+    '''Joue le tunnel d'achat et collecte les mesures par étape'''
+
+    def __init__(self, formations, stub, graine=42, allocations=False):
+        self.formations = formations
+        self.stub = stub
+        self.aleatoire = random.Random(graine)
+        self.allocations = allocations
+        self.mesures = {etape: {'ms': [], 'sql': [], 'alloc_ko': []} for etape in ETAPES}
+
+    def mesurer(self, etape, appel):
+        if self.allocations:
+            tracemalloc.reset_peak()
+            avant = tracemalloc.get_traced_memory()[0]
+        with CaptureQueriesContext(connection) as requetes:
+            debut = time.perf_counter()
+            response = appel()
+            duree = time.perf_counter() - debut
+        mesure = self.mesures[etape]
+        mesure['ms'].append(duree * 1000)
+        mesure['sql'].append(len(requetes))
+        if self.allocations:
+            mesure['alloc_ko'].append((tracemalloc.get_traced_memory()[1] - avant) / 1024)
+        return response
+
+    def parcours(self, numero):
+        navigateur = ClientHttp()
+        options = {'secure': True}
+
+        self.mesurer('catalogue', lambda: navigateur.get('/', **options))
+        for formation in self.aleatoire.sample(self.formations, min(3, len(self.formations))):
+            self.mesurer('ajouter_panier', lambda: navigateur.post(f'/panier/ajouter/{formation.id}/', **options))
+        self.mesurer('panier', lambda: navigateur.get('/panier/', **options))
+        self.mesurer('checkout', lambda: navigateur.get('/checkout/', **options))
+        response = self.mesurer('checkout_post', lambda: navigateur.post('/checkout/', {
+            'nom_complet': f'Acheteur {numero}',
+            'whatsapp': '+242061234567',
+            'email': f'acheteur{numero}@example.com',
+        }, **options))
+        if response.status_code != 302:
+            raise RuntimeError(f"Checkout en échec (HTTP {response.status_code})")
+
+        commande = Commande.objects.filter(client__email=f'acheteur{numero}@example.com').latest('id')
+        # L'acheteur paie sur Moneroo : le webhook et le callback le vérifient
+        self.stub.statuts[commande.moneroo_transaction_id] = 'success'
+        corps = json.dumps({
+            'event': 'payment.success',
+            'data': {
+                'id': commande.moneroo_transaction_id,
+                'status': 'success',
+                'metadata': {'commande_id': str(commande.id)},
+            },
+        }).encode('utf-8')
+        entetes = {}
+        if settings.MONEROO_WEBHOOK_SECRET:
+            entetes['HTTP_X_MONEROO_SIGNATURE'] = hmac.new(
+                settings.MONEROO_WEBHOOK_SECRET.encode('utf-8'), corps, hashlib.sha256
+            ).hexdigest()
+        self.mesurer('webhook', lambda: ClientHttp().post(
+            '/moneroo/webhook/', corps, content_type='application/json', **entetes, **options
+        ))
+        # Second temps du webhook, normalement joué par le worker traiter_webhooks
+        self.mesurer('webhook_differe', traiter_webhooks)
+        self.mesurer('callback', lambda: navigateur.get(
+            f'/paiement/callback/{commande.id}/',
+            {'paymentStatus': 'success', 'paymentId': commande.moneroo_transaction_id},
+            **options
+        ))
+
+    def rapport(self):
+        resultat = {}
+        for etape, mesure in self.mesures.items():
+            if not mesure['ms']:
+                continue
+            resultat[etape] = {
+                'n': len(mesure['ms']),
+                'p50_ms': round(percentile(mesure['ms'], 50), 3),
+                'p95_ms': round(percentile(mesure['ms'], 95), 3),
+                'p99_ms': round(percentile(mesure['ms'], 99), 3),
+                'sql_moyen': round(statistics.mean(mesure['sql']), 2),
+                'sql_max': max(mesure['sql']),
+            }
+            if mesure['alloc_ko']:
+                resultat[etape]['alloc_ko_moyen'] = round(statistics.mean(mesure['alloc_ko']), 1)
+        return resultat
+
+
+# Requêtes réelles de l'application et l'index que chacune doit utiliser
+REQUETES_INDEXEES = {
+    'catalogue': (
+        lambda: Formation.objects.filter(active=True).order_by('-date_creation'),
+        'formation_active_recent_idx',
+    ),
+    'checkout_client': (
+        lambda: Client.objects.filter(email__lower='client1@example.com'),
+        'client_email_ci_unique',
+    ),
+    'admin_statut': (
+        lambda: Commande.objects.filter(statut='paye').order_by('-date_commande')[:100],
+        'commande_statut_date_idx',
+    ),
+    'admin_date_paiement': (
+        # Comptage du filtre de date de l'admin (sans tri)
+        lambda: Commande.objects.filter(date_paiement__gte=timezone.now()).order_by(),
+        'commande_paiement_idx',
+    ),
+    'transaction': (
+        lambda: Commande.objects.filter(moneroo_transaction_id='py_seed_1'),
+        'commande_transaction_idx',
+    ),
+}
+
+
+def verifier_index():
+    '''
+    Passe chaque requête de REQUETES_INDEXEES à EXPLAIN et vérifie que le
+    plan utilise l'index attendu. Sur PostgreSQL, les parcours séquentiels
+    sont désactivés le temps de la vérification : sur une base de test de
+    quelques milliers de lignes le planificateur les préférerait, alors
+    qu'on veut prouver que l'index est utilisable pour la forme de requête
+    Retourne {nom: {'index', 'utilise', 'plan'}}
+    '''
+    resultats = {}
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        for nom, (requete, index) in REQUETES_INDEXEES.items():
+            noms = index if isinstance(index, tuple) else (index,)
+            plan = requete().explain()
+            resultats[nom] = {'index': index, 'utilise': any(n in plan for n in noms), 'plan': plan}
+    return resultats
+
+
+def mesurer_rendu_email(tailles=(1, 10, 50), iterations=20):
+    '''
+    Temps de rendu de l'email d'accès (texte + HTML) selon le nombre de
+    formations de la commande : à froid (blocs par formation absents du
+    cache) puis à chaud (blocs déjà rendus par une commande précédente)
+    '''
+    client = Client.objects.create(
+        nom_complet='Lecteur <Email>', whatsapp='+242060000000', email='bench-email@example.com'
+    )
+    formations = Formation.objects.bulk_create([
+        Formation(
+            titre=f'Formation email {i} <&>',
+            description='...',
+            prix=Decimal(10000),
+            lien_youtube=f'https://youtube.example.com/{i}' if i % 2 else '',
+            lien_drive=f'https://drive.example.com/email/{i}',
+        )
+        for i in range(max(tailles))
+    ])
+    resultats = {}
+    for taille in tailles:
+        commande = Commande.objects.create(client=client, montant_total=Decimal(10000 * taille))
+        commande.formations.add(*formations[:taille])
+        commande = Commande.objects.with_details().get(id=commande.id)
+
+        froid, chaud = [], []
+        for _ in range(iterations):
+            cache.clear()
+            debut = time.perf_counter()
+            construire_email_acces(commande)
+            froid.append((time.perf_counter() - debut) * 1000)
+            debut = time.perf_counter()
+            construire_email_acces(commande)
+            chaud.append((time.perf_counter() - debut) * 1000)
+        resultats[str(taille)] = {
+            'froid_p50_ms': round(percentile(froid, 50), 3),
+            'chaud_p50_ms': round(percentile(chaud, 50), 3),
+            'chaud_p95_ms': round(percentile(chaud, 95), 3),
+        }
+    return resultats
+
+
+MOTEURS_SESSION = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+
+
+def mesurer_ecritures_session(formations, visiteurs=20, acheteurs=10):
+    '''
+    Requêtes SQL sur django_session par moteur de session
+    - navigation : visiteurs qui parcourent catalogue et panier vide
+    - panier : acheteurs qui ajoutent 3 formations (dont un doublon) puis
+      retirent une formation absente ; seuls 2 ajouts modifient le panier
+    Retourne {moteur: {'ecritures_navigation', 'ecritures_panier',
+    'ecritures_par_modification', 'lectures'}}
+    '''
+    options = {'secure': True}
+    ids = [formation.id for formation in formations[:2]]
+    resultats = {}
+    for nom, moteur in MOTEURS_SESSION.items():
+        with override_settings(SESSION_ENGINE=moteur):
+            cache.clear()
+            with CaptureQueriesContext(connection) as navigation:
+                for _ in range(visiteurs):
+                    navigateur = ClientHttp()
+                    navigateur.get('/', **options)
+                    navigateur.get('/panier/', **options)
+                    navigateur.get('/panier/compteur/', **options)
+            with CaptureQueriesContext(connection) as achats:
+                for _ in range(acheteurs):
+                    navigateur = ClientHttp()
+                    navigateur.get('/', **options)
+                    for formation_id in ids + ids[:1]:
+                        navigateur.post(f'/panier/ajouter/{formation_id}/', **options)
+                    navigateur.get('/panier/', **options)
+                    navigateur.post('/panier/retirer/0/', **options)
+
+        def compter(requetes, ecriture):
+            return sum(
+                1 for r in requetes
+                if 'django_session' in r['sql'] and r['sql'].startswith(ecriture)
+            )
+
+        ecritures = ('INSERT', 'UPDATE', 'DELETE')
+        ecritures_panier = compter(achats, ecritures)
+        resultats[nom] = {
+            'ecritures_navigation': compter(navigation, ecritures),
+            'ecritures_panier': ecritures_panier,
+            'ecritures_par_modification': round(ecritures_panier / (acheteurs * len(ids)), 2),
+            'lectures': compter(navigation, 'SELECT') + compter(achats, 'SELECT'),
+        }
+    return resultats
+
+
+def executer(nb_formations=20, nb_clients=100, nb_commandes=500, iterations=50, graine=42):
+    '''
+    Peuple la base (qui doit être une base de test) et joue le tunnel
+    `iterations` fois, puis une seconde passe plus courte sous tracemalloc
+    pour mesurer les allocations par requête
+    '''
+    cache.clear()
+    formations = peupler(nb_formations, nb_clients, nb_commandes, graine)
+
+    with MonerooStub() as stub, override_settings(MONEROO_API_URL=stub.url):
+        tunnel = Tunnel(formations, stub, graine)
+        # Une itération d'échauffement (caches, imports) non comptée
+        Tunnel(formations, stub, graine).parcours('echauffement')
+        for i in range(iterations):
+            tunnel.parcours(i)
+        rapport = tunnel.rapport()
+
+        tracemalloc.start()
+        try:
+            passe_alloc = Tunnel(formations, stub, graine, allocations=True)
+            for i in range(max(iterations // 5, 1)):
+                passe_alloc.parcours(f'alloc{i}')
+        finally:
+            tracemalloc.stop()
+        for etape, valeurs in passe_alloc.rapport().items():
+            rapport[etape]['alloc_ko_moyen'] = valeurs.get('alloc_ko_moyen')
+
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+    index = {nom: r['utilise'] for nom, r in verifier_index().items()}
+    emails = mesurer_rendu_email(iterations=max(iterations // 5, 1))
+    sessions = mesurer_ecritures_session(formations)
+
+    return {
+        'parametres': {
+            'formations': nb_formations,
+            'clients': nb_clients,
+            'commandes': nb_commandes,
+            'iterations': iterations,
+            'graine': graine,
+        },
+        'environnement': {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'base': connection.vendor,
+        },
+        'etapes': rapport,
+        'index': index,
+        'emails': emails,
+        'sessions': sessions,
+    }
+
+
+def comparer(reference, actuel, tolerance=0.25):
+    '''
+    Compare deux rapports ; retourne la liste des régressions
+    - latence p95 au-delà de reference × (1 + tolerance)
+    - nombre de requêtes SQL supérieur à la référence (déterministe)
+    - index attendu absent du plan d'exécution
+    '''
+    regressions = [
+        f"{nom} : l'index attendu n'est plus utilisé"
+        for nom, utilise in actuel.get('index', {}).items()
+        if not utilise
+    ]
+    for etape, ref in reference['etapes'].items():
+        act = actuel['etapes'].get(etape)
+        if act is None:
+            continue
+        if act['p95_ms'] > ref['p95_ms'] * (1 + tolerance):
+            regressions.append(
+                f"{etape} : p95 {act['p95_ms']:.1f} ms > {ref['p95_ms']:.1f} ms (+{tolerance:.0%})"
+            )
+        if act['sql_max'] > ref['sql_max']:
+            regressions.append(
+                f"{etape} : {act['sql_max']} requêtes SQL > {ref['sql_max']}"
+            )
+    return regressions
+
+
+def formater(rapport):
+    '''Tableau lisible du rapport, une chaîne par ligne'''
+    lignes = [
+        f"{'étape':<16}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+        f"{'SQL moy':>10}{'SQL max':>9}{'alloc Ko':>10}"
+    ]
+    for etape, m in rapport['etapes'].items():
+        lignes.append(
+            f"{etape:<16}{m['n']:>6}{m['p50_ms']:>10.2f}{m['p95_ms']:>10.2f}{m['p99_ms']:>10.2f}"
+            f"{m['sql_moyen']:>10.2f}{m['sql_max']:>9}{m.get('alloc_ko_moyen') or 0:>10.1f}"
+        )
+    if rapport.get('emails'):
+        lignes.append(f"\n{'email (formations)':<20}{'froid p50':>12}{'chaud p50':>12}{'chaud p95':>12}")
+        for taille, m in rapport['emails'].items():
+            lignes.append(
+                f"{taille:<20}{m['froid_p50_ms']:>12.2f}{m['chaud_p50_ms']:>12.2f}{m['chaud_p95_ms']:>12.2f}"
+            )
+    if rapport.get('sessions'):
+        lignes.append(
+            f"\n{'session':<16}{'écr. navigation':>17}{'écr. panier':>13}{'écr./modif.':>13}{'lectures':>10}"
+        )
+        for moteur, m in rapport['sessions'].items():
+            lignes.append(
+                f"{moteur:<16}{m['ecritures_navigation']:>17}{m['ecritures_panier']:>13}"
+                f"{m['ecritures_par_modification']:>13.2f}{m['lectures']:>10}"
+            )
+    for nom, utilise in rapport.get('index', {}).items():
+        etat = 'index utilisé' if utilise else "PAS D'INDEX"
+        lignes.append(f"EXPLAIN {nom:<22}{etat}")
+    return lignes
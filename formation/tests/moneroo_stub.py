@@ -0,0 +1,103 @@
+'''
+Faux serveur Moneroo local pour les tests et les benchmarks
+Il répond aux deux endpoints utilisés par formation.utils :
+POST /v1/payments/initialize et GET /v1/payments/<id>
+'''
+import json
+import threading
+import time
+import uuid
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class _Serveur(ThreadingHTTPServer):
+    # File d'attente d'acceptation assez longue pour des rafales de
+    # connexions simultanées (client asynchrone, benchmarks)
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class MonerooStub:
+    '''
+    Usage :
+        with MonerooStub() as stub:
+            stub.statuts['tx_1'] = 'success'
+            stub.erreurs = [503]  # codes HTTP renvoyés aux prochains appels
+            with override_settings(MONEROO_API_URL=stub.url): ...
+    '''
+
+    def __init__(self, statut_par_defaut='pending', latence=0.0):
+        self.statuts = {}
+        self.statut_par_defaut = statut_par_defaut
+        self.latence = latence
+        self.appels = {'initialize': 0, 'verification': 0}
+        self.erreurs = []
+        self._lock = threading.Lock()
+        self.serveur = _Serveur(('127.0.0.1', 0), self._handler())
+        self.url = f'http://127.0.0.1:{self.serveur.server_port}/v1'
+        self._thread = None
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serveur.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.serveur.shutdown()
+        self.serveur.server_close()
+
+    def compter(self, nom):
+        '''Compte l'appel ; retourne le code d'erreur à simuler, s'il y en a un'''
+        with self._lock:
+            self.appels[nom] += 1
+            return self.erreurs.pop(0) if self.erreurs else None
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def repondre(self, code, donnees):
+                corps = json.dumps(donnees).encode('utf-8')
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(corps)))
+                self.end_headers()
+                self.wfile.write(corps)
+
+            def do_POST(self):
+                longueur = int(self.headers.get('Content-Length') or 0)
+                payload = json.loads(self.rfile.read(longueur) or b'{}')
+                if stub.latence:
+                    time.sleep(stub.latence)
+                if self.path.rstrip('/') != '/v1/payments/initialize':
+                    return self.repondre(404, {'message': 'Not found'})
+                if erreur := stub.compter('initialize'):
+                    return self.repondre(erreur, {'message': 'Erreur simulée'})
+                transaction_id = f'py_{uuid.uuid4().hex[:12]}'
+                with stub._lock:
+                    stub.statuts.setdefault(transaction_id, stub.statut_par_defaut)
+                self.repondre(201, {'data': {
+                    'id': transaction_id,
+                    'checkout_url': f'https://checkout.moneroo.test/{transaction_id}',
+                    'metadata': payload.get('metadata', {}),
+                }})
+
+            def do_GET(self):
+                if stub.latence:
+                    time.sleep(stub.latence)
+                prefixe = '/v1/payments/'
+                if not self.path.startswith(prefixe):
+                    return self.repondre(404, {'message': 'Not found'})
+                if erreur := stub.compter('verification'):
+                    return self.repondre(erreur, {'message': 'Erreur simulée'})
+                transaction_id = self.path[len(prefixe):].strip('/')
+                statut = stub.statuts.get(transaction_id, stub.statut_par_defaut)
+                self.repondre(200, {'data': {'id': transaction_id, 'status': statut}})
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
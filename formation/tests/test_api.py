@@ -0,0 +1,58 @@
+import gzip
+import json
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from formation.models import Formation
+
+
+class ApiFormationsTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        Formation.objects.bulk_create([
+            Formation(titre=f'Formation {i}', description='x' * 1000, prix=1000 + i, lien_drive='https://drive.example.com')
+            for i in range(7)
+        ])
+        # Dates de création identiques : le curseur départage par id
+        Formation.objects.update(date_creation=Formation.objects.first().date_creation)
+        Formation.objects.filter(titre='Formation 6').update(active=False)
+
+    def get(self, url='/api/formations/', **params):
+        return self.client.get(url, params, secure=True)
+
+    def test_pagination_par_curseur(self):
+        titres = []
+        url, params = '/api/formations/', {'limite': 4}
+        while url:
+            donnees = self.get(url, **params).json()
+            titres += [f['titre'] for f in donnees['resultats']]
+            url, params = donnees['suivant'], {}
+
+        self.assertEqual(len(titres), 6)
+        self.assertEqual(len(set(titres)), 6)
+
+    def test_projection_des_champs(self):
+        formation = self.get(fields='id,prix').json()['resultats'][0]
+
+        self.assertEqual(set(formation), {'id', 'prix'})
+        self.assertNotIn('lien_drive', self.get().json()['resultats'][0])
+        self.assertEqual(self.get(fields='lien_drive').status_code, 400)
+        self.assertEqual(self.get(curseur='???').status_code, 400)
+
+    def test_etag_et_gzip(self):
+        response = self.client.get('/api/formations/', secure=True, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(len(json.loads(gzip.decompress(response.content))['resultats']), 6)
+
+        response = self.client.get(
+            '/api/formations/', secure=True, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag']
+        )
+        self.assertEqual(response.status_code, 304)
+
+        Formation.objects.first().save()
+        response = self.client.get(
+            '/api/formations/', secure=True, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag']
+        )
+        self.assertEqual(response.status_code, 200)
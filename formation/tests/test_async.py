@@ -0,0 +1,125 @@
+import asyncio
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from django.test import TestCase, override_settings
+from django.urls import include, path
+
+from formation import views
+from formation.models import Formation, Client, Commande, EnvoiEmail, WebhookEvent
+from formation.tests.moneroo_stub import MonerooStub
+from formation.utils import creer_paiement_moneroo_async
+from formation.webhooks import traiter_lot
+
+
+# Routage d'un déploiement ASGI (SERVEUR_ASGI=True) : les vues de paiement
+# async masquent les vues synchrones, le reste du site est inchangé
+urlpatterns = [
+    path('checkout/', views.checkout_async_view, name='checkout'),
+    path('paiement/callback/<int:commande_id>/', views.paiement_callback_async_view, name='paiement_callback'),
+    path('moneroo/webhook/', views.moneroo_webhook_async, name='moneroo_webhook'),
+    path('', include('config.urls')),
+]
+
+
+@override_settings(ROOT_URLCONF='formation.tests.test_async')
+class VuesAsyncTests(TestCase):
+    '''Tunnel de paiement servi par les vues async, via le gestionnaire ASGI'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.formation = Formation.objects.create(
+            titre='Django async', description='...', prix=5000, lien_drive='https://drive.example.com'
+        )
+        cls.client_obj = Client.objects.create(
+            nom_complet='Jean Dupont', whatsapp='+242061234567', email='jean@example.com'
+        )
+
+    async def test_checkout_redirige_vers_moneroo(self):
+        with MonerooStub() as stub, override_settings(MONEROO_API_URL=stub.url):
+            await self.async_client.post(f'/panier/ajouter/{self.formation.id}/', secure=True)
+            response = await self.async_client.post('/checkout/', {
+                'nom_complet': 'Awa Diallo', 'email': 'awa@example.com', 'whatsapp': '+242065550000',
+            }, secure=True)
+
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].startswith('https://checkout.moneroo.test/'))
+        self.assertIn('X-Request-ID', response)
+        commande = await Commande.objects.select_related('client').aget(client__email='awa@example.com')
+        self.assertEqual(commande.moneroo_payment_url, response['Location'])
+        self.assertEqual(stub.appels['initialize'], 1)
+
+    async def test_checkout_moneroo_indisponible(self):
+        with override_settings(MONEROO_API_URL='http://127.0.0.1:9/v1', MONEROO_RETRIES=0):
+            await self.async_client.post(f'/panier/ajouter/{self.formation.id}/', secure=True)
+            response = await self.async_client.post('/checkout/', {
+                'nom_complet': 'Awa Diallo', 'email': 'awa@example.com', 'whatsapp': '+242065550000',
+            }, secure=True)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(await Commande.objects.filter(client__email='awa@example.com').aexists())
+
+    async def test_webhook_puis_callback(self):
+        commande = await Commande.objects.acreate(
+            client=self.client_obj, montant_total=5000, moneroo_transaction_id='py_async'
+        )
+        await commande.formations.aadd(self.formation)
+        corps = json.dumps({'event': 'payment.success', 'data': {
+            'id': 'py_async', 'status': 'success', 'metadata': {'commande_id': str(commande.id)},
+        }})
+
+        with MonerooStub(statut_par_defaut='success') as stub, override_settings(MONEROO_API_URL=stub.url):
+            for _ in range(2):
+                response = await self.async_client.post(
+                    '/moneroo/webhook/', corps, content_type='application/json', secure=True
+                )
+                self.assertEqual(response.status_code, 200)
+            self.assertEqual(await sync_to_async(traiter_lot)(), (2, 0))
+            response = await self.async_client.get(f'/paiement/callback/{commande.id}/', secure=True)
+        self.assertEqual(stub.appels['verification'], 1)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, f'#{commande.id}')
+        self.assertEqual(await WebhookEvent.objects.filter(commande_id=commande.id).acount(), 1)
+        self.assertEqual(await EnvoiEmail.objects.filter(commande_id=commande.id).acount(), 1)
+
+    async def test_callback_commande_inconnue(self):
+        response = await self.async_client.get('/paiement/callback/999999/', secure=True)
+        self.assertEqual(response.status_code, 404)
+
+
+class ClientAsyncTests(TestCase):
+    '''Les initialisations de paiement en vol ne se bloquent pas entre elles'''
+
+    def setUp(self):
+        client = Client.objects.create(nom_complet='Jean Dupont', whatsapp='', email='jean@example.com')
+        self.commandes = [
+            Commande.objects.create(client=client, montant_total=1000) for _ in range(10)
+        ]
+
+    async def test_initialisations_concurrentes(self):
+        with MonerooStub(latence=0.3) as stub, override_settings(MONEROO_API_URL=stub.url):
+            debut = time.perf_counter()
+            urls = await asyncio.gather(*(creer_paiement_moneroo_async(c) for c in self.commandes))
+            duree = time.perf_counter() - debut
+
+        self.assertTrue(all(urls))
+        self.assertEqual(stub.appels['initialize'], 10)
+        # En série : 10 × 0,3 s ; en parallèle : à peine plus qu'un appel
+        self.assertLess(duree, 1.5)
+        self.assertEqual(
+            await Commande.objects.filter(moneroo_payment_url__startswith='https://').acount(), 10
+        )
+
+    async def test_limite_du_pool_appliquee(self):
+        '''Au plus MONEROO_ASYNC_MAX_CONNEXIONS appels simultanés : les suivants attendent'''
+        with MonerooStub(latence=0.3) as stub, \
+                override_settings(MONEROO_API_URL=stub.url, MONEROO_ASYNC_MAX_CONNEXIONS=2):
+            debut = time.perf_counter()
+            urls = await asyncio.gather(*(creer_paiement_moneroo_async(c) for c in self.commandes[:4]))
+            duree = time.perf_counter() - debut
+
+        self.assertTrue(all(urls))
+        # Deux vagues de deux appels
+        self.assertGreaterEqual(duree, 0.6)
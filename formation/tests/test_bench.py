@@ -0,0 +1,76 @@
+import json
+import os
+from pathlib import Path
+
+from django.test import TestCase
+
+from formation.models import Commande
+from formation.tests import bench
+
+
+class TunnelAchatTests(TestCase):
+    '''Le benchmark joue le tunnel complet ; on le vérifie à petite échelle'''
+
+    def test_tunnel_complet(self):
+        rapport = bench.executer(nb_formations=5, nb_clients=3, nb_commandes=10, iterations=2)
+
+        self.assertEqual(set(rapport['etapes']), set(bench.ETAPES))
+        for mesure in rapport['etapes'].values():
+            self.assertLessEqual(mesure['p50_ms'], mesure['p99_ms'])
+            self.assertIsNotNone(mesure.get('alloc_ko_moyen'))
+        # Échauffement + 2 itérations + passe d'allocation : toutes payées
+        self.assertEqual(
+            Commande.objects.filter(client__email__startswith='acheteur', statut='paye').count(), 4
+        )
+
+    def test_comparer_detecte_les_regressions(self):
+        reference = {'etapes': {'panier': {'p95_ms': 10.0, 'sql_max': 3}}}
+        actuel = {'etapes': {'panier': {'p95_ms': 20.0, 'sql_max': 4}}}
+
+        regressions = bench.comparer(reference, actuel, tolerance=0.5)
+
+        self.assertEqual(len(regressions), 2)
+        self.assertEqual(bench.comparer(reference, reference), [])
+
+
+class IndexTests(TestCase):
+    '''Les requêtes de l'application s'appuient sur les index posés par 0005'''
+
+    def test_plans_utilisent_les_index(self):
+        bench.peupler(nb_formations=50, nb_clients=200, nb_commandes=1000)
+
+        for nom, resultat in bench.verifier_index().items():
+            with self.subTest(requete=nom):
+                self.assertTrue(resultat['utilise'], resultat['plan'])
+
+
+class TunnelAchatBenchmark(TestCase):
+    '''
+    Benchmark en grandeur réelle, désactivé par défaut :
+        BENCH_ITERATIONS=50 python manage.py test formation.tests.test_bench
+    BENCH_SORTIE=rapport.json enregistre le rapport de référence ;
+    BENCH_REFERENCE=rapport.json échoue en cas de régression
+    (tolérance p95 : BENCH_TOLERANCE, 0.25 par défaut)
+    '''
+
+    def test_benchmark(self):
+        iterations = int(os.environ.get('BENCH_ITERATIONS', 0))
+        if not iterations:
+            self.skipTest('BENCH_ITERATIONS non défini')
+
+        rapport = bench.executer(
+            nb_formations=int(os.environ.get('BENCH_FORMATIONS', 20)),
+            nb_clients=int(os.environ.get('BENCH_CLIENTS', 100)),
+            nb_commandes=int(os.environ.get('BENCH_COMMANDES', 500)),
+            iterations=iterations,
+            graine=int(os.environ.get('BENCH_GRAINE', 42)),
+        )
+        print('\n' + '\n'.join(bench.formater(rapport)))
+
+        if os.environ.get('BENCH_SORTIE'):
+            Path(os.environ['BENCH_SORTIE']).write_text(json.dumps(rapport, indent=2, ensure_ascii=False))
+        if os.environ.get('BENCH_REFERENCE'):
+            reference = json.loads(Path(os.environ['BENCH_REFERENCE']).read_text())
+            tolerance = float(os.environ.get('BENCH_TOLERANCE', 0.25))
+            regressions = bench.comparer(reference, rapport, tolerance)
+            self.assertEqual(regressions, [], 'Régressions détectées')
@@ -0,0 +1,122 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from formation.cache import version_catalogue
+from formation.models import Formation
+
+
+class GetConditionnelTests(TestCase):
+    '''304 tant que la page est identique, 200 dès qu'elle change'''
+
+    def setUp(self):
+        cache.clear()
+        # create (et non bulk_create) : les signaux indexent pour la recherche
+        self.formations = [
+            Formation.objects.create(titre=titre, description='...', prix=1000) for titre in ('Excel', 'Python')
+        ]
+
+    def etag(self, url, **params):
+        # Première visite : pose le cookie CSRF, qui fait partie de l'ETag
+        self.get(url, **params)
+        return self.get(url, **params)['ETag']
+
+    def get(self, url, etag=None, **params):
+        en_tetes = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return self.client.get(url, params, secure=True, **en_tetes)
+
+    def test_catalogue_304(self):
+        etag = self.etag('/')
+
+        self.assertEqual(self.get('/', etag).status_code, 304)
+
+    def test_catalogue_recherche_dans_l_etag(self):
+        etag = self.etag('/', q='excel')
+
+        self.assertEqual(self.get('/', etag, q='Excel!').status_code, 304)
+        response = self.get('/', etag, q='python')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['formations'], [self.formations[1]])
+        self.assertEqual(self.get('/', etag).status_code, 200)
+
+    def test_panier_apres_ajout(self):
+        '''La page qui affiche le message a un ETag ; la suivante, sans message, un autre'''
+        self.client.post(f'/panier/ajouter/{self.formations[0].id}/', secure=True)
+
+        avec_message = self.get('/panier/')
+        self.assertContains(avec_message, 'ajoutée au panier')
+        self.assertTrue(avec_message.has_header('ETag'))
+
+        sans_message = self.get('/panier/', avec_message['ETag'])
+        self.assertEqual(sans_message.status_code, 200)
+        self.assertNotContains(sans_message, 'ajoutée au panier')
+        self.assertEqual(self.get('/panier/', sans_message['ETag']).status_code, 304)
+
+    @override_settings(MESSAGE_STORAGE='django.contrib.messages.storage.session.SessionStorage')
+    def test_message_en_session_jamais_servi_en_304(self):
+        ajouter = lambda: self.client.post(f'/panier/ajouter/{self.formations[0].id}/', secure=True)
+        ajouter()
+        etag = self.etag('/panier/')
+        # Même panier, mais un message en attente dans la session
+        ajouter()
+
+        response = self.get('/panier/', etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'ajoutée au panier')
+
+
+@override_settings(STORAGES={
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+})
+class InvalidationTests(TestCase):
+    '''Toute modification d'une formation change la version et la grille servie'''
+
+    def setUp(self):
+        cache.clear()
+        self.excel = Formation.objects.create(titre='Excel', description='...', prix=1000)
+        self.python = Formation.objects.create(titre='Python', description='...', prix=1000)
+        self.assertContains(self.catalogue(), 'Python')
+        self.version = version_catalogue()
+
+    def catalogue(self):
+        return self.client.get('/', secure=True)
+
+    def assertInvalide(self):
+        self.assertGreater(version_catalogue(), self.version)
+
+    def test_enregistrement(self):
+        self.python.titre = 'Django'
+        self.python.save()
+
+        self.assertInvalide()
+        response = self.catalogue()
+        self.assertContains(response, 'Django')
+        self.assertNotContains(response, 'Python')
+
+    def test_suppression(self):
+        self.python.delete()
+
+        self.assertInvalide()
+        self.assertNotContains(self.catalogue(), 'Python')
+
+    def test_case_active_de_la_liste_admin(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'x'))
+        formations = [self.excel, self.python]
+        donnees = {
+            'form-TOTAL_FORMS': len(formations), 'form-INITIAL_FORMS': len(formations), '_save': 'Enregistrer',
+        }
+        for i, formation in enumerate(formations):
+            donnees[f'form-{i}-id'] = formation.id
+            if formation is self.excel:
+                donnees[f'form-{i}-active'] = 'on'
+
+        response = self.client.post('/admin/formation/formation/', donnees, secure=True)
+
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Formation.objects.get(pk=self.python.pk).active)
+        self.assertInvalide()
+        response = self.catalogue()
+        self.assertContains(response, 'Excel')
+        self.assertNotContains(response, 'Python')
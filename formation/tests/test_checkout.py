@@ -0,0 +1,138 @@
+import asyncio
+from datetime import timedelta
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from formation.models import Formation, Client, Commande
+from formation.tests.moneroo_stub import MonerooStub
+
+
+FORMULAIRE = {'nom_complet': 'Awa Diallo', 'email': 'awa@example.com', 'whatsapp': '+242065550000'}
+
+
+class RepriseCheckoutTests(TestCase):
+    '''Une nouvelle soumission du même panier reprend le paiement en cours'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.formations = Formation.objects.bulk_create([
+            Formation(titre=f'Formation {i}', description='...', prix=1000, lien_drive='https://drive.example.com')
+            for i in range(2)
+        ])
+
+    def setUp(self):
+        self.stub = MonerooStub()
+        self.stub.__enter__()
+        self.addCleanup(self.stub.__exit__)
+        reglages = override_settings(MONEROO_API_URL=self.stub.url)
+        reglages.enable()
+        self.addCleanup(reglages.disable)
+        self.ajouter(self.formations[0])
+
+    def ajouter(self, formation):
+        self.client.post(f'/panier/ajouter/{formation.id}/', secure=True)
+
+    def soumettre(self):
+        return self.client.post('/checkout/', FORMULAIRE, secure=True)
+
+    def test_double_soumission(self):
+        premiere = self.soumettre()
+        seconde = self.soumettre()
+
+        self.assertEqual(premiere.status_code, 302)
+        self.assertEqual(seconde['Location'], premiere['Location'])
+        self.assertEqual(self.stub.appels['initialize'], 1)
+        self.assertEqual(Commande.objects.count(), 1)
+
+    def test_panier_modifie(self):
+        premiere = self.soumettre()
+        self.ajouter(self.formations[1])
+        seconde = self.soumettre()
+
+        self.assertNotEqual(seconde['Location'], premiere['Location'])
+        self.assertEqual(self.stub.appels['initialize'], 2)
+
+    def test_client_connu_repasse_commande(self):
+        '''Second achat avec le même email (casse comprise) : même client, nouvelle commande'''
+        self.soumettre()
+        Commande.objects.marquer_comme_paye()
+        self.ajouter(self.formations[1])
+
+        response = self.client.post('/checkout/', dict(FORMULAIRE, email='Awa@Example.com'), secure=True)
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Client.objects.get().email, 'awa@example.com')
+        self.assertEqual(Commande.objects.count(), 2)
+
+    def test_fenetre_expiree_ou_commande_annulee(self):
+        self.soumettre()
+        Commande.objects.update(date_commande=timezone.now() - timedelta(hours=1))
+        self.soumettre()
+        Commande.objects.filter(date_commande__gte=timezone.now() - timedelta(minutes=1)).marquer_comme_annule()
+        self.soumettre()
+
+        self.assertEqual(self.stub.appels['initialize'], 3)
+        self.assertEqual(Commande.objects.count(), 3)
+
+    def test_initialisation_en_cours_par_une_autre_requete(self):
+        '''
+        Commande déjà réservée, URL pas encore connue : pas de second appel à
+        Moneroo ni d'attente, une page qui se recharge jusqu'à l'URL
+        '''
+        url = self.soumettre()['Location']
+        Commande.objects.update(moneroo_payment_url=None)
+
+        response = self.soumettre()
+
+        self.assertTemplateUsed(response, 'formation/paiement_en_preparation.html')
+        self.assertEqual(response['Refresh'], '2; url=/checkout/attente/')
+        self.assertEqual(self.client.get('/checkout/attente/', secure=True).status_code, 200)
+        Commande.objects.update(moneroo_payment_url=url)
+        self.assertRedirects(
+            self.client.get('/checkout/attente/', secure=True), url, fetch_redirect_response=False
+        )
+        self.assertEqual(self.stub.appels['initialize'], 1)
+        self.assertEqual(Commande.objects.count(), 1)
+        self.assertEqual(Client.objects.count(), 1)
+
+    def test_initialisation_echouee_pendant_l_attente(self):
+        self.soumettre()
+        Commande.objects.update(moneroo_payment_url=None)
+        self.soumettre()
+        Commande.objects.marquer_comme_annule()
+
+        response = self.client.get('/checkout/attente/', secure=True)
+
+        self.assertRedirects(response, '/checkout/', fetch_redirect_response=False)
+        self.assertNotIn('paiement_en_preparation', self.client.session)
+
+    def test_formation_desactivee_meme_panier(self):
+        '''Une formation désactivée ne change pas l'empreinte : le paiement est repris'''
+        premiere = self.soumettre()
+        inactive = Formation.objects.create(titre='Retirée', description='...', prix=500)
+        self.ajouter(inactive)
+        inactive.active = False
+        inactive.save()
+        seconde = self.soumettre()
+
+        self.assertEqual(seconde['Location'], premiere['Location'])
+        self.assertEqual(self.stub.appels['initialize'], 1)
+
+    @override_settings(ROOT_URLCONF='formation.tests.test_async')
+    async def test_soumissions_paralleles(self):
+        '''
+        Vue async : pendant que la première soumission attend Moneroo, la
+        seconde trouve la commande réservée et attend son URL de paiement
+        '''
+        self.stub.latence = 0.3
+        await self.async_client.post(f'/panier/ajouter/{self.formations[0].id}/', secure=True)
+
+        reponses = await asyncio.gather(*(
+            self.async_client.post('/checkout/', FORMULAIRE, secure=True) for _ in range(2)
+        ))
+
+        self.assertEqual([r.status_code for r in reponses], [302, 302])
+        self.assertEqual(reponses[0]['Location'], reponses[1]['Location'])
+        self.assertEqual(self.stub.appels['initialize'], 1)
+        self.assertEqual(await Commande.objects.acount(), 1)
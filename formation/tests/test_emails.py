@@ -0,0 +1,76 @@
+from io import StringIO
+
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+
+from formation.models import Formation, Client, Commande, EnvoiEmail
+from formation.utils import construire_email_acces
+
+
+class EmailAccesTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.formation = Formation.objects.create(
+            titre='Python <avancé> & co', description='...', prix=1000,
+            lien_drive='https://drive.example.com/?a=1&b=2'
+        )
+        client = Client.objects.create(nom_complet='Jean', whatsapp='+242061234567', email='jean@example.com')
+        self.commande = Commande.objects.create(client=client, montant_total=1000)
+        self.commande.formations.add(self.formation)
+
+    def html(self):
+        return construire_email_acces(self.commande).alternatives[0][0]
+
+    def test_titre_echappe_en_html_et_brut_en_texte(self):
+        message = construire_email_acces(self.commande)
+
+        self.assertIn('Python &lt;avancé&gt; &amp; co', message.alternatives[0][0])
+        self.assertIn('▶ Python <avancé> & co', message.body)
+        self.assertIn('Montant payé : 1000 FCFA', message.body)
+
+    def test_bloc_formation_reutilise_puis_invalide_par_modification(self):
+        self.html()
+        Formation.objects.filter(id=self.formation.id).update(titre='Titre modifié en base')
+        # Même date_modification : le bloc en cache est réutilisé
+        self.assertIn('Python &lt;avancé&gt;', self.html())
+
+        self.formation.refresh_from_db()
+        self.formation.save()
+        self.commande = Commande.objects.with_details().get(id=self.commande.id)
+        self.assertIn('Titre modifié en base', self.html())
+
+
+class RenvoiAccesTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.corrigee, autre = Formation.objects.bulk_create([
+            Formation(titre='Corrigée', description='...', prix=1000, lien_drive='https://drive.example.com/v2'),
+            Formation(titre='Autre', description='...', prix=1000),
+        ])
+        statuts = ['paye', 'acces_envoye', 'en_attente', 'annule']
+        for i, statut in enumerate(statuts):
+            client = Client.objects.create(nom_complet=f'Client {i}', whatsapp='+242061234567', email=f'c{i}@example.com')
+            commande = Commande.objects.create(client=client, montant_total=1000, statut=statut)
+            commande.formations.add(self.corrigee, autre)
+        client = Client.objects.create(nom_complet='Sans', whatsapp='+242061234567', email='sans@example.com')
+        Commande.objects.create(client=client, montant_total=1000, statut='paye').formations.add(autre)
+
+    def test_renvoi_aux_seuls_acheteurs_payes_par_lots(self):
+        sortie = StringIO()
+        call_command('renvoyer_acces', formation=[self.corrigee.id], envoyer=True, lot=1, stdout=sortie)
+
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), ['c0@example.com', 'c1@example.com'])
+        self.assertIn('https://drive.example.com/v2', mail.outbox[0].body)
+        self.assertEqual(EnvoiEmail.objects.filter(motif='renvoi', statut='envoye').count(), 2)
+        self.assertIn('c0@example.com : Envoyé', sortie.getvalue())
+
+    def test_relance_sans_doublon(self):
+        call_command('renvoyer_acces', formation=[self.corrigee.id], stdout=StringIO())
+        call_command('renvoyer_acces', formation=[self.corrigee.id], stdout=StringIO())
+
+        self.assertEqual(EnvoiEmail.objects.filter(motif='renvoi', statut='en_attente').count(), 2)
+        self.assertEqual(len(mail.outbox), 0)
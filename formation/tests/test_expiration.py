@@ -0,0 +1,65 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from formation.models import Client, Commande, HistoriqueStatut
+
+
+class ExpirerCommandesTests(TestCase):
+    '''Les commandes abandonnées expirent par lots, sans toucher aux autres'''
+
+    def setUp(self):
+        self.client_obj = Client.objects.create(
+            nom_complet='Jean Dupont', whatsapp='+242061234567', email='jean@example.com'
+        )
+
+    def creer_commandes(self, statuts, age):
+        commandes = Commande.objects.bulk_create([
+            Commande(client=self.client_obj, montant_total=1000, statut=statut) for statut in statuts
+        ])
+        Commande.objects.filter(id__in=[c.id for c in commandes]).update(date_commande=timezone.now() - age)
+        return commandes
+
+    def expirer(self, *args):
+        sortie = StringIO()
+        call_command('expirer_commandes', '--duree', '3600', '--lot', '2', *args, stdout=sortie)
+        return sortie.getvalue()
+
+    def test_expire_les_commandes_abandonnees_par_lots(self):
+        abandonnees = self.creer_commandes(['en_attente'] * 5, timedelta(hours=2))
+        recente, = self.creer_commandes(['en_attente'], timedelta(minutes=5))
+        payee, = self.creer_commandes(['paye'], timedelta(hours=2))
+
+        sortie = self.expirer()
+
+        self.assertIn('5 commande(s) expirée(s) en', sortie)
+        self.assertEqual(sortie.count("jusqu'à #"), 3)  # lots de 2
+        self.assertCountEqual(
+            Commande.objects.filter(statut='expire').values_list('id', flat=True), [c.id for c in abandonnees]
+        )
+        self.assertEqual(Commande.objects.get(pk=recente.pk).statut, 'en_attente')
+        self.assertEqual(Commande.objects.get(pk=payee.pk).statut, 'paye')
+        self.assertEqual(HistoriqueStatut.objects.filter(origine='expiration').count(), 5)
+
+    def test_paiement_tardif_accepte(self):
+        commande, = self.creer_commandes(['en_attente'], timedelta(hours=2))
+        self.expirer()
+
+        self.assertTrue(Commande.objects.get(pk=commande.pk).marquer_comme_paye(origine='webhook'))
+
+    def test_purge_des_clients_sans_commande(self):
+        self.creer_commandes(['en_attente'], timedelta(hours=2))
+        orphelins = Client.objects.bulk_create([
+            Client(nom_complet=f'Client {i}', whatsapp='', email=f'client{i}@example.com') for i in range(3)
+        ])
+
+        self.expirer()
+        self.assertEqual(Client.objects.count(), 4)
+        sortie = self.expirer('--purger-clients')
+
+        self.assertIn('3 client(s) sans commande supprimé(s)', sortie)
+        self.assertFalse(Client.objects.filter(id__in=[c.id for c in orphelins]).exists())
+        self.assertTrue(Client.objects.filter(pk=self.client_obj.pk).exists())
@@ -0,0 +1,141 @@
+import csv
+import io
+import json
+import os
+import time
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from formation.export import exporter, flux, _flux_async
+from formation.models import Formation, Client, Commande
+
+
+class ExportTestMixin:
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.formations = Formation.objects.bulk_create([
+            Formation(titre=f'Formation {i}', description='...', prix=1000, lien_drive='https://drive.example.com')
+            for i in range(3)
+        ])
+        cls.awa = Client.objects.create(nom_complet='Awa Diallo', whatsapp='+242065550000', email='awa@example.com')
+        cls.jean = Client.objects.create(nom_complet='Jean Dupont', whatsapp='', email='jean@example.com')
+        cls.payee = Commande.objects.create(
+            client=cls.awa, montant_total=2000, statut='paye', date_paiement=timezone.now()
+        )
+        cls.payee.formations.add(*cls.formations[:2])
+        cls.en_attente = Commande.objects.create(client=cls.awa, montant_total=1000)
+        cls.en_attente.formations.add(cls.formations[2])
+        cls.vide = Commande.objects.create(client=cls.jean, montant_total=0)
+
+
+class ExportTests(ExportTestMixin, TestCase):
+
+    def lire_csv(self, texte):
+        return list(csv.DictReader(io.StringIO(texte)))
+
+    def test_commandes_en_une_requete(self):
+        with CaptureQueriesContext(connection) as requetes:
+            texte = ''.join(flux(*exporter('commandes', taille_lot=2), 'csv'))
+
+        self.assertEqual(len(requetes), 1)
+        lignes = {int(ligne['id']): ligne for ligne in self.lire_csv(texte)}
+        self.assertEqual(
+            sorted(lignes[self.payee.id]['formations'].split(' | ')), ['Formation 0', 'Formation 1']
+        )
+        self.assertEqual(lignes[self.payee.id]['email'], 'awa@example.com')
+        self.assertEqual(lignes[self.vide.id]['formations'], '')
+        self.assertEqual(list(lignes), sorted(lignes))
+
+    def test_clients_et_revenus(self):
+        clients = {ligne['email']: ligne for ligne in self.lire_csv(''.join(flux(*exporter('clients'), 'csv')))}
+        revenus = self.lire_csv(''.join(flux(*exporter('revenus'), 'csv')))
+
+        self.assertEqual((clients['awa@example.com']['commandes'], clients['awa@example.com']['total_regle']), ('2', '2000.00'))
+        self.assertEqual(clients['jean@example.com']['total_regle'], '0.00')
+        self.assertEqual([(r['commandes'], r['montant']) for r in revenus], [('1', '2000.00')])
+
+    def test_commande_exporter_jsonl(self):
+        sortie, erreurs = StringIO(), StringIO()
+
+        call_command('exporter', 'commandes', '--format', 'jsonl', stdout=sortie, stderr=erreurs)
+
+        lignes = [json.loads(ligne) for ligne in sortie.getvalue().splitlines()]
+        self.assertEqual([ligne['id'] for ligne in lignes], sorted(c.id for c in (self.payee, self.en_attente, self.vide)))
+        self.assertEqual(lignes[1]['formations'], 'Formation 2')
+        self.assertIn('3 ligne(s) exportée(s)', erreurs.getvalue())
+
+    def test_action_admin_sur_la_selection(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'x'))
+
+        response = self.client.post('/admin/formation/commande/', {
+            'action': 'exporter_csv', '_selected_action': [self.payee.id, self.vide.id],
+        }, secure=True)
+
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment; filename="commandes-', response['Content-Disposition'])
+        lignes = self.lire_csv(b''.join(response.streaming_content).decode('utf-8'))
+        self.assertEqual([int(ligne['id']) for ligne in lignes], [self.payee.id, self.vide.id])
+
+    async def test_flux_asgi(self):
+        '''Sous ASGI, le flux est consommé morceau par morceau, sans être matérialisé'''
+        morceaux = [morceau async for morceau in _flux_async(iter(['a', 'b']))]
+
+        self.assertEqual(morceaux, ['a', 'b'])
+
+
+def rss_ko():
+    '''Mémoire résidente actuelle du processus (Linux)'''
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+
+
+class ExportBenchmark(TestCase):
+    '''
+    Mémoire résidente pendant l'export, désactivée par défaut :
+        EXPORT_BENCH_COMMANDES=1000000 python manage.py test formation.tests.test_export
+    '''
+
+    def test_rss_constante(self):
+        nombre = int(os.environ.get('EXPORT_BENCH_COMMANDES', 0))
+        if not nombre:
+            self.skipTest('EXPORT_BENCH_COMMANDES non défini')
+        if not os.path.exists('/proc/self/statm'):
+            self.skipTest('/proc/self/statm indisponible')
+
+        formations = Formation.objects.bulk_create([
+            Formation(titre=f'Formation {i}', description='...', prix=1000, lien_drive='https://drive.example.com')
+            for i in range(5)
+        ])
+        client = Client.objects.create(nom_complet='Bench', whatsapp='0', email='bench@example.com')
+        Liaison = Commande.formations.through
+        for debut in range(0, nombre, 10000):
+            commandes = Commande.objects.bulk_create([
+                Commande(client=client, montant_total=1000, statut='paye') for _ in range(min(10000, nombre - debut))
+            ])
+            Liaison.objects.bulk_create([
+                Liaison(commande_id=commande.id, formation_id=formations[commande.id % 5].id) for commande in commandes
+            ])
+
+        mesures, lignes = [], 0
+        debut = time.perf_counter()
+        for morceau in flux(*exporter('commandes'), 'csv'):
+            lignes += morceau.count('\n')
+            if lignes % 50000 < 500:
+                mesures.append(rss_ko())
+        duree = time.perf_counter() - debut
+
+        # Après l'amorçage (premier dixième), la mémoire ne croît plus
+        stables = mesures[len(mesures) // 10:]
+        print(
+            f"{nombre} commandes exportées en {duree:.1f} s ({nombre / duree:.0f}/s), "
+            f"RSS {min(stables) // 1024} → {max(stables) // 1024} Mo"
+        )
+        self.assertEqual(lignes, nombre + 1)
+        self.assertLess(max(stables) - min(stables), 20 * 1024)
@@ -0,0 +1,66 @@
+import shutil
+import tempfile
+from io import BytesIO
+
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from PIL import Image
+
+from formation.models import Formation
+
+
+def image_png(largeur, hauteur):
+    tampon = BytesIO()
+    Image.new('RGBA', (largeur, hauteur), (200, 30, 30, 128)).save(tampon, 'PNG')
+    return SimpleUploadedFile('couverture.png', tampon.getvalue(), content_type='image/png')
+
+
+class VariantesImageTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        reglages = override_settings(
+            STORAGES={
+                'default': {
+                    'BACKEND': 'django.core.files.storage.FileSystemStorage',
+                    'OPTIONS': {'location': self.media, 'base_url': '/media/'},
+                },
+                'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+            },
+            IMAGE_LARGEURS=[320, 640, 960],
+        )
+        reglages.enable()
+        self.addCleanup(reglages.disable)
+
+    def test_declinaisons_generees_a_l_upload(self):
+        formation = Formation.objects.create(titre='A', description='...', prix=1000, image=image_png(800, 450))
+        formation.refresh_from_db()
+
+        variantes = formation.variantes_image
+        self.assertEqual([l for l, _, _ in variantes['webp']], [320, 640])
+        self.assertEqual(formation.image_dimensions, (640, 360))
+        with formation.image.storage.open(variantes['jpg'][0][1]) as fichier:
+            self.assertEqual(Image.open(fichier).format, 'JPEG')
+        self.assertIn('320w', formation.srcset_webp)
+
+    def test_nouvelle_image_remplace_les_declinaisons(self):
+        formation = Formation.objects.create(titre='A', description='...', prix=1000, image=image_png(400, 300))
+        ancienne = formation.variantes_image['jpg'][0][1]
+
+        formation.image = image_png(1200, 600)
+        formation.save()
+
+        self.assertEqual([l for l, _, _ in formation.variantes_image['jpg']], [320, 640, 960])
+        self.assertFalse(formation.image.storage.exists(ancienne))
+
+    def test_catalogue_emet_srcset_et_lazy_loading(self):
+        for i in range(5):
+            Formation.objects.create(titre=f'F{i}', description='...', prix=1000, image=image_png(700, 400))
+
+        contenu = self.client.get('/', secure=True).content.decode()
+
+        self.assertEqual(contenu.count('type="image/webp"'), 5)
+        self.assertEqual(contenu.count('loading="lazy"'), 2)
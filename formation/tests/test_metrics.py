@@ -0,0 +1,16 @@
+from django.test import TestCase, override_settings
+
+
+@override_settings(METRICS_TOKEN='jeton')
+class MetricsTests(TestCase):
+    '''/metrics : jeton Bearer ou membre du staff'''
+
+    def metrics(self, autorisation):
+        return self.client.get('/metrics', HTTP_AUTHORIZATION=autorisation, secure=True)
+
+    def test_jeton(self):
+        self.assertEqual(self.metrics('Bearer jeton').status_code, 200)
+        self.assertEqual(self.metrics('Bearer autre').status_code, 403)
+
+    def test_en_tete_non_ascii(self):
+        self.assertEqual(self.metrics('Bearer é').status_code, 403)
@@ -0,0 +1,121 @@
+import time
+from unittest import mock
+
+import requests
+import urllib3.connection
+from django.conf import settings
+from django.test import SimpleTestCase, override_settings
+
+from formation.moneroo import CircuitOuvert, MonerooClient
+from formation.tests.moneroo_stub import MonerooStub
+
+
+class MonerooClientTests(SimpleTestCase):
+    '''Rejeux, disjoncteur et statistiques du client synchrone, contre le faux serveur'''
+
+    def setUp(self):
+        self.stub = MonerooStub()
+        self.stub.__enter__()
+        self.addCleanup(self.stub.__exit__)
+        reglages = override_settings(
+            MONEROO_API_URL=self.stub.url, MONEROO_RETRIES=2,
+            MONEROO_CIRCUIT_SEUIL=2, MONEROO_CIRCUIT_DELAI=0.2,
+        )
+        reglages.enable()
+        self.addCleanup(reglages.disable)
+        self.client_moneroo = MonerooClient()
+
+    def verifier(self):
+        return self.client_moneroo.get('/payments/tx_1')
+
+    def test_get_rejoue_sur_erreur_serveur(self):
+        self.stub.erreurs = [503, 502]
+
+        response = self.verifier()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stub.appels['verification'], 3)
+        self.assertEqual(self.client_moneroo.circuit.etat, 'ferme')
+
+    def test_post_non_rejoue_sur_erreur_serveur(self):
+        self.stub.erreurs = [503]
+
+        response = self.client_moneroo.post('/payments/initialize', json={})
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.stub.appels['initialize'], 1)
+
+    def test_connexion_refusee_rejouee(self):
+        '''Échec de connexion : rejoué, y compris pour un POST (rien n'a été envoyé)'''
+        connecter = urllib3.connection.connection.create_connection
+        tentatives = []
+
+        def refusee_une_fois(*args, **kwargs):
+            tentatives.append(args)
+            if len(tentatives) == 1:
+                raise ConnectionRefusedError()
+            return connecter(*args, **kwargs)
+
+        with mock.patch.object(urllib3.connection.connection, 'create_connection', refusee_une_fois):
+            response = self.client_moneroo.post('/payments/initialize', json={})
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(tentatives), 2)
+        self.assertEqual(self.stub.appels['initialize'], 1)
+
+    def test_erreur_reseau_apres_les_rejeux(self):
+        client = MonerooClient(base_url='http://127.0.0.1:1/v1')
+
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            client.get('/payments/tx_1')
+        self.assertEqual(client.circuit.echecs, 1)
+
+    @override_settings(MONEROO_RETRIES=0)
+    def test_disjoncteur(self):
+        client = MonerooClient()
+        self.stub.erreurs = [500, 500]
+
+        # Fermé : les échecs consécutifs sont comptés jusqu'au seuil
+        self.assertEqual(client.get('/payments/tx_1').status_code, 500)
+        self.assertEqual(client.circuit.etat, 'ferme')
+        client.get('/payments/tx_1')
+        self.assertEqual(client.circuit.etat, 'ouvert')
+
+        # Ouvert : l'appel n'est pas tenté
+        with self.assertRaises(CircuitOuvert):
+            client.get('/payments/tx_1')
+        self.assertEqual(self.stub.appels['verification'], 2)
+
+        # Semi-ouvert après le délai : un seul appel d'essai, qui échoue
+        time.sleep(0.25)
+        self.assertEqual(client.circuit.etat, 'semi_ouvert')
+        self.stub.erreurs = [500]
+        client.get('/payments/tx_1')
+        self.assertEqual(client.circuit.etat, 'ouvert')
+
+        # Nouvel essai réussi : le circuit se referme
+        time.sleep(0.25)
+        self.assertEqual(client.get('/payments/tx_1').status_code, 200)
+        self.assertEqual(client.circuit.etat, 'ferme')
+        self.assertEqual(client.circuit.echecs, 0)
+
+    def test_semi_ouvert_un_seul_essai(self):
+        self.client_moneroo.circuit.echecs = 2
+        self.client_moneroo.circuit.ouvert_depuis = time.monotonic() - 1
+
+        self.client_moneroo.circuit.autoriser()
+        with self.assertRaises(CircuitOuvert):
+            self.client_moneroo.circuit.autoriser()
+
+    def test_stats_du_pool(self):
+        self.stub.erreurs = [503]
+        for _ in range(3):
+            self.verifier()
+
+        stats = self.client_moneroo.stats()
+
+        self.assertEqual((stats['requetes'], stats['erreurs'], stats['circuit']), (3, 0, 'ferme'))
+        # Quatre requêtes HTTP (dont un rejeu) sur une seule connexion gardée ouverte
+        self.assertEqual(stats['pool'], {
+            'taille_max': settings.MONEROO_POOL_MAXSIZE, 'connexions_creees': 1, 'requetes_http': 4,
+        })
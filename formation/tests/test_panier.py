@@ -0,0 +1,78 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from formation.models import Formation
+
+
+class PanierTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.formations = Formation.objects.bulk_create([
+            Formation(titre=f'Formation {i}', description='...', prix=1000 * (i + 1))
+            for i in range(3)
+        ])
+        Formation.objects.filter(id=self.formations[2].id).update(active=False)
+
+    def ajouter(self, formation):
+        return self.client.post(f'/panier/ajouter/{formation.id}/', secure=True)
+
+    def test_session_ne_stocke_que_les_ids(self):
+        self.ajouter(self.formations[0])
+        self.ajouter(self.formations[1])
+
+        self.assertEqual(self.client.session['panier'], [self.formations[0].id, self.formations[1].id])
+        response = self.client.get('/panier/', secure=True)
+        self.assertEqual(response.context['total'], 3000)
+        self.assertEqual(len(response.context['formations']), 2)
+
+    def test_formation_inactive_refusee(self):
+        self.assertEqual(self.ajouter(self.formations[2]).status_code, 404)
+
+    def test_session_reecrite_uniquement_si_le_panier_change(self):
+        self.ajouter(self.formations[0])
+
+        with CaptureQueriesContext(connection) as requetes:
+            self.ajouter(self.formations[0])
+            self.client.post(f'/panier/retirer/{self.formations[1].id}/', secure=True)
+        ecritures = [r for r in requetes if r['sql'].startswith(('UPDATE', 'INSERT'))]
+        self.assertEqual(ecritures, [])
+
+    def test_ancien_format_de_session_lu(self):
+        session = self.client.session
+        session['panier'] = {str(self.formations[0].id): {'titre': 'x', 'prix': '1'}}
+        session.save()
+
+        response = self.client.get('/panier/', secure=True)
+        self.assertEqual(response.context['total'], 1000)
+
+
+class SessionTests(TestCase):
+
+    def test_navigation_sans_panier_ne_cree_pas_de_session(self):
+        for url in ('/', '/panier/', '/panier/compteur/', '/checkout/'):
+            self.client.get(url, secure=True)
+
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, self.client.cookies)
+        self.assertEqual(Session.objects.count(), 0)
+
+    def test_nettoyage_par_lots_des_sessions_expirees(self):
+        maintenant = timezone.now()
+        Session.objects.bulk_create(
+            [Session(session_key=f'expiree{i}', session_data='', expire_date=maintenant - timedelta(days=1))
+             for i in range(5)]
+            + [Session(session_key='active', session_data='', expire_date=maintenant + timedelta(days=1))]
+        )
+
+        call_command('nettoyer_sessions', lot=2, stdout=StringIO())
+
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['active'])
@@ -0,0 +1,75 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from formation.models import Formation
+from formation.recherche import normaliser, rechercher_ids
+
+
+class RechercheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.excel = Formation.objects.create(
+            titre='Excel pour débutants', description='Tableaux croisés et formules', prix=1000
+        )
+        self.python = Formation.objects.create(
+            titre='Python', description='Automatiser Excel avec Python', prix=1000
+        )
+        self.inactive = Formation.objects.create(
+            titre='Excel avancé', description='...', prix=1000, active=False
+        )
+
+    def test_classement_titre_avant_description(self):
+        self.assertEqual(rechercher_ids('excel'), [self.excel.id, self.python.id])
+        self.assertIn(self.inactive.id, rechercher_ids('excel', actives=False))
+
+    def test_accents_prefixes_et_operateurs_neutralises(self):
+        self.assertEqual(rechercher_ids('DEBUTANT'), [self.excel.id])
+        self.assertEqual(rechercher_ids('croi'), [self.excel.id])
+        self.assertEqual(rechercher_ids('"excel" OR NEAR('), [])
+        self.assertEqual(normaliser('  Excel,   Débutants! '), 'excel débutants')
+
+    def test_index_mis_a_jour_a_l_enregistrement(self):
+        self.python.titre = 'Django'
+        self.python.description = 'Sites web'
+        self.python.save()
+        self.assertEqual(rechercher_ids('excel'), [self.excel.id])
+
+        self.excel.delete()
+        self.assertEqual(rechercher_ids('excel'), [])
+
+    def test_recherche_sur_le_catalogue(self):
+        response = self.client.get('/', {'q': 'python'}, secure=True)
+
+        self.assertEqual(response.context['formations'], [self.python])
+        self.assertContains(response, 'Automatiser Excel')
+        self.assertNotContains(response, 'Tableaux croisés')
+
+    def test_seules_les_requetes_repetees_sont_mises_en_cache(self):
+        '''Une requête vue une fois n'est pas gardée ; l'ordre des mots ne compte pas'''
+        rechercher_ids('Excel débutants')
+        with CaptureQueriesContext(connection) as requetes:
+            rechercher_ids('excel débutants')
+        self.assertTrue(requetes)
+
+        with CaptureQueriesContext(connection) as requetes:
+            self.assertEqual(rechercher_ids('débutants, excel excel'), [self.excel.id])
+        self.assertEqual(len(requetes), 0)
+
+    @override_settings(STORAGES={
+        'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    })
+    def test_recherche_admin_sous_chaines_et_plein_texte(self):
+        '''Milieu de mot (icontains) et index plein texte, inactives comprises'''
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'x'))
+
+        response = self.client.get('/admin/formation/formation/', {'q': 'xcel'}, secure=True)
+
+        self.assertCountEqual(
+            [f.id for f in response.context['cl'].result_list],
+            [self.excel.id, self.python.id, self.inactive.id],
+        )
@@ -0,0 +1,132 @@
+import os
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from formation.models import Client, Commande, EnvoiEmail
+from formation.tests.moneroo_stub import MonerooStub
+
+
+class ReconcilePaymentsTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = MonerooStub().__enter__()
+        cls.addClassCleanup(cls.stub.__exit__)
+
+    def setUp(self):
+        self.client_obj = Client.objects.create(
+            nom_complet='Jean Dupont', whatsapp='+242061234567', email='jean@example.com'
+        )
+        self.checkpoint = Path(tempfile.mkdtemp()) / 'checkpoint.json'
+        overrides = override_settings(MONEROO_API_URL=self.stub.url, MONEROO_RETRIES=0)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def creer_commandes(self, statuts, age=timedelta(hours=1)):
+        commandes = Commande.objects.bulk_create([
+            Commande(
+                client=self.client_obj,
+                montant_total=5000,
+                moneroo_transaction_id=f'tx_{i}',
+            )
+            for i in range(len(statuts))
+        ])
+        Commande.objects.update(date_commande=timezone.now() - age)
+        for commande, statut in zip(commandes, statuts):
+            self.stub.statuts[commande.moneroo_transaction_id] = statut
+        return commandes
+
+    def reconcilier(self, *args):
+        out = StringIO()
+        call_command(
+            'reconcile_payments', '--checkpoint', str(self.checkpoint), '--debit', '0',
+            *args, stdout=out
+        )
+        return out.getvalue()
+
+    def test_applique_les_transitions(self):
+        payee, annulee, en_cours = self.creer_commandes(['success', 'failed', 'pending'])
+
+        self.reconcilier()
+
+        statuts = dict(Commande.objects.values_list('id', 'statut'))
+        self.assertEqual(statuts[payee.id], 'paye')
+        self.assertEqual(statuts[annulee.id], 'annule')
+        self.assertEqual(statuts[en_cours.id], 'en_attente')
+        self.assertEqual(
+            list(EnvoiEmail.objects.values_list('commande_id', flat=True)), [payee.id]
+        )
+        self.assertFalse(self.checkpoint.exists())
+
+    def test_ignore_les_commandes_recentes(self):
+        self.creer_commandes(['success'], age=timedelta(minutes=1))
+
+        self.reconcilier()
+
+        self.assertFalse(Commande.objects.filter(statut='paye').exists())
+
+    def test_commandes_recemment_expirees(self):
+        '''Paiement arrivé après l'expiration : la commande passe à payé'''
+        payee, echouee = self.creer_commandes(['success', 'failed'], age=timedelta(days=2))
+        ancienne = Commande.objects.create(
+            client=self.client_obj, montant_total=5000, moneroo_transaction_id='tx_ancienne', statut='expire'
+        )
+        Commande.objects.filter(pk=ancienne.pk).update(date_commande=timezone.now() - timedelta(days=30))
+        self.stub.statuts['tx_ancienne'] = 'success'
+        Commande.objects.filter(id__in=[payee.id, echouee.id]).marquer_comme_expire()
+
+        self.reconcilier()
+
+        statuts = dict(Commande.objects.values_list('id', 'statut'))
+        self.assertEqual(statuts, {payee.id: 'paye', echouee.id: 'expire', ancienne.id: 'expire'})
+        self.assertEqual(list(EnvoiEmail.objects.values_list('commande_id', flat=True)), [payee.id])
+
+    def test_reprend_apres_le_point_de_reprise(self):
+        premiere, seconde = self.creer_commandes(['success', 'success'])
+        self.checkpoint.write_text(f'{{"dernier_id": {premiere.id}}}')
+
+        self.reconcilier()
+
+        self.assertEqual(
+            list(Commande.objects.filter(statut='paye').values_list('id', flat=True)),
+            [seconde.id]
+        )
+
+
+@override_settings(MONEROO_RETRIES=0)
+class ReconcilePaymentsBenchmark(TestCase):
+    '''
+    Mesure de débit, désactivée par défaut :
+        RECONCILE_BENCH_ORDERS=10000 python manage.py test formation.tests.test_reconcile_payments
+    '''
+
+    def test_benchmark(self):
+        nombre = int(os.environ.get('RECONCILE_BENCH_ORDERS', 0))
+        if not nombre:
+            self.skipTest('RECONCILE_BENCH_ORDERS non défini')
+
+        client = Client.objects.create(nom_complet='Bench', whatsapp='0', email='bench@example.com')
+        Commande.objects.bulk_create([
+            Commande(client=client, montant_total=1000, moneroo_transaction_id=f'tx_{i}')
+            for i in range(nombre)
+        ], batch_size=1000)
+        Commande.objects.update(date_commande=timezone.now() - timedelta(hours=1))
+
+        with MonerooStub(statut_par_defaut='success') as stub, \
+                override_settings(MONEROO_API_URL=stub.url):
+            out = StringIO()
+            call_command(
+                'reconcile_payments', '--debit', '0', '--recommencer',
+                '--checkpoint', str(Path(tempfile.mkdtemp()) / 'checkpoint.json'),
+                stdout=out,
+            )
+
+        print(out.getvalue().splitlines()[-1])
+        self.assertEqual(Commande.objects.filter(statut='paye').count(), nombre)
@@ -0,0 +1,121 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from formation.models import Formation, Client, Commande, EnvoiEmail
+from formation.outbox import traiter_lot
+from formation.webhooks import traiter_lot as traiter_webhooks
+from formation.utils import construire_email_acces, generer_message_whatsapp
+from formation.verification import PREFIXE_CACHE
+
+
+class NombreDeRequetesTests(TestCase):
+    '''
+    Chaque chemin de paiement exécute un nombre fixe de requêtes SQL,
+    indépendant du nombre de formations dans la commande
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.formations = Formation.objects.bulk_create([
+            Formation(titre=f'Formation {i}', description='...', prix=1000, lien_drive='https://drive.example.com')
+            for i in range(5)
+        ])
+        cls.client_obj = Client.objects.create(
+            nom_complet='Jean Dupont', whatsapp='+242061234567', email='jean@example.com'
+        )
+
+    def creer_commande(self, nb_formations, **kwargs):
+        commande = Commande.objects.create(client=self.client_obj, montant_total=1000, **kwargs)
+        commande.formations.add(*self.formations[:nb_formations])
+        # Paiement déjà vérifié auprès de Moneroo (cache de vérification)
+        commande.moneroo_transaction_id = f'tx_requetes_{commande.id}'
+        commande.save(update_fields=['moneroo_transaction_id'])
+        cache.set(PREFIXE_CACHE + commande.moneroo_transaction_id, 'success')
+        return commande
+
+    def compter(self, appel):
+        with CaptureQueriesContext(connection) as requetes:
+            appel()
+        return len(requetes)
+
+    def assertNombreFixe(self, attendu, appel_pour):
+        '''Même nombre de requêtes pour un panier de 1 et de 5 formations'''
+        for nb_formations in (1, 5):
+            with self.subTest(formations=nb_formations):
+                appel = appel_pour(self.creer_commande(nb_formations))
+                self.assertEqual(self.compter(appel), attendu)
+
+    # Commande + prefetch, transition (verrou, UPDATE conditionnel, historique)
+    # + file d'email (transaction) ; panier déjà vide : session non réécrite
+    def test_callback_paiement_reussi(self):
+        self.assertNombreFixe(8, lambda commande: lambda: self.client.get(
+            f'/paiement/callback/{commande.id}/', {'paymentStatus': 'success'}, secure=True
+        ))
+
+    def test_callback_commande_deja_payee(self):
+        def callback(commande):
+            Commande.objects.filter(id=commande.id).marquer_comme_paye()
+            return lambda: self.client.get(f'/paiement/callback/{commande.id}/', secure=True)
+        self.assertNombreFixe(2, callback)
+
+    def corps_webhook(self, commande):
+        return json.dumps({'data': {
+            'id': f'py_{commande.id}', 'status': 'success',
+            'metadata': {'commande_id': str(commande.id)},
+        }})
+
+    # Réception : un seul INSERT dans la boîte de réception
+    def test_webhook_paiement_reussi(self):
+        self.assertNombreFixe(1, lambda commande: lambda: self.client.post(
+            '/moneroo/webhook/', self.corps_webhook(commande), content_type='application/json', secure=True
+        ))
+
+    # Réservation du lot (3), événement déjà vu, transaction à vérifier,
+    # transition (3), file d'email, WebhookEvent, résultat ; plus 4
+    # SAVEPOINT/RELEASE, les transactions étant ici imbriquées dans celle du test
+    def test_traitement_webhook(self):
+        def traitement(commande):
+            self.client.post(
+                '/moneroo/webhook/', self.corps_webhook(commande), content_type='application/json', secure=True
+            )
+            return traiter_webhooks
+        self.assertNombreFixe(15, traitement)
+
+    def test_envoi_email_depuis_la_file(self):
+        def envoi(commande):
+            Commande.objects.filter(id=commande.id).marquer_comme_paye()
+            EnvoiEmail.objects.create(commande=commande)
+            return traiter_lot
+        self.assertNombreFixe(12, envoi)
+
+    # Deux chargements (commande + prefetch) ; le rendu lui-même ne requête pas
+    def test_email_et_whatsapp_avec_with_details(self):
+        def rendu(commande):
+            return lambda: (
+                construire_email_acces(Commande.objects.with_details().get(id=commande.id)),
+                generer_message_whatsapp(Commande.objects.with_details().get(id=commande.id)),
+            )
+        self.assertNombreFixe(4, rendu)
+
+    # Liste de l'admin : client joint, pas de préchargement des formations
+    @override_settings(STORAGES={
+        'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    })
+    def test_liste_admin_des_commandes(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'x'))
+        liste = lambda: self.client.get('/admin/formation/commande/', secure=True)
+        self.creer_commande(5)
+        liste()
+        with CaptureQueriesContext(connection) as requetes:
+            liste()
+        for _ in range(3):
+            self.creer_commande(5)
+
+        self.assertEqual(self.compter(liste), len(requetes))
+        self.assertFalse([r for r in requetes if 'commande_formations' in r['sql']])
@@ -0,0 +1,64 @@
+from django.test import TestCase
+
+from formation.models import Client, Commande, HistoriqueStatut
+
+
+class TransitionsTests(TestCase):
+    '''Les changements de statut suivent Commande.TRANSITIONS et sont tracés'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_obj = Client.objects.create(
+            nom_complet='Jean Dupont', whatsapp='+242061234567', email='jean@example.com'
+        )
+
+    def creer_commande(self, **kwargs):
+        return Commande.objects.create(client=self.client_obj, montant_total=1000, **kwargs)
+
+    def test_cycle_de_vie_complet(self):
+        commande = self.creer_commande()
+
+        self.assertTrue(commande.marquer_comme_paye(origine='webhook'))
+        self.assertTrue(commande.marquer_acces_envoye(origine='email'))
+
+        commande.refresh_from_db()
+        self.assertEqual(commande.statut, 'acces_envoye')
+        self.assertIsNotNone(commande.date_paiement)
+        self.assertIsNotNone(commande.date_acces_envoye)
+        self.assertEqual(
+            list(commande.historique.values_list('ancien_statut', 'nouveau_statut', 'origine')),
+            [('en_attente', 'paye', 'webhook'), ('paye', 'acces_envoye', 'email')]
+        )
+
+    def test_transitions_interdites(self):
+        commande = self.creer_commande(statut='acces_envoye')
+
+        self.assertFalse(commande.marquer_comme_annule())
+        self.assertFalse(commande.marquer_comme_paye())
+        self.assertFalse(self.creer_commande().marquer_acces_envoye())
+        self.assertFalse(HistoriqueStatut.objects.exists())
+
+    def test_chemins_concurrents(self):
+        '''Deux objets périmés (webhook et callback) : un seul changement appliqué'''
+        commande = self.creer_commande()
+        webhook = Commande.objects.get(pk=commande.pk)
+
+        self.assertTrue(commande.marquer_comme_paye(origine='callback'))
+        self.assertFalse(webhook.marquer_comme_paye(origine='webhook'))
+        self.assertFalse(webhook.marquer_comme_annule(origine='webhook'))
+
+        self.assertEqual(Commande.objects.get(pk=commande.pk).statut, 'paye')
+        self.assertEqual(HistoriqueStatut.objects.filter(commande=commande).count(), 1)
+
+    def test_transition_en_masse(self):
+        attente, annulee, payee = (
+            self.creer_commande(), self.creer_commande(statut='annule'), self.creer_commande(statut='paye')
+        )
+
+        ids = Commande.objects.filter(id__in=[attente.id, annulee.id, payee.id]).transition('paye', 'reconciliation')
+
+        self.assertCountEqual(ids, [attente.id, annulee.id])
+        self.assertEqual(
+            dict(HistoriqueStatut.objects.values_list('commande_id', 'ancien_statut')),
+            {attente.id: 'en_attente', annulee.id: 'annule'}
+        )
@@ -0,0 +1,176 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from formation.models import Client, Commande
+from formation.tests.moneroo_stub import MonerooStub
+from formation.verification import PREFIXE_CACHE, statut_verifie, statut_verifie_async
+
+
+class VerificationTestMixin:
+
+    def setUp(self):
+        cache.clear()
+        self.stub = MonerooStub()
+        self.stub.__enter__()
+        self.addCleanup(self.stub.__exit__)
+        reglages = override_settings(MONEROO_API_URL=self.stub.url)
+        reglages.enable()
+        self.addCleanup(reglages.disable)
+
+
+class StatutVerifieTests(VerificationTestMixin, SimpleTestCase):
+    '''Cache et single-flight des vérifications Moneroo'''
+
+    def test_statut_mis_en_cache(self):
+        self.stub.statuts['tx_1'] = 'success'
+
+        self.assertEqual([statut_verifie('tx_1') for _ in range(3)], ['success'] * 3)
+        self.assertEqual(self.stub.appels['verification'], 1)
+
+    @override_settings(PAIEMENT_CACHE_TIMEOUT=0)
+    def test_statut_provisoire_reverifie(self):
+        self.assertEqual(statut_verifie('tx_1'), 'pending')
+        self.stub.statuts['tx_1'] = 'success'
+
+        self.assertEqual(statut_verifie('tx_1'), 'success')
+        self.assertEqual(self.stub.appels['verification'], 2)
+
+    def test_verifications_simultanees_entre_threads(self):
+        self.stub.statuts['tx_1'] = 'success'
+        self.stub.latence = 0.3
+        depart = threading.Barrier(8)
+
+        def verifier(_):
+            depart.wait()
+            return statut_verifie('tx_1')
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            statuts = list(pool.map(verifier, range(8)))
+
+        self.assertEqual(statuts, ['success'] * 8)
+        self.assertEqual(self.stub.appels['verification'], 1)
+
+    def test_verification_en_cours_dans_un_autre_worker(self):
+        '''Verrou posé par un autre worker : attendre son résultat dans le cache'''
+        cle = PREFIXE_CACHE + 'tx_1'
+        cache.set(cle + ':verrou', 1)
+        threading.Timer(0.2, cache.set, (cle, 'failed')).start()
+
+        self.assertEqual(statut_verifie('tx_1'), 'failed')
+        self.assertEqual(self.stub.appels['verification'], 0)
+
+    def test_worker_en_echec(self):
+        '''Verrou libéré sans résultat : ce worker vérifie lui-même'''
+        cle = PREFIXE_CACHE + 'tx_1'
+        cache.set(cle + ':verrou', 1)
+        threading.Timer(0.2, cache.delete, (cle + ':verrou',)).start()
+
+        self.assertEqual(statut_verifie('tx_1'), 'pending')
+        self.assertEqual(self.stub.appels['verification'], 1)
+
+    @override_settings(
+        MONEROO_RETRIES=0, MONEROO_CONNECT_TIMEOUT=0.5,
+        PAIEMENT_VERIFICATION_TIMEOUT=1, PAIEMENT_VERIFICATION_ATTENTE=1,
+    )
+    def test_suiveurs_attendent_le_meneur(self):
+        '''
+        Le meneur attend d'abord un autre worker puis appelle Moneroo : les
+        threads suiveurs du même processus obtiennent quand même son résultat
+        '''
+        self.stub.statuts['tx_1'] = 'success'
+        self.stub.latence = 0.5
+        cle = PREFIXE_CACHE + 'tx_1'
+        cache.set(cle + ':verrou', 1)
+        threading.Timer(0.8, cache.delete, (cle + ':verrou',)).start()
+        depart = threading.Barrier(3)
+
+        def verifier(_):
+            depart.wait()
+            return statut_verifie('tx_1')
+
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            statuts = list(pool.map(verifier, range(3)))
+
+        self.assertEqual(statuts, ['success'] * 3)
+        self.assertEqual(self.stub.appels['verification'], 1)
+
+    @override_settings(PAIEMENT_VERIFICATION_ATTENTE=0.3)
+    def test_attente_bornee_d_un_autre_worker(self):
+        '''Autre worker trop lent : abandon après PAIEMENT_VERIFICATION_ATTENTE, sans appel'''
+        cache.set(PREFIXE_CACHE + 'tx_1:verrou', 1)
+
+        debut = time.monotonic()
+        self.assertIsNone(statut_verifie('tx_1'))
+        self.assertLess(time.monotonic() - debut, 1)
+        self.assertEqual(self.stub.appels['verification'], 0)
+
+
+    @mock.patch('formation.verification.statut_paiement_moneroo', side_effect=AssertionError('appel bloquant'))
+    async def test_verifications_simultanees_async(self, _):
+        '''Vues ASGI : un seul appel httpx, les autres coroutines attendent son Future'''
+        self.stub.statuts['tx_1'] = 'success'
+        self.stub.latence = 0.3
+
+        statuts = await asyncio.gather(*(statut_verifie_async('tx_1') for _ in range(8)))
+
+        self.assertEqual(statuts, ['success'] * 8)
+        self.assertEqual(self.stub.appels['verification'], 1)
+        self.assertEqual(await statut_verifie_async('tx_1'), 'success')
+        self.assertEqual(self.stub.appels['verification'], 1)
+
+    async def test_verification_async_en_cours_dans_un_autre_worker(self):
+        cle = PREFIXE_CACHE + 'tx_1'
+        cache.set(cle + ':verrou', 1)
+        asyncio.get_running_loop().call_later(0.2, cache.set, cle, 'failed')
+
+        self.assertEqual(await statut_verifie_async('tx_1'), 'failed')
+        self.assertEqual(self.stub.appels['verification'], 0)
+
+
+class CallbackVerifieTests(VerificationTestMixin, TestCase):
+    '''Le callback ne croit pas paymentStatus : il vérifie auprès de Moneroo'''
+
+    def setUp(self):
+        super().setUp()
+        client = Client.objects.create(nom_complet='Jean Dupont', whatsapp='', email='jean@example.com')
+        self.commande = Commande.objects.create(
+            client=client, montant_total=1000, moneroo_transaction_id='tx_callback'
+        )
+
+    def callback(self):
+        return self.client.get(
+            f'/paiement/callback/{self.commande.id}/', {'paymentStatus': 'success'}, secure=True
+        )
+
+    def test_statut_annonce_non_confirme(self):
+        self.callback()
+
+        self.assertEqual(Commande.objects.get(pk=self.commande.pk).statut, 'en_attente')
+
+    def test_statut_confirme(self):
+        self.stub.statuts['tx_callback'] = 'success'
+
+        self.callback()
+        self.callback()
+
+        self.assertEqual(Commande.objects.get(pk=self.commande.pk).statut, 'paye')
+        self.assertEqual(self.stub.appels['verification'], 1)
+
+    @override_settings(ROOT_URLCONF='formation.tests.test_async')
+    @mock.patch('formation.verification.statut_paiement_moneroo', side_effect=AssertionError('appel bloquant'))
+    async def test_callback_async_verifie_sans_bloquer(self, _):
+        self.stub.statuts['tx_callback'] = 'success'
+
+        await self.async_client.get(
+            f'/paiement/callback/{self.commande.id}/', {'paymentStatus': 'success'}, secure=True
+        )
+
+        commande = await Commande.objects.aget(pk=self.commande.pk)
+        self.assertEqual(commande.statut, 'paye')
+        self.assertEqual(self.stub.appels['verification'], 1)
@@ -0,0 +1,236 @@
+import hashlib
+import hmac
+import json
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from formation.models import Client, Commande, EnvoiEmail, WebhookRecu
+from formation.tests.moneroo_stub import MonerooStub
+from formation.webhooks import purger_traites, reserver_lot, traiter_lot
+
+
+def corps_webhook(commande_id, statut, identifiant=None):
+    return json.dumps({'event': f'payment.{statut}', 'data': {
+        'id': identifiant or f'py_{commande_id}', 'status': statut,
+        'metadata': {'commande_id': str(commande_id)},
+    }}).encode('utf-8')
+
+
+class WebhookTestMixin:
+
+    def creer_commandes(self, nombre):
+        client = Client.objects.create(nom_complet='Jean Dupont', whatsapp='', email='jean@example.com')
+        commandes = [Commande.objects.create(client=client, montant_total=1000) for _ in range(nombre)]
+        for commande in commandes:
+            commande.moneroo_transaction_id = f'tx_{commande.id}'
+            commande.save(update_fields=['moneroo_transaction_id'])
+        return commandes
+
+    def poster(self, corps, **entetes):
+        return self.client.post(
+            '/moneroo/webhook/', corps, content_type='application/json', secure=True, **entetes
+        )
+
+
+class ReceptionTests(WebhookTestMixin, TestCase):
+    '''Premier temps : vérifier, enregistrer, répondre'''
+
+    def test_webhook_enregistre_sans_etre_applique(self):
+        commande, = self.creer_commandes(1)
+        corps = corps_webhook(commande.id, 'success')
+
+        response = self.poster(corps, HTTP_X_REQUEST_ID='req-1')
+
+        self.assertEqual(response.status_code, 200)
+        recu = WebhookRecu.objects.get()
+        self.assertEqual(bytes(recu.corps), corps)
+        self.assertEqual(recu.commande_id, commande.id)
+        self.assertEqual(recu.entetes['X-Request-ID'], 'req-1')
+        self.assertEqual(Commande.objects.get(pk=commande.pk).statut, 'en_attente')
+
+    @override_settings(MONEROO_WEBHOOK_SECRET='secret')
+    def test_signature_verifiee_avant_enregistrement(self):
+        commande, = self.creer_commandes(1)
+        corps = corps_webhook(commande.id, 'success')
+        signature = hmac.new(b'secret', corps, hashlib.sha256).hexdigest()
+
+        self.assertEqual(self.poster(corps).status_code, 401)
+        self.assertEqual(self.poster(corps, HTTP_X_MONEROO_SIGNATURE='faux').status_code, 403)
+        self.assertEqual(self.poster(b'{"data": {}}', HTTP_X_MONEROO_SIGNATURE=hmac.new(
+            b'secret', b'{"data": {}}', hashlib.sha256).hexdigest()).status_code, 400)
+        self.assertEqual(WebhookRecu.objects.count(), 0)
+
+        self.assertEqual(self.poster(corps, HTTP_X_MONEROO_SIGNATURE=signature).status_code, 200)
+        self.assertEqual(WebhookRecu.objects.count(), 1)
+
+
+class TraitementTests(WebhookTestMixin, TestCase):
+    '''Second temps : application par lots, statut vérifié auprès de Moneroo'''
+
+    def setUp(self):
+        cache.clear()
+        self.stub = MonerooStub()
+        self.stub.__enter__()
+        self.addCleanup(self.stub.__exit__)
+        reglages = override_settings(MONEROO_API_URL=self.stub.url)
+        reglages.enable()
+        self.addCleanup(reglages.disable)
+
+    def test_evenements_appliques_dans_l_ordre_de_reception(self):
+        commande, = self.creer_commandes(1)
+        self.stub.statuts[commande.moneroo_transaction_id] = 'success'
+        # Échec périmé puis succès, puis redélivrance
+        for corps in (
+            corps_webhook(commande.id, 'failed', 'py_1'),
+            corps_webhook(commande.id, 'success', 'py_2'),
+            corps_webhook(commande.id, 'success', 'py_2'),
+        ):
+            self.poster(corps)
+
+        self.assertEqual(traiter_lot(), (3, 0))
+
+        # Le statut vérifié prime sur le statut annoncé, une seule vérification
+        self.assertEqual(Commande.objects.get(pk=commande.pk).statut, 'paye')
+        self.assertEqual(
+            list(WebhookRecu.objects.values_list('resultat', flat=True)), ['paye', 'inchange', 'deja_traite']
+        )
+        self.assertEqual(EnvoiEmail.objects.filter(commande=commande).count(), 1)
+        self.assertFalse(WebhookRecu.objects.filter(statut='recu').exists())
+        self.assertEqual(self.stub.appels['verification'], 1)
+
+    def test_statut_non_confirme_replanifie(self):
+        '''Moneroo ne confirme pas (encore) le paiement : nouvel essai plus tard'''
+        commande, = self.creer_commandes(1)
+        self.poster(corps_webhook(commande.id, 'success'))
+
+        self.assertEqual(traiter_lot(), (0, 1))
+
+        recu = WebhookRecu.objects.get()
+        self.assertEqual((recu.statut, recu.tentatives), ('recu', 1))
+        self.assertIn('PaiementNonConfirme', recu.derniere_erreur)
+        self.assertEqual(Commande.objects.get(pk=commande.pk).statut, 'en_attente')
+
+    def test_partitions_disjointes(self):
+        commandes = self.creer_commandes(6)
+        for commande in commandes:
+            self.poster(corps_webhook(commande.id, 'success'))
+
+        paires = {recu.commande_id for recu in reserver_lot(100, partition=0, partitions=2)}
+        impaires = {recu.commande_id for recu in reserver_lot(100, partition=1, partitions=2)}
+
+        self.assertEqual({cid % 2 for cid in paires}, {0})
+        self.assertEqual({cid % 2 for cid in impaires}, {1})
+        self.assertEqual(paires | impaires, {commande.id for commande in commandes})
+        # Lot réservé : invisible jusqu'à l'expiration de la réservation
+        self.assertEqual(reserver_lot(100), [])
+
+    def test_commande_introuvable(self):
+        self.poster(corps_webhook(999999, 'success'))
+
+        self.assertEqual(traiter_lot(), (1, 0))
+        self.assertEqual(WebhookRecu.objects.get().resultat, 'introuvable')
+
+
+    def test_ordre_preserve_apres_un_echec(self):
+        '''Webhook en échec replanifié : les suivants de la même commande l'attendent'''
+        commande, autre = self.creer_commandes(2)
+        self.stub.statuts[autre.moneroo_transaction_id] = 'success'
+        self.poster(corps_webhook(commande.id, 'success', 'py_1'))
+        self.poster(corps_webhook(commande.id, 'failed', 'py_2'))
+        self.poster(corps_webhook(autre.id, 'success', 'py_3'))
+
+        # Moneroo ne confirme pas encore le paiement de `commande`
+        self.assertEqual(traiter_lot(), (1, 2))
+        self.assertEqual(
+            list(WebhookRecu.objects.values_list('statut', 'tentatives')), [('recu', 1), ('recu', 0), ('traite', 1)]
+        )
+        self.assertEqual(reserver_lot(100), [])
+
+        # Premier webhook de nouveau dû : les deux sont appliqués, dans l'ordre
+        WebhookRecu.objects.filter(statut='recu').update(prochaine_tentative=timezone.now())
+        self.stub.statuts[commande.moneroo_transaction_id] = 'success'
+        cache.clear()
+        self.assertEqual(traiter_lot(), (2, 0))
+        self.assertEqual(
+            list(WebhookRecu.objects.filter(commande_id=commande.id).values_list('resultat', flat=True)),
+            ['paye', 'inchange']
+        )
+
+    def test_verification_hors_transaction(self):
+        '''Aucune transaction ouverte pendant l'appel à Moneroo'''
+        commande, = self.creer_commandes(1)
+        self.poster(corps_webhook(commande.id, 'success'))
+        transactions_du_test = len(connection.atomic_blocks)
+        ouvertes = []
+
+        def verifier(transaction_id):
+            ouvertes.append(len(connection.atomic_blocks) - transactions_du_test)
+            return 'success'
+
+        with mock.patch('formation.webhooks.statut_verifie', side_effect=verifier):
+            self.assertEqual(traiter_lot(), (1, 0))
+        self.assertEqual(ouvertes, [0])
+
+
+class TraitementParalleleTests(WebhookTestMixin, TestCase):
+    '''
+    Répartition d'un lot entre threads : chaque commande dans une seule
+    tranche, dans l'ordre de réception (l'application concurrente elle-même
+    demande PostgreSQL, SQLite en mémoire verrouille ses tables)
+    '''
+
+    def test_lot_reparti_par_commande(self):
+        commandes = self.creer_commandes(8)
+        for commande in commandes:
+            self.poster(corps_webhook(commande.id, 'failed', f'py_{commande.id}_1'))
+            self.poster(corps_webhook(commande.id, 'success', f'py_{commande.id}_2'))
+        tranches = []
+
+        def enregistrer(tranche):
+            tranches.append([(recu.commande_id, recu.id) for recu in tranche])
+            return len(tranche)
+
+        with mock.patch('formation.webhooks.traiter_tranche_thread', side_effect=enregistrer):
+            self.assertEqual(traiter_lot(threads=4), (16, 0))
+
+        self.assertEqual(len(tranches), 4)
+        for tranche in tranches:
+            self.assertEqual(len({commande_id % 4 for commande_id, _ in tranche}), 1)
+            self.assertEqual(tranche, sorted(tranche, key=lambda ligne: ligne[1]))
+
+
+class PurgeTests(TestCase):
+    '''Les webhooks traités ne sont conservés que WEBHOOK_RETENTION_JOURS'''
+
+    def creer(self, statut, age_jours):
+        date = timezone.now() - timedelta(days=age_jours)
+        return WebhookRecu.objects.create(
+            corps=b'{}', commande_id=1, statut=statut,
+            date_traitement=date if statut == 'traite' else None,
+        )
+
+    @override_settings(WEBHOOK_RETENTION_JOURS=30)
+    def test_purge_des_webhooks_traites_anciens(self):
+        anciens = [self.creer('traite', 40) for _ in range(3)]
+        conserves = [self.creer('traite', 5), self.creer('erreur', 40), self.creer('recu', 40)]
+
+        self.assertEqual(purger_traites(taille=2), 3)
+
+        self.assertFalse(WebhookRecu.objects.filter(id__in=[r.id for r in anciens]).exists())
+        self.assertEqual(WebhookRecu.objects.count(), len(conserves))
+
+    def test_purge_par_le_worker(self):
+        self.creer('traite', 400)
+        sortie = StringIO()
+
+        call_command('traiter_webhooks', stdout=sortie)
+
+        self.assertIn('1 webhook(s) traité(s) purgé(s)', sortie.getvalue())
+        self.assertFalse(WebhookRecu.objects.exists())
@@ -1,6 +1,17 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+# Vues de paiement : versions async en déploiement ASGI (SERVEUR_ASGI)
+if settings.SERVEUR_ASGI:
+    checkout_view = views.checkout_async_view
+    paiement_callback_view = views.paiement_callback_async_view
+    moneroo_webhook = views.moneroo_webhook_async
+else:
+    checkout_view = views.checkout_view
+    paiement_callback_view = views.paiement_callback_view
+    moneroo_webhook = views.moneroo_webhook
+
 urlpatterns = [
     # Pages principales
     path('', views.catalogue_view, name='catalogue'),
@@ -10,15 +21,24 @@ urlpatterns = [
     path('panier/ajouter/<int:formation_id>/', views.ajouter_panier_view, name='ajouter_panier'),
     path('panier/retirer/<int:formation_id>/', views.retirer_panier_view, name='retirer_panier'),
     path('panier/vider/', views.vider_panier_view, name='vider_panier'),
+    path('panier/compteur/', views.panier_compteur_view, name='panier_compteur'),
+
+    # API JSON (lecture seule)
+    path('api/formations/', views.api_formations_view, name='api_formations'),
 
     # Checkout et paiement
-    path('checkout/', views.checkout_view, name='checkout'),
-    path('paiement/callback/<int:commande_id>/', views.paiement_callback_view, name='paiement_callback'),
+    path('checkout/', checkout_view, name='checkout'),
+    path('checkout/attente/', views.paiement_en_preparation_view, name='paiement_en_preparation'),
+    path('paiement/callback/<int:commande_id>/', paiement_callback_view, name='paiement_callback'),
     path('confirmation/', views.confirmation_view, name='confirmation'),
 
     # Admin temporaire
     path('_create_admin/', views.create_superuser_temp, name='create_admin_temp'),
 
     # ✅ WEBHOOK MONEROO - LA SEULE ROUTE NÉCESSAIRE
-    path('moneroo/webhook/', views.moneroo_webhook, name='moneroo_webhook'),
+    path('moneroo/webhook/', moneroo_webhook, name='moneroo_webhook'),
+    path('moneroo/stats/', views.moneroo_stats_view, name='moneroo_stats'),
+
+    # Supervision
+    path('metrics', views.metrics_view, name='metrics'),
 ]
\ No newline at end of file
@@ -1,31 +1,26 @@
 import requests
 from django.conf import settings
-from django.core.mail import send_mail
+from django.core.cache import cache
+from django.core.mail import EmailMultiAlternatives
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
 from decimal import Decimal
 import json
+import logging
 import urllib.parse
 
+from .moneroo import get_client, get_client_async, CircuitOuvert
 
-import json
-import requests
-from django.conf import settings
 
+# Statuts de paiement renvoyés par Moneroo
+STATUTS_PAYES = ['success', 'successful', 'paid', 'completed']
+STATUTS_ECHOUES = ['failed', 'cancelled', 'canceled', 'declined']
 
-def creer_paiement_moneroo(commande):
-    """
-    Initialise un paiement avec Moneroo et retourne l'URL de paiement
-    VERSION FINALE - Conforme à la documentation officielle Moneroo
-    + CORRECTION ERREUR 422 (customer.phone must be a number)
-    """
+logger = logging.getLogger(__name__)
 
-    print("=== INITIALISATION PAIEMENT MONEROO ===")
-    print(f"Commande #{commande.id}")
-    print(f"Montant : {commande.montant_total} XAF")
-    print(f"Client : {commande.client.email}")
-    print("=" * 50)
 
-    # ENDPOINT OFFICIEL MONEROO
-    payment_url = "https://api.moneroo.io/v1/payments/initialize"
+def _payload_paiement(commande):
+    '''Corps de la requête d'initialisation d'un paiement Moneroo'''
 
     # --- Séparer le nom complet ---
     nom_parts = commande.client.nom_complet.strip().split(' ', 1)
@@ -44,7 +39,7 @@ def creer_paiement_moneroo(commande):
             phone_number = None  # champ optionnel → ignoré
 
     # --- PAYLOAD CONFORME MONEROO ---
-    payload = {
+    return {
         "amount": int(commande.montant_total),
         "currency": "XAF",
         "description": f"Achat de formation(s) - Commande #{commande.id}",
@@ -62,118 +57,205 @@ def creer_paiement_moneroo(commande):
         }
     }
 
-    # --- HEADERS ---
-    headers = {
-        "Authorization": f"Bearer {settings.MONEROO_API_KEY}",
-        "Content-Type": "application/json",
-        "Accept": "application/json"
-    }
+
+def _lire_initialisation(commande, response):
+    '''
+    Interprète la réponse de Moneroo (requests ou httpx) ; en cas de succès
+    renseigne la commande en mémoire et retourne l'URL de paiement
+    Lève ValueError (json.JSONDecodeError) si le corps n'est pas du JSON
+    '''
+    logger.debug("Moneroo : HTTP %s %s", response.status_code, response.text)
+
+    # --- SUCCÈS ---
+    if response.status_code in (200, 201):
+        data = response.json()
+        transaction_data = data.get("data", {})
+        checkout_url = transaction_data.get("checkout_url")
+        transaction_id = transaction_data.get("id")
+
+        if checkout_url and transaction_id:
+            commande.moneroo_transaction_id = transaction_id
+            commande.moneroo_payment_url = checkout_url
+            return checkout_url
+
+        logger.warning("Moneroo : réponse valide mais données incomplètes : %s", data)
+        return None
+
+    # --- ERREURS CONNUES ---
+    if response.status_code == 400:
+        logger.error("Moneroo : requête invalide (400) : %s", response.text)
+        return None
+
+    if response.status_code == 401:
+        logger.error("Moneroo : clé API invalide (401)")
+        return None
+
+    if response.status_code == 422:
+        logger.error("Moneroo : validation échouée (422) : %s", response.text)
+        return None
+
+    # --- AUTRES ERREURS ---
+    logger.error("Moneroo : erreur HTTP %s : %s", response.status_code, response.text)
+    return None
+
+
+def _paiement_initialise(commande):
+    logger.info(
+        "Paiement Moneroo initialisé",
+        extra={'commande_id': commande.id, 'transaction_id': commande.moneroo_transaction_id}
+    )
+
+
+CHAMPS_PAIEMENT = ['moneroo_transaction_id', 'moneroo_payment_url']
+CHEMIN_INITIALISATION = "/payments/initialize"
+
+
+def creer_paiement_moneroo(commande):
+    """
+    Initialise un paiement avec Moneroo et retourne l'URL de paiement
+    VERSION FINALE - Conforme à la documentation officielle Moneroo
+    + CORRECTION ERREUR 422 (customer.phone must be a number)
+    """
+
+    logger.info(
+        "Initialisation du paiement Moneroo",
+        extra={'commande_id': commande.id, 'montant': str(commande.montant_total)}
+    )
+
+    # ENDPOINT OFFICIEL MONEROO
+    client = get_client()
+    payload = _payload_paiement(commande)
 
     try:
-        print(f"[REQUEST] POST {payment_url}")
-        print(f"[PAYLOAD]\n{json.dumps(payload, indent=2)}")
-
-        response = requests.post(
-            payment_url,
-            json=payload,
-            headers=headers,
-            timeout=15
-        )
+        logger.debug("Moneroo : POST %s%s payload %s", client.base_url, CHEMIN_INITIALISATION, payload)
+
+        response = client.post(CHEMIN_INITIALISATION, json=payload)
+        checkout_url = _lire_initialisation(commande, response)
+        if checkout_url:
+            commande.save(update_fields=CHAMPS_PAIEMENT)
+            _paiement_initialise(commande)
+        return checkout_url
 
-        print(f"[RESPONSE] HTTP {response.status_code}")
-        print(f"[RESPONSE] {response.text}")
-
-        # --- SUCCÈS ---
-        if response.status_code in (200, 201):
-            data = response.json()
-            transaction_data = data.get("data", {})
-            checkout_url = transaction_data.get("checkout_url")
-            transaction_id = transaction_data.get("id")
-
-            if checkout_url and transaction_id:
-                commande.moneroo_transaction_id = transaction_id
-                commande.moneroo_payment_url = checkout_url
-                commande.save()
-
-                print("✅ SUCCÈS MONEROO")
-                print(f"   Transaction ID : {transaction_id}")
-                print(f"   URL Paiement   : {checkout_url}")
-
-                return checkout_url
-
-            print("⚠️ Réponse valide mais données incomplètes")
-            print(json.dumps(data, indent=2))
-            return None
-
-        # --- ERREURS CONNUES ---
-        if response.status_code == 400:
-            print("🔴 ERREUR 400 : Requête invalide")
-            print(response.json())
-            return None
-
-        if response.status_code == 401:
-            print("🔴 ERREUR 401 : Clé API invalide")
-            return None
-
-        if response.status_code == 422:
-            print("🔴 ERREUR 422 : Validation échouée")
-            print(json.dumps(response.json(), indent=2))
-            return None
-
-        # --- AUTRES ERREURS ---
-        print(f"🔴 ERREUR HTTP {response.status_code}")
-        print(response.text)
+    except CircuitOuvert as e:
+        logger.error("Moneroo : %s", e)
         return None
 
     except requests.exceptions.Timeout:
-        print("❌ TIMEOUT : Moneroo ne répond pas")
+        logger.error("Moneroo : délai dépassé")
         return None
 
     except requests.exceptions.RequestException as e:
-        print(f"❌ ERREUR RÉSEAU : {e}")
+        logger.error("Moneroo : erreur réseau : %s", e)
         return None
 
     except json.JSONDecodeError:
-        print("❌ ERREUR JSON : Réponse invalide")
+        logger.error("Moneroo : réponse JSON invalide")
         return None
 
 
-def verifier_paiement_moneroo(transaction_id):
+async def creer_paiement_moneroo_async(commande):
     '''
-    Vérifie le statut d'un paiement auprès de Moneroo
-    Retourne True si le paiement est validé
+    Variante asynchrone de creer_paiement_moneroo (vues ASGI) : l'attente de
+    Moneroo ne bloque aucun thread. La commande doit avoir son client chargé
     '''
-    headers = {
-        'Authorization': f'Bearer {settings.MONEROO_API_KEY}',
-        'Accept': 'application/json'
-    }
+    import httpx
+
+    logger.info(
+        "Initialisation du paiement Moneroo",
+        extra={'commande_id': commande.id, 'montant': str(commande.montant_total)}
+    )
+
+    client = get_client_async()
+    payload = _payload_paiement(commande)
+
+    try:
+        logger.debug("Moneroo : POST %s%s payload %s", client.base_url, CHEMIN_INITIALISATION, payload)
+
+        response = await client.post(CHEMIN_INITIALISATION, json=payload)
+        checkout_url = _lire_initialisation(commande, response)
+        if checkout_url:
+            await commande.asave(update_fields=CHAMPS_PAIEMENT)
+            _paiement_initialise(commande)
+        return checkout_url
+
+    except CircuitOuvert as e:
+        logger.error("Moneroo : %s", e)
+        return None
+
+    except httpx.TimeoutException:
+        logger.error("Moneroo : délai dépassé")
+        return None
 
+    except httpx.HTTPError as e:
+        logger.error("Moneroo : erreur réseau : %s", e)
+        return None
+
+    except json.JSONDecodeError:
+        logger.error("Moneroo : réponse JSON invalide")
+        return None
+
+
+def _chemin_statut(transaction_id):
     # Endpoint de vérification (à confirmer dans la doc)
-    url = f'https://api.moneroo.io/v1/payments/{transaction_id}'
+    return f'/payments/{transaction_id}'
 
+
+def _lire_statut(transaction_id, response):
+    '''Statut lu dans la réponse de vérification, None si Moneroo est en erreur'''
+    if response.status_code != 200:
+        logger.warning("Moneroo : vérification de %s en erreur HTTP %s", transaction_id, response.status_code)
+        return None
+
+    data = response.json()
+
+    # Extraire le statut (peut être dans data.status ou data.data.status)
+    payment_data = data.get('data', {})
+    status = (payment_data.get('status') or data.get('status') or '').lower()
+
+    logger.debug("Moneroo : paiement %s au statut %s", transaction_id, status)
+    return status
+
+
+def statut_paiement_moneroo(transaction_id):
+    '''
+    Interroge Moneroo sur l'état d'un paiement
+    Retourne le statut brut en minuscules ('success', 'failed', 'pending'...)
+    ou None si Moneroo n'a pas pu répondre
+    '''
     try:
-        response = requests.get(url, headers=headers, timeout=10)
+        response = get_client().get(
+            _chemin_statut(transaction_id),
+            timeout=(settings.MONEROO_CONNECT_TIMEOUT, settings.PAIEMENT_VERIFICATION_TIMEOUT),
+        )
+        return _lire_statut(transaction_id, response)
 
-        if response.status_code == 200:
-            data = response.json()
+    except (CircuitOuvert, requests.exceptions.RequestException, ValueError) as e:
+        logger.warning("Moneroo : vérification de %s impossible : %s", transaction_id, e)
+        return None
 
-            # Extraire le statut (peut être dans data.status ou data.data.status)
-            payment_data = data.get('data', {})
-            status = payment_data.get('status', '').lower()
 
-            # Statuts possibles selon les standards :
-            # 'success', 'successful', 'paid', 'completed'
-            is_paid = status in ['success', 'successful', 'paid', 'completed']
+async def statut_paiement_moneroo_async(transaction_id):
+    '''Variante asynchrone de statut_paiement_moneroo (vues ASGI)'''
+    import httpx
 
-            print(f"[VERIFICATION] Paiement {transaction_id} : {status}")
-            return is_paid
-        else:
-            print(f"[VERIFICATION] Erreur HTTP {response.status_code}")
-            return False
+    try:
+        response = await get_client_async().get(
+            _chemin_statut(transaction_id),
+            timeout=httpx.Timeout(settings.PAIEMENT_VERIFICATION_TIMEOUT, connect=settings.MONEROO_CONNECT_TIMEOUT),
+        )
+        return _lire_statut(transaction_id, response)
 
-    except requests.exceptions.RequestException as e:
-        print(f"Erreur vérification Moneroo: {e}")
-        return False
+    except (CircuitOuvert, httpx.HTTPError, ValueError) as e:
+        logger.warning("Moneroo : vérification de %s impossible : %s", transaction_id, e)
+        return None
+
+
+def verifier_paiement_moneroo(transaction_id):
+    '''
+    Vérifie le statut d'un paiement auprès de Moneroo
+    Retourne True si le paiement est validé
+    '''
+    return statut_paiement_moneroo(transaction_id) in STATUTS_PAYES
 
 
 def generer_message_whatsapp(commande):
@@ -197,161 +279,77 @@ def generer_message_whatsapp(commande):
     return whatsapp_url
 
 
-def envoyer_acces_formation_email(commande):
+def cle_fragment_email(formation, format_):
     '''
-    Envoie automatiquement les accès aux formations par email
-    Retourne True si l'envoi a réussi, False sinon
+    Clé du bloc d'une formation dans l'email d'accès ; elle change avec
+    date_modification, donc toute modification invalide le bloc
     '''
-    formations_liste = commande.formations.all()
-
-    # Construction du message HTML
-    message_html = f"""
-    <html>
-    <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-        <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
-            <div style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); padding: 30px; border-radius: 10px 10px 0 0; text-align: center;">
-                <h1 style="color: white; margin: 0;">🎉 Bienvenue !</h1>
-            </div>
-
-            <div style="background: white; padding: 30px; border: 1px solid #eee; border-top: none;">
-                <p style="font-size: 16px;">Bonjour <strong>{commande.client.nom_complet}</strong>,</p>
-
-                <p>Merci pour votre achat ! Votre paiement a été confirmé avec succès.</p>
-
-                <div style="background: #f8f9fa; padding: 20px; border-radius: 8px; margin: 25px 0;">
-                    <p style="margin: 0; font-size: 14px; color: #666;">Numéro de commande</p>
-                    <p style="margin: 5px 0 0 0; font-size: 24px; font-weight: bold; color: #667eea;">#{commande.id}</p>
-                    <p style="margin: 10px 0 0 0; font-size: 14px; color: #666;">Montant payé : <strong>{commande.montant_total} FCFA</strong></p>
-                </div>
-
-                <h2 style="color: #667eea; border-bottom: 2px solid #667eea; padding-bottom: 10px;">📚 Vos accès aux formations</h2>
-    """
-
-    # Ajouter chaque formation
-    for formation in formations_liste:
-        message_html += f"""
-                <div style="border-left: 4px solid #667eea; padding: 15px; margin: 20px 0; background: #f8f9fa; border-radius: 0 8px 8px 0;">
-                    <h3 style="color: #2c3e50; margin: 0 0 15px 0; font-size: 18px;">{formation.titre}</h3>
-        """
-
-        if formation.lien_youtube:
-            message_html += f"""
-                    <div style="margin: 10px 0;">
-                        <p style="margin: 0; font-weight: bold; color: #555;">🎥 Vidéos de formation (YouTube)</p>
-                        <a href="{formation.lien_youtube}" style="color: #667eea; text-decoration: none; word-break: break-all;">{formation.lien_youtube}</a>
-                    </div>
-            """
-
-        if formation.lien_drive:
-            message_html += f"""
-                    <div style="margin: 10px 0;">
-                        <p style="margin: 0; font-weight: bold; color: #555;">📁 Documents et ressources (Google Drive)</p>
-                        <a href="{formation.lien_drive}" style="color: #667eea; text-decoration: none; word-break: break-all;">{formation.lien_drive}</a>
-                    </div>
-            """
-
-        if not formation.lien_youtube and not formation.lien_drive:
-            message_html += f"""
-                    <p style="color: #f39c12; margin: 0;">⏳ Les accès seront ajoutés très prochainement</p>
-            """
-
-        message_html += """
-                </div>
-        """
-
-    # Pied du message
-    message_html += f"""
-                <div style="background: linear-gradient(135deg, #e8f5e9 0%, #c8e6c9 100%); padding: 20px; border-radius: 8px; margin: 30px 0;">
-                    <h3 style="color: #2c3e50; margin: 0 0 15px 0;">✅ Vos garanties</h3>
-                    <ul style="margin: 0; padding-left: 20px;">
-                        <li style="margin: 8px 0;">Accès illimité à vie aux ressources</li>
-                        <li style="margin: 8px 0;">Support disponible via WhatsApp</li>
-                        <li style="margin: 8px 0;">Mises à jour gratuites du contenu</li>
-                        <li style="margin: 8px 0;">Certificat de fin de formation</li>
-                    </ul>
-                </div>
-
-                <div style="background: #fff3cd; border-left: 4px solid #ffc107; padding: 15px; margin: 20px 0; border-radius: 0 8px 8px 0;">
-                    <p style="margin: 0; color: #856404;">
-                        <strong>💡 Besoin d'aide ?</strong><br>
-                        Contactez-nous sur WhatsApp au <strong>{settings.ADMIN_WHATSAPP}</strong>
-                    </p>
-                </div>
-
-                <p style="margin-top: 30px;">Bonne formation ! 🚀</p>
-                <p style="color: #667eea; font-weight: bold;">L'équipe Formations</p>
-            </div>
-
-            <div style="background: #f8f9fa; padding: 20px; text-align: center; border-radius: 0 0 10px 10px;">
-                <p style="margin: 0; font-size: 12px; color: #999;">
-                    Cet email a été envoyé automatiquement. Merci de ne pas y répondre.<br>
-                    Pour toute question, contactez-nous sur WhatsApp.
-                </p>
-            </div>
-        </div>
-    </body>
-    </html>
-    """
-
-    # Message texte simple (fallback pour clients email sans HTML)
-    message_text = f"""
-🎉 BIENVENUE DANS VOTRE FORMATION !
-
-Bonjour {commande.client.nom_complet},
-
-Merci pour votre achat ! Votre paiement a été confirmé avec succès.
-
-📋 DÉTAILS DE VOTRE COMMANDE
-━━━━━━━━━━━━━━━━━━━━━━━━━━━
-Numéro de commande : #{commande.id}
-Montant payé : {commande.montant_total} FCFA
-
-
-📚 VOS ACCÈS AUX FORMATIONS
-━━━━━━━━━━━━━━━━━━━━━━━━━━━
-"""
+    horodatage = formation.date_modification.timestamp() if formation.date_modification else 0
+    return f'email:acces:{format_}:{formation.id}:{horodatage}'
 
-    for formation in formations_liste:
-        message_text += f"\n▶ {formation.titre}\n"
-        if formation.lien_youtube:
-            message_text += f"  🎥 YouTube : {formation.lien_youtube}\n"
-        if formation.lien_drive:
-            message_text += f"  📁 Drive : {formation.lien_drive}\n"
-        if not formation.lien_youtube and not formation.lien_drive:
-            message_text += f"  ⏳ Accès en cours de préparation\n"
-
-    message_text += f"""
-
-✅ VOS GARANTIES
-━━━━━━━━━━━━━━━━━━━━━━━━━━━
-- Accès illimité à vie
-- Support WhatsApp
-- Mises à jour gratuites
-- Certificat de formation
 
+def fragments_acces(formations, format_):
+    '''
+    Retourne le bloc rendu de chaque formation (format_ = 'html' ou 'txt')
+    Les blocs sont partagés entre commandes : chacun n'est rendu qu'une
+    fois par date_modification, puis lu dans le cache en une seule requête
+    '''
+    cles = [cle_fragment_email(formation, format_) for formation in formations]
+    en_cache = cache.get_many(cles)
+    manquants = {}
+    fragments = []
+    for cle, formation in zip(cles, formations):
+        fragment = en_cache.get(cle)
+        if fragment is None:
+            fragment = manquants[cle] = render_to_string(
+                f'formation/emails/_acces_formation.{format_}', {'formation': formation}
+            )
+        fragments.append(mark_safe(fragment))
+    if manquants:
+        cache.set_many(manquants, settings.EMAIL_FRAGMENT_CACHE_TIMEOUT)
+    return fragments
+
+
+def construire_email_acces(commande, connection=None):
+    '''
+    Construit l'email (texte + HTML) contenant les accès aux formations
+    à partir des templates formation/emails/acces.{html,txt}
+    '''
+    # Une seule évaluation (ou aucune si préchargée via with_details)
+    formations_liste = list(commande.formations.all())
 
-💡 BESOIN D'AIDE ?
-━━━━━━━━━━━━━━━━━━━━━━━━━━━
-WhatsApp : {settings.ADMIN_WHATSAPP}
+    contexte = {'commande': commande, 'admin_whatsapp': settings.ADMIN_WHATSAPP}
+    message_text = render_to_string(
+        'formation/emails/acces.txt',
+        {**contexte, 'fragments': fragments_acces(formations_liste, 'txt')}
+    )
+    message_html = render_to_string(
+        'formation/emails/acces.html',
+        {**contexte, 'fragments': fragments_acces(formations_liste, 'html')}
+    )
 
+    message = EmailMultiAlternatives(
+        subject=f'🎓 Vos accès aux formations - Commande #{commande.id}',
+        body=message_text,  # Version texte
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[commande.client.email],
+        connection=connection,
+    )
+    message.attach_alternative(message_html, 'text/html')  # Version HTML (plus jolie)
+    return message
 
-Bonne formation ! 🚀
-L'équipe Formations
-"""
 
+def envoyer_acces_formation_email(commande, connection=None):
+    '''
+    Envoie les accès aux formations par email
+    Une connexion SMTP déjà ouverte peut être fournie pour l'envoi par lots
+    Retourne True si l'envoi a réussi, False sinon
+    '''
     try:
-        # Envoi de l'email
-        send_mail(
-            subject=f'🎓 Vos accès aux formations - Commande #{commande.id}',
-            message=message_text,  # Version texte
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[commande.client.email],
-            html_message=message_html,  # Version HTML (plus jolie)
-            fail_silently=False,
-        )
-        print(f"✅ Email envoyé avec succès à {commande.client.email}")
+        construire_email_acces(commande, connection=connection).send(fail_silently=False)
+        logger.info("Email d'accès envoyé", extra={'commande_id': commande.id})
         return True
 
     except Exception as e:
-        print(f"❌ Erreur lors de l'envoi de l'email : {e}")
-        return False
\ No newline at end of file
+        logger.error("Échec de l'envoi de l'email d'accès : %s", e, extra={'commande_id': commande.id})
+        return False
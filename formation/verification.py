@@ -0,0 +1,181 @@
+'''
+Vérification des paiements auprès de Moneroo, partagée par le callback et
+le webhook
+- le statut vérifié est mis en cache par transaction : longtemps s'il est
+  définitif (payé, échoué), quelques secondes s'il peut encore changer
+- single-flight : les vérifications simultanées d'une même transaction ne
+  font qu'un appel à Moneroo, entre threads d'un worker (verrou en mémoire)
+  comme entre workers (verrou posé dans le cache partagé par cache.add)
+- statut_verifie_async : même protocole pour les vues ASGI, avec un Future
+  par transaction et par boucle d'événements ; l'attente n'occupe aucun thread
+'''
+import asyncio
+import math
+import threading
+import time
+import weakref
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .utils import statut_paiement_moneroo, statut_paiement_moneroo_async, STATUTS_PAYES, STATUTS_ECHOUES
+
+
+PREFIXE_CACHE = 'moneroo:paiement:'
+INTERVALLE_ATTENTE = 0.1
+
+
+class _Vol:
+    '''Vérification en cours dans ce processus, partagée par les threads qui l'attendent'''
+
+    def __init__(self):
+        self.termine = threading.Event()
+        self.statut = None
+
+
+_vols = {}
+_vols_lock = threading.Lock()
+
+# Vérifications asynchrones en cours : {boucle: {clé: Future}}
+_vols_async = weakref.WeakKeyDictionary()
+
+
+def duree_max_appel():
+    '''
+    Pire durée d'un appel de vérification, tentatives rejouées par le client
+    Moneroo comprises (durée du verrou entre workers)
+    '''
+    tentatives = settings.MONEROO_RETRIES + 1
+    return tentatives * (settings.MONEROO_CONNECT_TIMEOUT + settings.PAIEMENT_VERIFICATION_TIMEOUT) + 1
+
+
+def duree_max_verification():
+    '''
+    Pire durée d'une vérification menée par ce processus : attente d'un
+    autre worker puis appel à Moneroo. Les threads suiveurs attendent
+    au moins aussi longtemps que le meneur
+    '''
+    return settings.PAIEMENT_VERIFICATION_ATTENTE + duree_max_appel()
+
+
+def statut_verifie(transaction_id):
+    '''
+    Statut Moneroo d'un paiement ('success', 'failed', 'pending'...) ou None
+    si Moneroo n'a pas pu répondre (ou pas à temps)
+    '''
+    if not transaction_id:
+        return None
+    cle = PREFIXE_CACHE + transaction_id
+    statut = cache.get(cle)
+    if statut is not None:
+        return statut
+
+    with _vols_lock:
+        vol = _vols.get(cle)
+        meneur = vol is None
+        if meneur:
+            vol = _vols[cle] = _Vol()
+    if not meneur:
+        vol.termine.wait(duree_max_verification())
+        return vol.statut
+
+    try:
+        vol.statut = _verifier_entre_workers(transaction_id, cle)
+        return vol.statut
+    finally:
+        with _vols_lock:
+            del _vols[cle]
+        vol.termine.set()
+
+
+def _verifier_entre_workers(transaction_id, cle):
+    '''
+    Un seul worker interroge Moneroo pour une transaction donnée : celui qui
+    pose le verrou ; les autres attendent que le statut arrive dans le cache,
+    au plus PAIEMENT_VERIFICATION_ATTENTE secondes
+    '''
+    verrou = cle + ':verrou'
+    limite = time.monotonic() + settings.PAIEMENT_VERIFICATION_ATTENTE
+    while True:
+        if cache.add(verrou, 1, timeout=math.ceil(duree_max_appel())):
+            try:
+                statut = statut_paiement_moneroo(transaction_id)
+                if statut is not None:
+                    cache.set(cle, statut, duree_cache(statut))
+                return statut
+            finally:
+                cache.delete(verrou)
+
+        # Un autre worker vérifie : son résultat arrive dans le cache, ou le
+        # verrou disparaît (échec) et ce worker retente de le poser
+        while time.monotonic() < limite:
+            time.sleep(INTERVALLE_ATTENTE)
+            statut = cache.get(cle)
+            if statut is not None:
+                return statut
+            if cache.get(verrou) is None:
+                break
+        else:
+            return None
+
+
+async def statut_verifie_async(transaction_id):
+    '''Variante asynchrone de statut_verifie (vues ASGI)'''
+    if not transaction_id:
+        return None
+    cle = PREFIXE_CACHE + transaction_id
+    statut = await cache.aget(cle)
+    if statut is not None:
+        return statut
+
+    # Une seule boucle par worker : rien ne s'intercale entre lecture et
+    # inscription du Future, pas de verrou nécessaire
+    boucle = asyncio.get_running_loop()
+    vols = _vols_async.setdefault(boucle, {})
+    vol = vols.get(cle)
+    if vol is not None:
+        try:
+            return await asyncio.wait_for(asyncio.shield(vol), duree_max_verification())
+        except asyncio.TimeoutError:
+            return None
+
+    vol = vols[cle] = boucle.create_future()
+    try:
+        statut = await _verifier_entre_workers_async(transaction_id, cle)
+        vol.set_result(statut)
+        return statut
+    finally:
+        del vols[cle]
+        if not vol.done():
+            vol.set_result(None)
+
+
+async def _verifier_entre_workers_async(transaction_id, cle):
+    '''Variante asynchrone de _verifier_entre_workers (même verrou dans le cache)'''
+    verrou = cle + ':verrou'
+    limite = time.monotonic() + settings.PAIEMENT_VERIFICATION_ATTENTE
+    while True:
+        if await cache.aadd(verrou, 1, timeout=math.ceil(duree_max_appel())):
+            try:
+                statut = await statut_paiement_moneroo_async(transaction_id)
+                if statut is not None:
+                    await cache.aset(cle, statut, duree_cache(statut))
+                return statut
+            finally:
+                await cache.adelete(verrou)
+
+        while time.monotonic() < limite:
+            await asyncio.sleep(INTERVALLE_ATTENTE)
+            statut = await cache.aget(cle)
+            if statut is not None:
+                return statut
+            if await cache.aget(verrou) is None:
+                break
+        else:
+            return None
+
+
+def duree_cache(statut):
+    if statut in STATUTS_PAYES or statut in STATUTS_ECHOUES:
+        return settings.PAIEMENT_CACHE_TIMEOUT_FINAL
+    return settings.PAIEMENT_CACHE_TIMEOUT
@@ -1,116 +1,263 @@
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.contrib import messages
-from django.views.decorators.http import require_http_methods
+from django.views.decorators.http import require_http_methods, condition
+from django.views.decorators.cache import cache_control, never_cache
+from django.views.decorators.gzip import gzip_page
 from django.contrib.auth.models import User
-from django.http import HttpResponse, JsonResponse, HttpResponseForbidden
+from django.http import HttpResponse, JsonResponse, HttpResponseForbidden, Http404
 from django.views.decorators.csrf import csrf_exempt
+from django.contrib.admin.views.decorators import staff_member_required
 from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
 from .models import Formation, Client, Commande
 from .forms import ClientForm
-from .utils import creer_paiement_moneroo, generer_message_whatsapp, envoyer_acces_formation_email
+from .utils import (
+    creer_paiement_moneroo, creer_paiement_moneroo_async, generer_message_whatsapp,
+    STATUTS_PAYES, STATUTS_ECHOUES,
+)
+from .outbox import mettre_en_file_acces
+from .webhooks import preparer_reception, WebhookInvalide
+from .verification import statut_verifie, statut_verifie_async
+from .moneroo import get_client
+from .logs import lier_commande
+from .metrics import registre
+from .panier import Panier, formations_par_id
+from .recherche import normaliser, rechercher
+from .cache import (
+    formations_actives, grille_catalogue,
+    etag_catalogue, last_modified_catalogue, etag_panier, version_catalogue,
+)
+from datetime import datetime
 from decimal import Decimal
-import json
+import asyncio
+import base64
+import binascii
 import hashlib
 import hmac
+import logging
+import time
 
 
+logger = logging.getLogger(__name__)
+
+# Intervalle de relecture d'une commande dont le paiement est initialisé
+# par une autre requête (soumissions concurrentes du checkout, vue async)
+ATTENTE_REPRISE_INTERVALLE = 0.25
+
+# Vue synchrone : la page d'attente se recharge toutes les N secondes
+# plutôt que d'immobiliser un worker WSGI
+ATTENTE_REPRISE_RAFRAICHISSEMENT = 2
+SESSION_PAIEMENT_EN_PREPARATION = 'paiement_en_preparation'
+
+
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=etag_catalogue, last_modified_func=last_modified_catalogue)
 def catalogue_view(request):
-    '''Affiche toutes les formations actives'''
-    formations = Formation.objects.filter(active=True)
-    print(f"DEBUG: {formations.count()} formations actives trouvées")
-    for f in formations:
-        print(f"  - {f.titre}")
-    return render(request, 'formation/catalogue.html', {'formations': formations})
+    '''
+    Affiche toutes les formations actives, ou les résultats de ?q=
+    La grille est un fragment partagé mis en cache par version du catalogue ;
+    un GET conditionnel dont l'ETag correspond reçoit un 304 sans rendu
+    '''
+    recherche = normaliser(request.GET.get('q', ''))
+    if recherche:
+        formations = rechercher(recherche)
+        grille = grille_catalogue(request, formations)
+    else:
+        formations = formations_actives()
+        grille = grille_catalogue(request)
+    logger.debug("%d formations affichées", len(formations))
+    return render(request, 'formation/catalogue.html', {
+        'formations': formations,
+        'grille': grille,
+        'recherche': recherche,
+    })
 
 
 @require_http_methods(["POST"])
 def ajouter_panier_view(request, formation_id):
     '''Ajoute une formation au panier (session)'''
-    formation = get_object_or_404(Formation, id=formation_id, active=True)
-    panier = request.session.get('panier', {})
-    panier[str(formation.id)] = {
-        'titre': formation.titre,
-        'prix': str(formation.prix),
-    }
-    request.session['panier'] = panier
+    formation = formations_par_id().get(formation_id)
+    if formation is None:
+        raise Http404("Formation introuvable")
+    Panier(request).ajouter(formation.id)
     messages.success(request, f'"{formation.titre}" ajoutée au panier !')
     return redirect('panier')
 
 
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=etag_panier)
 def panier_view(request):
     '''Affiche le contenu du panier'''
-    panier = request.session.get('panier', {})
-    formations_ids = panier.keys()
-    formations = Formation.objects.filter(id__in=formations_ids)
-    total = sum([f.prix for f in formations])
-    return render(request, 'formation/panier.html', {'formations': formations, 'total': total})
+    panier = Panier(request)
+    return render(request, 'formation/panier.html', {
+        'formations': panier.formations(),
+        'total': panier.total(),
+    })
 
 
 @require_http_methods(["POST"])
 def retirer_panier_view(request, formation_id):
     '''Retire une formation du panier'''
-    panier = request.session.get('panier', {})
-    if str(formation_id) in panier:
-        formation_titre = panier[str(formation_id)]['titre']
-        del panier[str(formation_id)]
-        request.session['panier'] = panier
+    if Panier(request).retirer(formation_id):
+        formation = formations_par_id().get(formation_id)
+        formation_titre = formation.titre if formation else 'Formation'
         messages.info(request, f'"{formation_titre}" retirée du panier.')
     return redirect('panier')
 
 
+@never_cache
+def panier_compteur_view(request):
+    '''Nombre d'articles du panier, pour le badge des pages partagées'''
+    return JsonResponse({'count': len(Panier(request))})
+
+
 def vider_panier_view(request):
     '''Vide complètement le panier'''
-    request.session['panier'] = {}
+    Panier(request).vider()
     messages.info(request, 'Panier vidé.')
     return redirect('panier')
 
 
-def checkout_view(request):
-    '''Affiche le formulaire client avant paiement'''
-    panier = request.session.get('panier', {})
-    if not panier:
+def _checkout_preparer(request):
+    '''
+    Partie de checkout_view sans appel à Moneroo, partagée avec la vue async
+    Retourne (reponse, commande, contexte, nouvelle) : si une commande est à
+    payer, reponse vaut None ; `nouvelle` indique s'il faut initialiser son
+    paiement ou attendre celui que la soumission précédente initialise
+    '''
+    panier = Panier(request)
+    formations = panier.formations()
+    if not formations:
         messages.warning(request, 'Votre panier est vide.')
-        return redirect('catalogue')
+        return redirect('catalogue'), None, None, False
 
-    formations_ids = panier.keys()
-    formations = Formation.objects.filter(id__in=formations_ids)
-    total = sum([f.prix for f in formations])
+    total = panier.total()
 
     if request.method == 'POST':
-        form = ClientForm(request.POST)
+        form = ClientForm.soumis(request.POST)
         if form.is_valid():
-            client, created = Client.objects.get_or_create(
-                email=form.cleaned_data['email'],
-                defaults={
-                    'nom_complet': form.cleaned_data['nom_complet'],
-                    'whatsapp': form.cleaned_data['whatsapp'],
-                }
-            )
-            commande = Commande.objects.create(client=client, montant_total=total)
-            commande.formations.set(formations)
-            print(f"✅ [CHECKOUT] Commande #{commande.id} créée pour {client.email}")
-
-            try:
-                payment_url = creer_paiement_moneroo(commande)
-                if payment_url:
-                    return redirect(payment_url)
-                else:
-                    messages.error(request, 'Erreur lors de l\'initialisation du paiement.')
-                    commande.delete()
-            except Exception as e:
-                print(f"🔴 [ERREUR] {type(e).__name__} - {e}")
-                import traceback
-                traceback.print_exc()
-                messages.error(request, f'Une erreur interne est survenue: {e}')
-                commande.delete()
+            contexte = {'form': form, 'formations': formations, 'total': total}
+            empreinte = panier.empreinte()
+            with transaction.atomic():
+                # Ligne client verrouillée : deux soumissions simultanées
+                # (double clic, page lente) passent l'une après l'autre et
+                # la seconde trouve la commande créée par la première
+                client, created = Client.objects.select_for_update().get_or_create(
+                    email__lower=form.cleaned_data['email'],
+                    defaults={
+                        'email': form.cleaned_data['email'],
+                        'nom_complet': form.cleaned_data['nom_complet'],
+                        'whatsapp': form.cleaned_data['whatsapp'],
+                    }
+                )
+                existante = None if created else (
+                    Commande.objects.paiement_en_cours(client, empreinte, total).first()
+                )
+                if existante is None:
+                    commande = Commande.objects.create(
+                        client=client, montant_total=total, empreinte_panier=empreinte
+                    )
+                    commande.formations.add(*(formation.id for formation in formations))
+
+            if existante is not None:
+                lier_commande(existante.id)
+                if existante.moneroo_payment_url:
+                    logger.info("Checkout : paiement en cours repris")
+                    return redirect(existante.moneroo_payment_url), None, contexte, False
+                logger.info("Checkout : paiement en cours d'initialisation par une autre requête")
+                return None, existante, contexte, False
+
+            lier_commande(commande.id)
+            logger.info("Commande créée", extra={'client_id': client.id, 'montant': str(total)})
+            return None, commande, contexte, True
     else:
         form = ClientForm()
 
-    return render(request, 'formation/checkout.html', {
-        'form': form,
-        'formations': formations,
-        'total': total
-    })
+    contexte = {'form': form, 'formations': formations, 'total': total}
+    return render(request, 'formation/checkout.html', contexte), None, contexte, False
+
+
+def _checkout_echec(request, commande, contexte, erreur=None):
+    '''
+    Paiement non initialisé : la commande est supprimée (si cette requête
+    l'a créée), le formulaire réaffiché
+    '''
+    if erreur is not None:
+        messages.error(request, f'Une erreur interne est survenue: {erreur}')
+    else:
+        messages.error(request, 'Erreur lors de l\'initialisation du paiement.')
+    if commande is not None:
+        commande.delete()
+    return render(request, 'formation/checkout.html', contexte)
+
+
+def _url_paiement_initialise(commande_id):
+    '''
+    URL de paiement d'une commande en cours d'initialisation : chaîne vide
+    tant que Moneroo n'a pas répondu, None si la commande n'est plus payable
+    '''
+    urls = list(
+        Commande.objects
+        .filter(id=commande_id, statut='en_attente')
+        .values_list('moneroo_payment_url', flat=True)[:1]
+    )
+    if not urls:
+        return None
+    return urls[0] or ''
+
+
+def _paiement_en_preparation(request, commande_id):
+    '''
+    Paiement initialisé par une autre requête : redirige vers Moneroo si
+    l'URL est connue, sinon répond tout de suite par une page qui se
+    recharge (aucun worker n'attend la réponse de Moneroo)
+    '''
+    url = _url_paiement_initialise(commande_id)
+    if url:
+        request.session.pop(SESSION_PAIEMENT_EN_PREPARATION, None)
+        return redirect(url)
+    if url is None:
+        request.session.pop(SESSION_PAIEMENT_EN_PREPARATION, None)
+        messages.error(request, 'Erreur lors de l\'initialisation du paiement.')
+        return redirect('checkout')
+
+    request.session[SESSION_PAIEMENT_EN_PREPARATION] = commande_id
+    response = render(request, 'formation/paiement_en_preparation.html')
+    # Rechargement en GET vers la page d'attente (jamais de nouveau POST)
+    response['Refresh'] = f"{ATTENTE_REPRISE_RAFRAICHISSEMENT}; url={reverse('paiement_en_preparation')}"
+    return response
+
+
+@never_cache
+def paiement_en_preparation_view(request):
+    '''Page d'attente rechargée jusqu'à ce que l'URL de paiement soit connue'''
+    commande_id = request.session.get(SESSION_PAIEMENT_EN_PREPARATION)
+    if commande_id is None:
+        return redirect('checkout')
+    return _paiement_en_preparation(request, commande_id)
+
+
+def checkout_view(request):
+    '''Affiche le formulaire client avant paiement'''
+    reponse, commande, contexte, nouvelle = _checkout_preparer(request)
+    if commande is None:
+        return reponse
+
+    if not nouvelle:
+        return _paiement_en_preparation(request, commande.id)
+
+    try:
+        payment_url = creer_paiement_moneroo(commande)
+    except Exception as e:
+        logger.exception("Erreur lors de l'initialisation du paiement")
+        return _checkout_echec(request, commande, contexte, e)
+
+    if payment_url:
+        return redirect(payment_url)
+    return _checkout_echec(request, commande, contexte)
 
 
 def paiement_callback_view(request, commande_id):
@@ -118,79 +265,127 @@ def paiement_callback_view(request, commande_id):
     Callback après redirection depuis Moneroo
     VERSION AMÉLIORÉE : Gère le cas où le webhook a déjà traité le paiement
     '''
-    commande = get_object_or_404(Commande, id=commande_id)
+    commande = get_object_or_404(Commande.objects.with_details(), id=commande_id)
+    return _traiter_callback(request, commande, _statut_callback(commande))
 
-    print("=" * 60)
-    print(f"[CALLBACK] Commande #{commande_id}")
-    print(f"[CALLBACK] Statut actuel : {commande.statut}")
-    print(f"[CALLBACK] Query params : {dict(request.GET)}")
-    print("=" * 60)
 
-    # CAS 1 : Le webhook a déjà marqué la commande comme payée
-    if commande.statut == 'paye' or commande.statut == 'acces_envoye':
-        print(f"✅ [CALLBACK] Commande déjà traitée par webhook - Affichage confirmation")
-        messages.success(request, '✅ Paiement confirmé ! Vos accès ont été envoyés par email.')
+async def checkout_async_view(request):
+    '''
+    Version ASGI de checkout_view (SERVEUR_ASGI) : pendant l'appel à
+    Moneroo, la boucle d'événements sert les autres requêtes. Session,
+    formulaire et création de la commande restent synchrones (thread)
+    '''
+    reponse, commande, contexte, nouvelle = await sync_to_async(_checkout_preparer)(request)
+    if commande is None:
+        return reponse
 
-        # Vider le panier
-        request.session['panier'] = {}
+    if not nouvelle:
+        # Attente courte sans bloquer la boucle, puis page d'attente si
+        # Moneroo n'a toujours pas répondu
+        await _attendre_paiement_async(commande.id)
+        return await sync_to_async(_paiement_en_preparation)(request, commande.id)
 
-        # Générer le lien WhatsApp
-        whatsapp_url = generer_message_whatsapp(commande)
+    try:
+        payment_url = await creer_paiement_moneroo_async(commande)
+    except Exception as e:
+        logger.exception("Erreur lors de l'initialisation du paiement")
+        return await sync_to_async(_checkout_echec)(request, commande, contexte, e)
 
-        return render(request, 'formation/paiement_reussi.html', {
-            'commande': commande,
-            'whatsapp_url': whatsapp_url,
-            'email_envoye': True
-        })
+    if payment_url:
+        return redirect(payment_url)
+    return await sync_to_async(_checkout_echec)(request, commande, contexte)
 
-    # CAS 2 : Le paiement n'a pas encore été traité - Traiter maintenant
-    # En mode Sandbox, on fait confiance au paramètre paymentStatus de Moneroo
-    payment_status = request.GET.get('paymentStatus', '').lower()
-    payment_id = request.GET.get('paymentId', '')
 
-    print(f"[CALLBACK] paymentStatus : {payment_status}")
-    print(f"[CALLBACK] paymentId : {payment_id}")
+async def _attendre_paiement_async(commande_id):
+    '''Attend au plus CHECKOUT_ATTENTE_REPRISE secondes l'URL initialisée par une autre requête'''
+    limite = time.monotonic() + settings.CHECKOUT_ATTENTE_REPRISE
+    while await sync_to_async(_url_paiement_initialise)(commande_id) == '':
+        if time.monotonic() >= limite:
+            return
+        await asyncio.sleep(ATTENTE_REPRISE_INTERVALLE)
+
+
+async def paiement_callback_async_view(request, commande_id):
+    '''Version ASGI de paiement_callback_view'''
+    try:
+        commande = await Commande.objects.with_details().aget(id=commande_id)
+    except Commande.DoesNotExist:
+        raise Http404("Commande introuvable")
+    payment_status = await _statut_callback_async(commande)
+    return await sync_to_async(_traiter_callback)(request, commande, payment_status)
+
+
+def _paiement_reussi(request, commande):
+    # Vider le panier
+    Panier(request).vider()
+
+    # Générer le lien WhatsApp
+    whatsapp_url = generer_message_whatsapp(commande)
+
+    return render(request, 'formation/paiement_reussi.html', {
+        'commande': commande,
+        'whatsapp_url': whatsapp_url,
+        'email_envoye': True
+    })
 
-    if payment_status in ['success', 'successful', 'paid', 'completed']:
-        print(f"✅ [CALLBACK] Paiement confirmé par Moneroo - Traitement")
 
-        # Marquer la commande comme payée
-        commande.marquer_comme_paye()
+def _statut_callback(commande):
+    '''
+    Statut du paiement vérifié auprès de Moneroo (cache partagé avec le
+    webhook) ; le paramètre paymentStatus de l'URL de retour n'est pas
+    une preuve de paiement. None si la commande est déjà traitée
+    '''
+    if commande.statut in ('paye', 'acces_envoye'):
+        return None
+    return statut_verifie(commande.moneroo_transaction_id) or ''
 
-        # Envoyer les accès par email
-        email_envoye = envoyer_acces_formation_email(commande)
 
-        if email_envoye:
-            commande.marquer_acces_envoye()
-            messages.success(request, '✅ Vos accès ont été envoyés par email !')
-            print(f"✅ [CALLBACK] Email envoyé à {commande.client.email}")
-        else:
-            messages.warning(request, '⚠️ Paiement confirmé. Les accès seront envoyés sous peu.')
-            print(f"⚠️  [CALLBACK] Échec envoi email")
+async def _statut_callback_async(commande):
+    '''Variante asynchrone de _statut_callback : la vérification n'occupe aucun thread'''
+    if commande.statut in ('paye', 'acces_envoye'):
+        return None
+    return await statut_verifie_async(commande.moneroo_transaction_id) or ''
 
-        # Vider le panier
-        request.session['panier'] = {}
 
-        # Générer le lien WhatsApp
-        whatsapp_url = generer_message_whatsapp(commande)
+def _traiter_callback(request, commande, payment_status):
+    '''Traitement du retour Moneroo, partagé avec la vue async'''
+    lier_commande(commande.id)
+    logger.info("Callback de paiement reçu", extra={'statut': commande.statut})
+    logger.debug("Callback : paramètres %s", request.GET)
 
-        return render(request, 'formation/paiement_reussi.html', {
-            'commande': commande,
-            'whatsapp_url': whatsapp_url,
-            'email_envoye': email_envoye
-        })
+    # CAS 1 : Le webhook a déjà marqué la commande comme payée
+    if commande.statut == 'paye' or commande.statut == 'acces_envoye':
+        logger.info("Callback : commande déjà traitée par le webhook")
+        messages.success(request, '✅ Paiement confirmé ! Vos accès ont été envoyés par email.')
+        return _paiement_reussi(request, commande)
+
+    # CAS 2 : Le paiement n'a pas encore été traité - Traiter maintenant
+    logger.info(
+        "Callback : statut vérifié %s", payment_status,
+        extra={'payment_status': payment_status, 'statut_annonce': request.GET.get('paymentStatus', '')}
+    )
+
+    if payment_status in STATUTS_PAYES:
+
+        # Marquer la commande comme payée et programmer l'email d'accès
+        with transaction.atomic():
+            if commande.marquer_comme_paye(origine='callback'):
+                mettre_en_file_acces(commande.id)
+
+        messages.success(request, '✅ Paiement confirmé ! Vos accès arrivent par email dans quelques instants.')
+        logger.info("Callback : paiement confirmé, email d'accès mis en file")
+        return _paiement_reussi(request, commande)
 
     # CAS 3 : Paiement échoué ou annulé
-    elif payment_status in ['failed', 'cancelled', 'canceled', 'declined']:
-        print(f"❌ [CALLBACK] Paiement échoué : {payment_status}")
-        commande.statut = 'annule'
-        commande.save()
+    elif payment_status in STATUTS_ECHOUES:
+        logger.warning("Callback : paiement échoué (%s)", payment_status)
+        commande.marquer_comme_annule(origine='callback')
         messages.error(request, 'Le paiement a été annulé ou a échoué.')
         return redirect('catalogue')
 
-    # CAS 4 : Statut inconnu ou pas de paymentStatus
+    # CAS 4 : Paiement en attente, ou Moneroo injoignable
     else:
-        print(f"⚠️  [CALLBACK] Statut inconnu ou manquant : {payment_status}")
+        logger.warning("Callback : paiement non confirmé (%r)", payment_status)
         messages.warning(request, 'Le paiement est en cours de traitement. Veuillez patienter quelques instants.')
         return redirect('catalogue')
 
@@ -200,6 +395,121 @@ def confirmation_view(request):
     return render(request, 'formation/confirmation.html')
 
 
+# Champs exposés par l'API (jamais les liens d'accès payants)
+CHAMPS_API = ('id', 'titre', 'description', 'prix', 'image', 'date_creation', 'date_modification')
+CHAMPS_API_DEFAUT = ('id', 'titre', 'prix', 'image', 'date_creation')
+LIMITE_API_DEFAUT = 20
+LIMITE_API_MAX = 100
+
+
+def _encoder_curseur(date_creation, formation_id):
+    brut = f'{date_creation.isoformat()}|{formation_id}'.encode('utf-8')
+    return base64.urlsafe_b64encode(brut).decode('ascii').rstrip('=')
+
+
+def _decoder_curseur(curseur):
+    '''Retourne (date_creation, id) ; ValueError si le curseur est invalide'''
+    try:
+        brut = base64.urlsafe_b64decode(curseur + '=' * (-len(curseur) % 4)).decode('utf-8')
+        date_iso, formation_id = brut.split('|')
+        return datetime.fromisoformat(date_iso), int(formation_id)
+    except (TypeError, ValueError, UnicodeDecodeError, binascii.Error):
+        raise ValueError("Curseur invalide")
+
+
+def _etag_api_formations(request):
+    '''Le contenu ne dépend que de la version du catalogue et des paramètres'''
+    parametres = hashlib.sha256(request.GET.urlencode().encode('utf-8')).hexdigest()[:12]
+    return f'{version_catalogue()}-{parametres}'
+
+
+@gzip_page
+@cache_control(public=True, no_cache=True)
+@condition(etag_func=_etag_api_formations)
+@require_http_methods(["GET", "HEAD"])
+def api_formations_view(request):
+    '''
+    Catalogue en JSON, paginé par curseur sur (date_creation, id) décroissants
+    Paramètres : ?limite=20 (max 100), ?curseur=<valeur de "suivant">,
+    ?fields=id,titre,prix (projection ; description exclue par défaut)
+    '''
+    champs = request.GET.get('fields')
+    champs = tuple(c.strip() for c in champs.split(',') if c.strip()) if champs else CHAMPS_API_DEFAUT
+    inconnus = [c for c in champs if c not in CHAMPS_API]
+    if inconnus:
+        return JsonResponse(
+            {'erreur': f"Champ(s) inconnu(s) : {', '.join(inconnus)}", 'champs': CHAMPS_API},
+            status=400
+        )
+
+    try:
+        limite = min(max(int(request.GET.get('limite', LIMITE_API_DEFAUT)), 1), LIMITE_API_MAX)
+    except ValueError:
+        return JsonResponse({'erreur': "Paramètre limite invalide"}, status=400)
+
+    formations = Formation.objects.filter(active=True).order_by('-date_creation', '-id')
+    if request.GET.get('curseur'):
+        try:
+            date_creation, formation_id = _decoder_curseur(request.GET['curseur'])
+        except ValueError as e:
+            return JsonResponse({'erreur': str(e)}, status=400)
+        formations = formations.filter(
+            Q(date_creation__lt=date_creation) | Q(date_creation=date_creation, id__lt=formation_id)
+        )
+
+    # Une ligne de plus que la page pour savoir s'il existe une page suivante
+    colonnes = set(champs) | {'id', 'date_creation'}
+    lignes = list(formations.values(*colonnes)[:limite + 1])
+    page, reste = lignes[:limite], lignes[limite:]
+
+    stockage_images = Formation._meta.get_field('image').storage
+    resultats = []
+    for ligne in page:
+        if 'image' in champs:
+            ligne['image'] = stockage_images.url(ligne['image']) if ligne['image'] else None
+        resultats.append({champ: ligne[champ] for champ in champs})
+
+    suivant = None
+    if reste:
+        parametres = request.GET.copy()
+        parametres['curseur'] = _encoder_curseur(page[-1]['date_creation'], page[-1]['id'])
+        suivant = request.build_absolute_uri(f'{request.path}?{parametres.urlencode()}')
+
+    return JsonResponse({'resultats': resultats, 'suivant': suivant})
+
+
+@staff_member_required
+def moneroo_stats_view(request):
+    '''Statistiques du client Moneroo de ce worker (latences, pool, disjoncteur)'''
+    return JsonResponse(get_client().stats())
+
+
+def metrics_view(request):
+    '''
+    Métriques de ce worker au format Prometheus
+    Accès : en-tête "Authorization: Bearer <METRICS_TOKEN>" ou membre du staff
+    '''
+    jeton = settings.METRICS_TOKEN
+    autorisation = request.headers.get('Authorization', '')
+    autorise = (
+        # Comparaison en octets : compare_digest refuse les chaînes non ASCII
+        (jeton and hmac.compare_digest(autorisation.encode(), f'Bearer {jeton}'.encode()))
+        or (request.user.is_authenticated and request.user.is_staff)
+    )
+    if not autorise:
+        return HttpResponseForbidden("Accès refusé")
+
+    contenu = registre.exposer()
+    stats = get_client().stats()
+    contenu += (
+        '# TYPE formation_moneroo_pool_connexions_creees counter\n'
+        f'formation_moneroo_pool_connexions_creees {stats["pool"]["connexions_creees"]}\n'
+        '# TYPE formation_moneroo_circuit_ouvert gauge\n'
+        f'formation_moneroo_circuit_ouvert {int(stats["circuit"] != "ferme")}\n'
+    )
+    return HttpResponse(contenu, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 @csrf_exempt
 def create_superuser_temp(request):
     """Vue temporaire pour créer un superuser"""
@@ -234,104 +544,29 @@ def create_superuser_temp(request):
 def moneroo_webhook(request):
     """
     Webhook Moneroo - Compatible Sandbox (sans secret) et Production (avec secret)
+    Le webhook est vérifié puis enregistré, et Moneroo reçoit sa réponse
+    aussitôt : le worker traiter_webhooks l'applique ensuite
     """
     if request.method != "POST":
         return JsonResponse({"error": "Méthode non autorisée"}, status=405)
 
-    raw_body = request.body
-    print("🔔 WEBHOOK MONEROO REÇU")
-    print("=" * 60)
-
-    # Validation de signature (uniquement si secret configuré)
-    webhook_secret = getattr(settings, 'MONEROO_WEBHOOK_SECRET', '')
-
-    if webhook_secret:
-        received_signature = request.headers.get('X-Moneroo-Signature', '')
-        if not received_signature:
-            print("⚠️  Pas de signature X-Moneroo-Signature")
-            return JsonResponse({"error": "Signature manquante"}, status=401)
-
-        expected_signature = hmac.new(
-            webhook_secret.encode('utf-8'),
-            raw_body,
-            hashlib.sha256
-        ).hexdigest()
-
-        if not hmac.compare_digest(expected_signature, received_signature):
-            print("🔴 SIGNATURE INVALIDE !")
-            return JsonResponse({"error": "Signature invalide"}, status=403)
-
-        print("✅ Signature validée")
-    else:
-        print("⚠️  Mode SANDBOX : Validation de signature désactivée")
-
-    # Parse JSON
     try:
-        payload = json.loads(raw_body.decode('utf-8'))
-        print(f"📦 Payload : {json.dumps(payload, indent=2)}")
-    except json.JSONDecodeError as e:
-        print(f"❌ ERREUR JSON : {e}")
-        return JsonResponse({"error": "JSON invalide"}, status=400)
-
-    # Extraction des données
-    event_type = payload.get("event", "")
-    payment_data = payload.get("data", {})
-    metadata = payment_data.get("metadata") or payload.get("metadata", {})
-
-    commande_id = (
-            metadata.get("commande_id") or
-            metadata.get("commandeId") or
-            payload.get("commande_id")
-    )
+        recu = preparer_reception(request)
+    except WebhookInvalide as e:
+        return JsonResponse({"error": e.message}, status=e.status)
+    recu.save()
+    return JsonResponse({"message": "Webhook reçu"}, status=200)
 
-    status = (
-            payment_data.get("status", "") or
-            payload.get("status", "")
-    ).lower()
 
-    print(f"📋 Type événement : {event_type}")
-    print(f"📋 Statut paiement : {status}")
-    print(f"📋 Commande ID : {commande_id}")
-
-    if not commande_id:
-        print("❌ ERREUR : commande_id manquant")
-        return JsonResponse({"error": "commande_id manquant"}, status=400)
+@csrf_exempt
+async def moneroo_webhook_async(request):
+    '''Version ASGI de moneroo_webhook : un seul INSERT attendu sur la boucle'''
+    if request.method != "POST":
+        return JsonResponse({"error": "Méthode non autorisée"}, status=405)
 
-    # Récupération de la commande
     try:
-        commande = Commande.objects.get(id=commande_id)
-        print(f"✅ Commande #{commande.id} trouvée - Statut: {commande.statut}")
-    except Commande.DoesNotExist:
-        print(f"❌ Commande #{commande_id} introuvable")
-        return JsonResponse({"error": "Commande introuvable"}, status=404)
-
-    # Vérification des doublons
-    if commande.statut == 'paye' and status in ["success", "paid", "completed", "successful"]:
-        print(f"⚠️  Commande déjà PAYÉE - Webhook ignoré")
-        return JsonResponse({"message": "Paiement déjà traité"}, status=200)
-
-    # Mise à jour du statut
-    if status in ["success", "paid", "completed", "successful"]:
-        commande.marquer_comme_paye()
-        print(f"✅ Commande #{commande.id} marquée comme PAYÉE")
-
-        email_envoye = envoyer_acces_formation_email(commande)
-        if email_envoye:
-            commande.marquer_acces_envoye()
-            print(f"✅ Email envoyé à {commande.client.email}")
-
-        return JsonResponse({
-            "message": "Paiement confirmé",
-            "commande_id": commande.id,
-            "email_envoye": email_envoye
-        }, status=200)
-
-    elif status in ["failed", "cancelled", "canceled", "declined"]:
-        commande.statut = 'annule'
-        commande.save()
-        print(f"❌ Commande #{commande.id} ANNULÉE")
-        return JsonResponse({"message": "Paiement échoué"}, status=200)
-
-    else:
-        print(f"ℹ️  Statut ignoré : {status}")
-        return JsonResponse({"message": f"Statut ignoré: {status}"}, status=200)
\ No newline at end of file
+        recu = preparer_reception(request)
+    except WebhookInvalide as e:
+        return JsonResponse({"error": e.message}, status=e.status)
+    await recu.asave()
+    return JsonResponse({"message": "Webhook reçu"}, status=200)
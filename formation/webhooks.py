@@ -0,0 +1,360 @@
+'''
+Webhooks Moneroo, traités en deux temps
+1. la vue vérifie la signature, enregistre le corps brut et les en-têtes
+   dans WebhookRecu (un seul INSERT) et répond aussitôt à Moneroo
+2. la commande traiter_webhooks applique les webhooks reçus par lots,
+   partitionnés par commande : les webhooks d'une même commande sont
+   appliqués l'un après l'autre, dans l'ordre de réception, ceux de
+   commandes différentes en parallèle
+Les webhooks traités sont purgés après WEBHOOK_RETENTION_JOURS (le
+dédoublonnage repose sur WebhookEvent, qui est conservé)
+'''
+import hashlib
+import hmac
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction, IntegrityError
+from django.db.models import Exists, OuterRef
+from django.db.models.functions import Mod
+from django.utils import timezone
+
+from .logs import lier_commande
+from .models import Commande, WebhookEvent, WebhookRecu
+from .outbox import mettre_en_file_acces
+from .utils import STATUTS_PAYES, STATUTS_ECHOUES
+from .verification import statut_verifie
+
+
+logger = logging.getLogger(__name__)
+
+# En-têtes conservés avec le corps (diagnostic, rejeu)
+EN_TETES_CONSERVES = ('Content-Type', 'User-Agent', 'X-Moneroo-Signature', 'X-Request-ID')
+
+# Durée pendant laquelle un lot réservé par un worker est invisible des autres
+DUREE_RESERVATION = timedelta(minutes=5)
+
+
+class PaiementNonConfirme(Exception):
+    '''Moneroo ne confirme pas (encore) le statut annoncé : nouvel essai plus tard'''
+
+
+class WebhookInvalide(Exception):
+    '''
+    Webhook inexploitable : refusé dès la réception (signature, JSON,
+    commande_id manquant), ou mis en erreur sans nouvel essai par le
+    worker (paiement jamais initialisé). Une commande inconnue n'est pas
+    une erreur : le webhook est traité avec le résultat 'introuvable'
+    '''
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def verifier_signature(raw_body, signature):
+    '''Sans MONEROO_WEBHOOK_SECRET (sandbox), la signature n'est pas vérifiée'''
+    webhook_secret = getattr(settings, 'MONEROO_WEBHOOK_SECRET', '')
+    if not webhook_secret:
+        logger.debug("Webhook : mode sandbox, signature non vérifiée")
+        return
+
+    if not signature:
+        logger.warning("Webhook : pas de signature X-Moneroo-Signature")
+        raise WebhookInvalide("Signature manquante", status=401)
+
+    attendue = hmac.new(webhook_secret.encode('utf-8'), raw_body, hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(attendue, signature):
+        logger.error("Webhook : signature invalide")
+        raise WebhookInvalide("Signature invalide", status=403)
+
+
+def extraire_evenement(raw_body):
+    '''
+    Décode le corps d'un webhook : clé d'idempotence, type, statut de
+    paiement et commande. Lève WebhookInvalide s'il est inexploitable
+    '''
+    try:
+        payload = json.loads(raw_body.decode('utf-8'))
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        logger.warning("Webhook : JSON invalide (%s)", e)
+        raise WebhookInvalide("JSON invalide")
+    if not isinstance(payload, dict):
+        raise WebhookInvalide("JSON invalide")
+
+    payment_data = payload.get("data") or {}
+    metadata = payment_data.get("metadata") or payload.get("metadata") or {}
+    commande_id = (
+            metadata.get("commande_id") or
+            metadata.get("commandeId") or
+            payload.get("commande_id")
+    )
+    status = (payment_data.get("status", "") or payload.get("status", "")).lower()
+
+    if not commande_id:
+        logger.warning("Webhook : commande_id manquant")
+        raise WebhookInvalide("commande_id manquant")
+    try:
+        commande_id = int(commande_id)
+    except (TypeError, ValueError):
+        raise WebhookInvalide("commande_id invalide")
+
+    return {
+        'cle': cle_evenement_webhook(payload, raw_body, status),
+        'type': payload.get("event", ""),
+        'statut': status,
+        'commande_id': commande_id,
+    }
+
+
+def cle_evenement_webhook(payload, raw_body, status):
+    '''
+    Clé d'idempotence d'un webhook Moneroo : identifiant de l'événement ou du
+    paiement + statut, ou à défaut l'empreinte du corps brut
+    '''
+    payment_data = payload.get("data") or {}
+    identifiant = payload.get("id") or payment_data.get("id")
+    if identifiant:
+        return f"{payload.get('event', '')}:{identifiant}:{status}"[:255]
+    return "sha256:" + hashlib.sha256(raw_body).hexdigest()
+
+
+def preparer_reception(request):
+    '''
+    Premier temps : contrôle le webhook et retourne la ligne WebhookRecu à
+    enregistrer (non sauvegardée, pour que la vue async utilise asave)
+    Lève WebhookInvalide si Moneroo doit être informé d'un refus
+    '''
+    raw_body = request.body
+    logger.info("Webhook Moneroo reçu", extra={'taille': len(raw_body)})
+
+    verifier_signature(raw_body, request.headers.get('X-Moneroo-Signature', ''))
+    evenement = extraire_evenement(raw_body)
+    lier_commande(evenement['commande_id'])
+    logger.info(
+        "Webhook : événement %s, statut %s mis en file", evenement['type'], evenement['statut'],
+        extra={'evenement': evenement['type'], 'statut': evenement['statut']}
+    )
+
+    return WebhookRecu(
+        corps=raw_body,
+        entetes={nom: request.headers[nom] for nom in EN_TETES_CONSERVES if nom in request.headers},
+        commande_id=evenement['commande_id'],
+    )
+
+
+def statut_confirme(commande_id, annonce):
+    '''
+    Statut du paiement de la commande vérifié auprès de Moneroo (cache et
+    single-flight partagés avec le callback), à la place du statut annoncé
+    par le webhook. Lève PaiementNonConfirme si Moneroo ne le confirme pas
+    '''
+    transactions = list(
+        Commande.objects.filter(id=commande_id).values_list('moneroo_transaction_id', flat=True)[:1]
+    )
+    if not transactions:
+        return annonce  # commande introuvable, signalé par appliquer_evenement
+    if not transactions[0]:
+        raise WebhookInvalide("Paiement jamais initialisé : statut invérifiable")
+
+    statut = statut_verifie(transactions[0])
+    if statut not in STATUTS_PAYES and statut not in STATUTS_ECHOUES:
+        raise PaiementNonConfirme(f"statut annoncé {annonce!r}, statut Moneroo {statut!r}")
+    return statut
+
+
+def appliquer_evenement(evenement):
+    '''
+    Applique la transition portée par un webhook ; retourne le résultat
+    ('paye', 'annule', 'inchange', 'ignore', 'deja_traite', 'introuvable')
+    '''
+    cle, status, commande_id = evenement['cle'], evenement['statut'], evenement['commande_id']
+
+    # Chemin rapide : événement déjà vu, aucune commande chargée
+    if WebhookEvent.objects.filter(cle=cle).exists():
+        logger.info("Webhook : événement %s déjà traité", cle)
+        return 'deja_traite'
+
+    if status in STATUTS_PAYES or status in STATUTS_ECHOUES:
+        status = statut_confirme(commande_id, status)
+
+    try:
+        with transaction.atomic():
+            # Transitions par UPDATE conditionnel : seul le premier chemin
+            # (webhook ou callback) qui change le statut met l'email en file
+            if status in STATUTS_PAYES:
+                modifie = Commande.objects.filter(id=commande_id).marquer_comme_paye(origine='webhook')
+                if modifie:
+                    mettre_en_file_acces(commande_id)
+                resultat = 'paye' if modifie else 'inchange'
+            elif status in STATUTS_ECHOUES:
+                modifie = Commande.objects.filter(id=commande_id).marquer_comme_annule(origine='webhook')
+                resultat = 'annule' if modifie else 'inchange'
+            else:
+                modifie = 0
+                resultat = 'ignore'
+
+            if not modifie and not Commande.objects.filter(id=commande_id).exists():
+                logger.warning("Webhook : commande introuvable")
+                return 'introuvable'
+
+            WebhookEvent.objects.create(
+                cle=cle,
+                type_evenement=evenement['type'][:100],
+                statut_paiement=status[:50],
+                commande_id=commande_id,
+            )
+    except IntegrityError:
+        # Redélivrance traitée en parallèle (autre worker) : déjà appliquée
+        logger.info("Webhook : événement %s traité en parallèle", cle)
+        return 'deja_traite'
+
+    logger.info("Webhook : %s (statut %s)", resultat, status)
+    return resultat
+
+
+def reserver_lot(taille, partition=0, partitions=1):
+    '''
+    Réserve les webhooks dus les plus anciens, de la partition demandée
+    (commande_id modulo partitions) : deux workers de partitions
+    différentes ne traitent jamais la même commande
+    Un webhook attend tant qu'un webhook antérieur de la même commande est
+    replanifié (ou réservé) : les événements d'une commande sont appliqués
+    dans l'ordre de réception, même après un échec
+    '''
+    maintenant = timezone.now()
+    anterieurs_en_attente = WebhookRecu.objects.filter(
+        commande_id=OuterRef('commande_id'),
+        id__lt=OuterRef('id'),
+        statut='recu',
+        prochaine_tentative__gt=maintenant,
+    )
+    recus = (
+        WebhookRecu.objects
+        .filter(statut='recu', prochaine_tentative__lte=maintenant)
+        .exclude(Exists(anterieurs_en_attente))
+    )
+    if partitions > 1:
+        recus = recus.alias(partition=Mod('commande_id', partitions)).filter(partition=partition)
+    with transaction.atomic():
+        ids = list(
+            recus
+            .select_for_update(skip_locked=True)
+            .order_by('id')
+            .values_list('id', flat=True)[:taille]
+        )
+        WebhookRecu.objects.filter(id__in=ids).update(prochaine_tentative=maintenant + DUREE_RESERVATION)
+    return list(WebhookRecu.objects.filter(id__in=ids).order_by('id'))
+
+
+def traiter_lot(taille=None, threads=1, partition=0, partitions=1):
+    '''
+    Second temps : applique un lot de webhooks reçus
+    Le lot est découpé en `threads` tranches par commande_id ; chaque
+    tranche est traitée dans l'ordre de réception par un thread
+    Retourne le couple (nombre traités, nombre en échec)
+    '''
+    lot = reserver_lot(taille or settings.WEBHOOK_TAILLE_LOT, partition, partitions)
+    if not lot:
+        return 0, 0
+
+    tranches = [[] for _ in range(max(threads, 1))]
+    for recu in lot:
+        tranches[recu.commande_id % len(tranches)].append(recu)
+    tranches = [tranche for tranche in tranches if tranche]
+
+    if len(tranches) == 1:
+        resultats = [traiter_tranche(tranches[0])]
+    else:
+        with ThreadPoolExecutor(max_workers=len(tranches)) as pool:
+            resultats = list(pool.map(traiter_tranche_thread, tranches))
+
+    traites = sum(resultats)
+    return traites, len(lot) - traites
+
+
+def traiter_tranche(recus):
+    '''
+    Applique une tranche dans l'ordre de réception ; après un échec, les
+    webhooks suivants de la même commande sont remis en file derrière lui
+    '''
+    traites, bloquees, reportes = 0, set(), []
+    for recu in recus:
+        if recu.commande_id in bloquees:
+            reportes.append(recu.id)
+        elif appliquer_recu(recu):
+            traites += 1
+        else:
+            bloquees.add(recu.commande_id)
+    if reportes:
+        # Fin de réservation : reserver_lot les reprendra après le webhook en échec
+        WebhookRecu.objects.filter(id__in=reportes).update(prochaine_tentative=timezone.now())
+    return traites
+
+
+def traiter_tranche_thread(recus):
+    try:
+        return traiter_tranche(recus)
+    finally:
+        # Chaque thread a ouvert sa propre connexion
+        connection.close()
+
+
+def appliquer_recu(recu):
+    '''
+    Applique un webhook reçu et enregistre le résultat ; False en cas d'échec
+    Pas de transaction englobante : la vérification auprès de Moneroo
+    (appel HTTP) précède la courte transaction d'appliquer_evenement. Si le
+    worker s'arrête avant d'enregistrer le résultat, le webhook rejoué est
+    reconnu par WebhookEvent ('deja_traite')
+    '''
+    lier_commande(recu.commande_id)
+    try:
+        evenement = extraire_evenement(bytes(recu.corps))
+        recu.resultat = appliquer_evenement(evenement)
+        recu.statut = 'traite'
+        recu.tentatives += 1
+        recu.date_traitement = timezone.now()
+        recu.derniere_erreur = ''
+        recu.save(update_fields=['resultat', 'statut', 'tentatives', 'date_traitement', 'derniere_erreur'])
+    except Exception as e:
+        enregistrer_echec(recu, e)
+        return False
+    return True
+
+
+def enregistrer_echec(recu, erreur):
+    '''Replanifie un webhook avec backoff, ou le met en erreur (corps inexploitable, trop d'échecs)'''
+    recu.tentatives += 1
+    recu.derniere_erreur = f"{type(erreur).__name__}: {erreur}"
+    logger.warning(
+        "Échec du traitement du webhook #%s (tentative %d) : %s", recu.id, recu.tentatives, recu.derniere_erreur,
+        extra={'commande_id': recu.commande_id}
+    )
+    if isinstance(erreur, WebhookInvalide) or recu.tentatives >= settings.WEBHOOK_MAX_TENTATIVES:
+        recu.statut = 'erreur'
+    else:
+        secondes = settings.WEBHOOK_DELAI_BASE * (2 ** (recu.tentatives - 1))
+        recu.prochaine_tentative = timezone.now() + timedelta(seconds=min(secondes, settings.WEBHOOK_DELAI_MAX))
+    recu.save(update_fields=['tentatives', 'derniere_erreur', 'statut', 'prochaine_tentative'])
+
+
+def purger_traites(taille=None):
+    '''
+    Supprime, par lots parcourus par clé, les webhooks traités depuis plus
+    de WEBHOOK_RETENTION_JOURS ; ceux en erreur restent pour diagnostic
+    Retourne le nombre de webhooks supprimés
+    '''
+    taille = taille or settings.WEBHOOK_TAILLE_LOT
+    limite = timezone.now() - timedelta(days=settings.WEBHOOK_RETENTION_JOURS)
+    anciens = WebhookRecu.objects.filter(statut='traite', date_traitement__lt=limite).order_by('id')
+    total, dernier_id = 0, 0
+    while ids := list(anciens.filter(id__gt=dernier_id).values_list('id', flat=True)[:taille]):
+        dernier_id = ids[-1]
+        supprimes, _ = WebhookRecu.objects.filter(id__in=ids).delete()
+        total += supprimes
+    return total